@@ -1,16 +1,22 @@
 import streamlit as st
 import numpy as np
-import pandas as pd
 from datetime import datetime
 import os
-from google.cloud import bigquery
 from streamlit_folium import folium_static
-import folium
 import requests
 from bokeh.models.widgets import Button
 from bokeh.models import CustomJS
 from streamlit_bokeh_events import streamlit_bokeh_events
-from branca.element import Template, MacroElement
+
+from taxi_compass.predictions import get_prediction_cache
+from taxi_compass.stand_map import stand_map
+from taxi_compass.stands import get_stand_cache
+
+TSFINDER_URL = 'https://us-central1-taxi-compass-lewagon.cloudfunctions.net/tsfinder'
+
+# 'local' finds the nearest taxi stands in this process, 'remote' asks the
+# tsfinder cloud function (also the fallback when the local lookup fails)
+STAND_LOOKUP = os.environ.get('TAXI_COMPASS_STAND_LOOKUP', 'local')
 
 
 def random_location_in_sg():
@@ -40,67 +46,47 @@ def trigger_prediction_in_GCP():
     st.write(r.text)
 
 
-# @st.cache()
 def SQL_prediction_date():
     '''
-    Upon starting, take the distinct available dates for prediction.
-    This function needs only to be ran once, so cacheing it allows for
-    faster times anytime we interact with the streamlit page.
+    The distinct dates still ahead with predictions available.
+    All the predictions live in a process wide cache shared by every session
+    (see taxi_compass.predictions), reloaded only when the prediction job
+    wrote new ones, so this is an in memory lookup, not a query.
     '''
-    QUERY_PREDICTION_TIME = f"""
-    Select distinct(datetime(timestamp(timestamp_pred,"Asia/Singapore"), "Asia/Singapore")) as pred_dates, timestamp_pred
-    from `taxi-compass-lewagon.api_dataset.r_taxi_stand_pred`
-    where timestamp(timestamp_pred,"Asia/Singapore") > current_timestamp()
-    order by pred_dates asc
-    """
-    query_job = bigquery_client.query(QUERY_PREDICTION_TIME)
-    query_df = query_job.to_dataframe()
-    return query_df
-
-def SQL_Query(taxi_stands_string):
+    return get_prediction_cache().get().prediction_dates()
+
+def nearby_taxi_stands(lat, lon, taxi_length):
     '''
-    Takes a taxi_stand_list and performs a query on the latest
-    predictions on taxi_stand occupation
+    Ids of the taxi_length taxi stands nearest to lat, lon, nearest first.
+
+    The taxi stands and their KD-tree are loaded once per process (see
+    taxi_compass.stands.get_stand_cache), so this takes microseconds instead
+    of a round trip to the tsfinder cloud function, which is only called
+    when STAND_LOOKUP is 'remote' or the local lookup fails.
     '''
-    taxi_stand_tuple = tuple(taxi_stands_string.split('-'))
-
-    QUERY_TS_LIST = f"""
-    SELECT timestamp, ts_id, lat, lon, taxi_count
-    FROM `taxi-compass-lewagon.api_dataset.h_taxi_stand_taxi_count`
-    WHERE ts_id in {taxi_stand_tuple}
-    ORDER BY timestamp DESC
-    LIMIT {len(taxi_stand_tuple)}
-    """
-
-    QUERY_TS_PRED =f"""
-    SELECT p.taxi_st_id as ts_id, p.taxi_count_pred as prediction, p.timestamp_pred as timestamp_pred,
-    c.taxi_st_lat as latitude, c.taxi_st_lon as longitude
-    FROM `taxi-compass-lewagon.api_dataset.r_taxi_stand_pred` as p
-    LEFT JOIN `taxi-compass-lewagon.api_dataset.c_taxi_stand` as c
-    ON p.taxi_st_id = c.taxi_st_id
-    WHERE timestamp_pred = '{st.session_state.time_range}' AND p.taxi_st_id in {taxi_stand_tuple}
-    """
-
-    query_job = bigquery_client.query(QUERY_TS_PRED)
-    query_df = query_job.to_dataframe()
-    return query_df
-
-def color_guide(count):
+    if STAND_LOOKUP == 'local':
+        try:
+            _, index = get_stand_cache().get()
+            ts_ids, _ = index.nearest(np.float64(lat), np.float64(lon),
+                                      taxi_length)
+            return ts_ids.tolist()
+        except Exception as e:
+            print(f'local taxi stand lookup failed, asking tsfinder: {e!r}')
+    r = requests.post(TSFINDER_URL,
+                      json={
+                          "latitude": lat,
+                          "longitude": lon,
+                          "length": taxi_length
+                      })
+    return r.text.split('-')
+
+def SQL_Query(taxi_stands):
     '''
-    This function is used to simplify visually the results by
-    assigning colors to different predicted taxi count in each taxi stand.
+    Takes a taxi_stand_list and looks up the latest predictions on
+    taxi_stand occupation in the prediction cache
     '''
-    colors = {
-        0: 'lightgreen',
-        1: 'green',
-        2: 'green',
-        3: 'blue',
-        4: 'blue'
-    }
-    if count > 4:
-        return 'black'
-    else:
-        return colors[count]
+    return get_prediction_cache().get().lookup(taxi_stands,
+                                               st.session_state.time_range)
 
 # ------------------------------------------------------------------------- #
 # ----------------------  BIG QUERY SETUP --------------------------------- #
@@ -112,7 +98,6 @@ def color_guide(count):
 # '''
 bq_key_path = 'google-credentials.json'  ## Env variable in Heroku
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = bq_key_path
-bigquery_client = bigquery.Client(project='taxi-compass-lewagon')
 
 
 # ------------------------------------------------------------------------- #
@@ -131,11 +116,9 @@ if "coordinates" not in st.session_state:
 if "random_location" not in st.session_state:
     st.session_state.random_location = False
 
-if "prediction_date_df" not in st.session_state:
-    # st.session_state.prediction_date_df = pd.DataFrame({})
-    st.session_state.prediction_date_df = SQL_prediction_date()
-else:
-    pass
+# Read on every rerun: it comes from the shared prediction cache, so new
+# predictions show up without restarting the session
+st.session_state.prediction_date_df = SQL_prediction_date()
 
 if "time_range" not in st.session_state:
     st.session_state.time_range = ''
@@ -235,149 +218,19 @@ else:
 
             st.write(f'The following are your nearby taxi stands \
                         predicted taxi count'                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                             )
-            ## First get nearby taxi stands using the cloud function tsfinder:
-            ## Amount of taxi stands returned is computed on tsfinder cloud function
-            ## using taxi_length parameter in POST
-            r = requests.post(
-                'https://us-central1-taxi-compass-lewagon.cloudfunctions.net/tsfinder',
-                json={
-                    "latitude": st.session_state.coordinates[0],
-                    "longitude": st.session_state.coordinates[1],
-                    "length": taxi_length
-                })
-            ## Pass the list of $taxi_length nearby taxistands to perform the SQL Query
-            results_df = SQL_Query(r.text)
+            ## First get the $taxi_length nearby taxi stands, then their
+            ## predictions from the cache
+            taxi_stands = nearby_taxi_stands(st.session_state.coordinates[0],
+                                             st.session_state.coordinates[1],
+                                             taxi_length)
+            results_df = SQL_Query(taxi_stands)
 
             # ------------------------------------------------------------------ #
             # -------------------- CREATION OF FOLIUM MAP ---------------------- #
             # ------------------------------------------------------------------ #
+            # One GeoJSON layer for all the taxi stands, coloured by their
+            # prediction, plus the legend (see taxi_compass.stand_map)
 
-            m = folium.Map(location=[
-                st.session_state.coordinates[0], st.session_state.coordinates[1]
-            ],
-                        zoom_start=14,
-                        tiles='openstreetmap')
-
-            folium.Marker(
-                location=[
-                    st.session_state.coordinates[0],
-                    st.session_state.coordinates[1]
-                ],
-                popup='You are here',
-                icon=folium.Icon(color="red", icon="car", prefix='fa'),
-            ).add_to(m)
-
-            for index,row in results_df.iterrows():
-                folium.Marker(
-                    location=[row.latitude, row.longitude],
-                    popup=f'Predicted Taxi Count Here: {row.prediction}',
-                    icon=folium.Icon(color=color_guide(row.prediction),
-                                    icon="car"),
-                ).add_to(m)
-
-            # ------------------------------------------------------------------ #
-            # -------------------- HTML for FOLIUM LEGEND ---------------------- #
-            # ------------------------------------------------------------------ #
-
-            template = """
-{% macro html(this, kwargs) %}
-
-<!doctype html>
-<html lang="en">
-<head>
-  <meta charset="utf-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1">
-  <title>jQuery UI Draggable - Default functionality</title>
-  <link rel="stylesheet" href="//code.jquery.com/ui/1.12.1/themes/base/jquery-ui.css">
-
-  <script src="https://code.jquery.com/jquery-1.12.4.js"></script>
-  <script src="https://code.jquery.com/ui/1.12.1/jquery-ui.js"></script>
-
-  <script>
-  $( function() {
-    $( "#maplegend" ).draggable({
-                    start: function (event, ui) {
-                        $(this).css({
-                            right: "auto",
-                            top: "auto",
-                            bottom: "auto"
-                        });
-                    }
-                });
-});
-
-  </script>
-</head>
-<body>
-
-
-<div id='maplegend' class='maplegend'
-    style='position: absolute; z-index:9999; border:2px solid grey; background-color:rgba(255, 255, 255, 0.8);
-     border-radius:6px; padding: 10px; font-size:14px; right: 20px; bottom: 20px;'>
-
-<div class='legend-title'>Legend</div>
-<div class='legend-scale'>
-  <ul class='legend-labels'>
-    <li><span style='background:red;opacity:0.7;'></span>You</li>
-    <li><span style='background:lightgreen;opacity:0.7;'></span>No Taxis</li>
-    <li><span style='background:green;opacity:0.7;'></span>Few Taxis</li>
-    <li><span style='background:blue;opacity:0.7;'></span>Several Taxis</li>
-    <li><span style='background:black;opacity:0.7;'></span>Lots of Taxis</li>
-
-  </ul>
-</div>
-</div>
-
-</body>
-</html>
-
-<style type='text/css'>
-  .maplegend .legend-title {
-    text-align: left;
-    margin-bottom: 5px;
-    font-weight: bold;
-    font-size: 90%;
-    }
-  .maplegend .legend-scale ul {
-    margin: 0;
-    margin-bottom: 5px;
-    padding: 0;
-    float: left;
-    list-style: none;
-    }
-  .maplegend .legend-scale ul li {
-    font-size: 80%;
-    list-style: none;
-    margin-left: 0;
-    line-height: 18px;
-    margin-bottom: 2px;
-    }
-  .maplegend ul.legend-labels li span {
-    display: block;
-    float: left;
-    height: 16px;
-    width: 30px;
-    margin-right: 5px;
-    margin-left: 0;
-    border: 1px solid #999;
-    }
-  .maplegend .legend-source {
-    font-size: 80%;
-    color: #777;
-    clear: both;
-    }
-  .maplegend a {
-    color: #777;
-    }
-</style>
-{% endmacro %}"""
-
-            macro = MacroElement()
-            macro._template = Template(template)
-
-            # m.get_root().add_child(macro)
-            macro.add_to(m)
-
-            ###
+            m = stand_map(st.session_state.coordinates, results_df)
 
             folium_static(m)
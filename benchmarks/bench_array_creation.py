@@ -0,0 +1,40 @@
+'''
+Runtime of array_creation, original (mask + vstack/concat per stand) against
+the preallocated builder, for the usual 350 stands and for more stands.
+
+    python -m benchmarks.bench_array_creation
+'''
+import contextlib
+import io
+import json
+import time
+
+from benchmarks import reference
+from benchmarks.synthetic import get_data_frame
+from taxi_compass.features import array_creation, preprocessing
+
+
+def seconds(func, *args, **kwargs):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    for n_stands, minutes in ((350, 16), (350, 60), (2000, 60)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = preprocessing(
+                get_data_frame(n_stands=n_stands, minutes=minutes, missing=0))
+        print(json.dumps({
+            'benchmark': 'array_creation',
+            'stands': n_stands,
+            'minutes': minutes,
+            'seconds_before': round(
+                seconds(reference.array_creation, df, n_stands=n_stands), 4),
+            'seconds_after': round(seconds(array_creation, df), 4)
+        }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+Reading the last 16 minutes and a full day of counts for every taxi stand,
+from rows shaped like h_taxi_stand_taxi_count (filter + pivot) against the
+memory-mapped CountHistory, plus the bytes each of them keeps.
+
+    python -m benchmarks.bench_history
+'''
+import json
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from taxi_compass.history import CountHistory
+
+
+def rows_frame(n_stands, days, seed=0):
+    rng = np.random.default_rng(seed)
+    minutes = days * 24 * 60
+    timestamps = pd.date_range('2022-01-14', periods=minutes, freq='min')
+    return pd.DataFrame({
+        'ts_id': np.tile(np.char.add('kml_', np.arange(n_stands).astype(str)),
+                         minutes),
+        'lat': np.tile(1.3 + np.arange(n_stands) / 1000, minutes),
+        'lon': np.tile(103.8 + np.arange(n_stands) / 1000, minutes),
+        'taxi_count': rng.poisson(1.5, n_stands * minutes),
+        'timestamp': np.repeat(timestamps, n_stands)
+    })
+
+
+def from_rows(df, start, minutes):
+    start = pd.Timestamp(start)
+    rows = df[(df['timestamp'] >= start) &
+              (df['timestamp'] < start + pd.Timedelta(minutes=minutes))]
+    return rows.pivot(index='ts_id', columns='timestamp',
+                      values='taxi_count').to_numpy()
+
+
+def seconds(func, *args, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    n_stands, days = 350, 7
+    df = rows_frame(n_stands, days)
+    with tempfile.TemporaryDirectory() as root:
+        history = CountHistory(root)
+        history.import_frame(df)
+        for name, start, minutes in (('prediction_window',
+                                      '2022-01-20 12:00', 16),
+                                     ('training_day', '2022-01-19', 1440)):
+            np.testing.assert_array_equal(
+                from_rows(df, start, minutes),
+                history.window(start, minutes)[np.argsort(
+                    history.stands['ts_id'].to_numpy())])
+            print(json.dumps({
+                'benchmark': f'history_{name}',
+                'stands': n_stands,
+                'days_stored': days,
+                'seconds_before': round(seconds(from_rows, df, start,
+                                                minutes), 5),
+                'seconds_after': round(seconds(history.window, start,
+                                               minutes), 5)
+            }))
+        print(json.dumps({
+            'benchmark': 'history_bytes',
+            'stands': n_stands,
+            'days_stored': days,
+            'bytes_before': int(df.memory_usage(deep=True).sum()),
+            'bytes_after': sum(history.day(day).nbytes for day in
+                               pd.date_range('2022-01-14', periods=days))
+        }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''
+Throughput (rows/sec) of the local XGBoost backend against the JSON path.
+
+The JSON path is emulated with a local stub of the hosted model: the rows
+go through X.tolist() and json like predict_json sends them, the stub
+decodes them and runs the same booster. Network latency to ML Engine is
+not included, so the real gap is wider.
+
+    python -m benchmarks.bench_inference
+'''
+import json
+import time
+
+import numpy as np
+import requests
+
+from benchmarks.stub_server import StubServer
+from taxi_compass.inference import LocalPredictor
+
+
+def model_inputs(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack((rng.integers(1, 351, n), rng.poisson(1.5, n),
+                            rng.choice([0.0, 0.2, 1.4], n),
+                            rng.integers(0, 2, n), rng.integers(0, 2, n),
+                            rng.uniform(-1, 1, (n, 4)))).astype(np.float32)
+
+
+def stub_model_route(predictor):
+    def route(query, body):
+        instances = json.loads(body)['instances']
+        return 200, {'predictions': predictor.predict(instances).tolist()}
+
+    return route
+
+
+def rows_per_second(func, X, repeat=3):
+    best = min(timed(func, X) for _ in range(repeat))
+    return len(X) / best
+
+
+def timed(func, X):
+    start = time.perf_counter()
+    func(X)
+    return time.perf_counter() - start
+
+
+def main():
+    predictor = LocalPredictor()
+    routes = {'/predict': stub_model_route(predictor)}
+    with StubServer(routes) as stub:
+        session = requests.Session()
+
+        def json_path(X):
+            r = session.post(stub.url + '/predict',
+                             data=json.dumps({'instances': X.tolist()}))
+            return np.array(r.json()['predictions'])
+
+        for n_rows in (350 * 16, 350 * 60, 100000):
+            X = model_inputs(n_rows)
+            np.testing.assert_array_equal(json_path(X), predictor.predict(X))
+            print(json.dumps({
+                'benchmark': 'inference',
+                'rows': n_rows,
+                'rows_per_sec_json': round(rows_per_second(json_path, X)),
+                'rows_per_sec_local': round(
+                    rows_per_second(predictor.predict, X))
+            }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+'''
+Size of the map page and time to build and render it, for the nearby taxi
+stands of one click up to a city wide view.
+
+"before" is the map app.py used to build: a folium Marker and Icon per taxi
+stand from iterrows, and the legend template compiled again every rerun.
+"after" is taxi_compass.stand_map, one GeoJSON layer and a cached legend.
+Rendering is m.get_root().render(), what folium_static sends to the browser.
+
+    python -m benchmarks.bench_map
+'''
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import reference
+from benchmarks.replay import synthetic_stands
+from taxi_compass.stand_map import stand_map
+
+SIZES = (20, 200, 1000, 5000)
+USER = (1.3521, 103.8198)
+
+
+def results(n_stands, seed=0):
+    '''
+    results_df of SQL_Query for n_stands taxi stands
+    '''
+    rng = np.random.default_rng(seed)
+    ts_df = synthetic_stands(n_stands, seed)
+    return pd.DataFrame({
+        'ts_id': ts_df['ts_id'],
+        'prediction': rng.integers(0, 8, len(ts_df)).astype(np.float64),
+        'timestamp_pred': pd.Timestamp('2022-01-20 10:30'),
+        'latitude': ts_df['lat'],
+        'longitude': ts_df['lon']
+    })
+
+
+def render(build, results_df, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        html = build(USER, results_df).get_root().render()
+        timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1000, len(html.encode())
+
+
+def main():
+    stand_map(USER, results(1))  # compile the legend once, like a warm app
+    for n_stands in SIZES:
+        results_df = results(n_stands)
+        repeat = 5 if n_stands <= 1000 else 2
+        before_ms, before_bytes = render(reference.stand_map, results_df,
+                                         repeat)
+        after_ms, after_bytes = render(stand_map, results_df, repeat)
+        print(json.dumps({
+            'benchmark': 'stand_map',
+            'stands': n_stands,
+            'before_ms': round(before_ms, 2),
+            'after_ms': round(after_ms, 2),
+            'before_kb': round(before_bytes / 1024, 1),
+            'after_kb': round(after_bytes / 1024, 1),
+            'speedup': round(before_ms / after_ms, 1)
+        }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+'''
+End to end run of the pipeline on one box, timing every stage.
+
+The recorded feeds are replayed by the stub server and written to a
+temporary SQLite storage, one snapshot per minute, then the predictions are
+made from them and merged back:
+
+    ingest, every minute:  fetch (LTA pages over HTTP), assign (taxis to
+                           taxi stands, rainfall interpolated at them),
+                           write (counts, rainfall, mrt status)
+    predict, once:         read (get_data), preprocessing, array_creation,
+                           inference (local model), write_back (merge)
+
+Ingest stages are the mean seconds per snapshot, predict stages the seconds
+of the single run. Each configuration prints one json line.
+
+    python -m benchmarks.bench_pipeline                # recorded fleet
+    python -m benchmarks.bench_pipeline --scale        # 10k-100k taxis
+    python -m benchmarks.bench_pipeline --taxis 20000 --stands 1000
+    python -m benchmarks.bench_pipeline --output results.jsonl
+'''
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import tempfile
+import time
+
+# the benchmark runs the model in this process
+os.environ.setdefault('PREDICT_BACKEND', 'local')
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from benchmarks.replay import (MRT_LIST_PATH, fixture, lta_pages,  # noqa: E402
+                               replay_routes, replay_urls, synthetic_fleet,
+                               synthetic_stands)
+from benchmarks.stub_server import StubServer  # noqa: E402
+from googlebigquery import insert_predicted_count  # noqa: E402
+from taxi_compass.feeds import (MrtSchedule, load_mrt_list,  # noqa: E402
+                                rainfall_frame, stand_count_frame)
+from taxi_compass.geo import StandIndex  # noqa: E402
+from taxi_compass.lta import get_taxi_coordinates, make_session  # noqa: E402
+from taxi_compass.rainfall import RainfallWeights  # noqa: E402
+from taxi_compass.storage import SQLiteStorage  # noqa: E402
+from taxi_compass.writer import DEDUP_KEYS, BufferedWriter  # noqa: E402
+
+# (taxis, taxi stands) of --scale
+SCALES = ((10000, 350), (10000, 2000), (50000, 2000), (100000, 5000))
+
+CUTOFF_DISTANCE = 0.2
+MAX_STANDS_PER_TAXI = 10
+
+
+@contextlib.contextmanager
+def stage(timings, name):
+    '''
+    Add the seconds of the block to timings[name], without its prints
+    '''
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def static_tables(storage, ts_df):
+    '''
+    Taxi stand to mrt station table get_data joins with
+    '''
+    mrt_list = load_mrt_list(MRT_LIST_PATH)
+    storage.append(
+        'c_mrt_stn_taxi_stand',
+        pd.DataFrame({
+            'taxi_st_id': ts_df['ts_id'],
+            'mrt_stn': mrt_list['stn_id'].to_numpy()[
+                np.arange(len(ts_df)) % len(mrt_list)]
+        }))
+
+
+def run(n_taxis=None, n_stands=350, minutes=16, seed=0):
+    '''
+    One pipeline run, n_taxis=None replays the recorded LTA pages
+    '''
+    ts_df = synthetic_stands(n_stands, seed)
+    if n_taxis is None:
+        routes = replay_routes()
+        n_taxis = sum(len(page['value'])
+                      for page in fixture('lta_taxi_availability.json')
+                      ['pages'])
+    else:
+        routes = replay_routes(
+            lta_pages(synthetic_fleet(n_taxis, ts_df, seed=seed)))
+    max_pages = n_taxis // 500 + 2
+
+    now = datetime.datetime(2022, 1, 20, 2, 0)
+    now_sg = now + datetime.timedelta(hours=8)
+    ingest, predict, rows = {}, {}, {}
+    with tempfile.TemporaryDirectory() as tmp, StubServer(routes) as stub:
+        storage = SQLiteStorage(os.path.join(tmp, 'taxi_compass.db'))
+        writers = {
+            table: BufferedWriter(table, keys, storage, max_age=0,
+                                  spool_dir=os.path.join(tmp, 'spool'))
+            for table, keys in DEDUP_KEYS.items()
+        }
+        with contextlib.redirect_stdout(io.StringIO()):
+            static_tables(storage, ts_df)
+            schedule = MrtSchedule(load_mrt_list(MRT_LIST_PATH))
+        index = StandIndex.from_dataframe(ts_df)
+        weights = None
+        session = make_session()
+        urls = replay_urls(stub)
+        alerts = fixture('train_service_alerts.json')
+
+        for minute in range(minutes, 0, -1):
+            timestamp = now_sg - datetime.timedelta(minutes=minute,
+                                                    seconds=-20)
+            with stage(ingest, 'fetch'):
+                taxi_coords = get_taxi_coordinates(
+                    session, url=urls['lta_taxi_availability'],
+                    max_pages=max_pages)
+                rainfall = session.get(urls['rainfall']).json()
+            with stage(ingest, 'assign'):
+                counts = index.count_within(taxi_coords[:, 0],
+                                            taxi_coords[:, 1],
+                                            CUTOFF_DISTANCE,
+                                            MAX_STANDS_PER_TAXI)
+                stations = rainfall_frame(rainfall)
+                if weights is None:
+                    weights = RainfallWeights.from_frames(ts_df, stations)
+                snapshot = stand_count_frame(ts_df, counts, timestamp,
+                                             weights.interpolate(stations))
+            with stage(ingest, 'write'):
+                writers['h_taxi_stand_taxi_count'].write(snapshot)
+                writers['h_weather_rainfall'].write(
+                    stations.assign(update_time=str(timestamp)))
+                writers['h_mrt_status_availability'].write(
+                    schedule.status_frame(alerts, timestamp))
+        assert len(taxi_coords) == n_taxis
+
+        with stage(predict, 'read'):
+            taxi_df_pred = insert_predicted_count.get_data(storage, now)
+        with stage(predict, 'preprocessing'):
+            df = insert_predicted_count.preprocessing(taxi_df_pred)
+        with stage(predict, 'array_creation'):
+            X_mas, X_mas_pred, mask = insert_predicted_count.array_creation(
+                df)
+        with stage(predict, 'inference'):
+            y_res = insert_predicted_count.predict(X_mas, X_mas_pred, mask)
+        with stage(predict, 'write_back'):
+            insert_predicted_count.merge_rows(y_res, storage)
+        rows['snapshot'] = len(snapshot)
+        rows['model_input'] = int(mask.sum())
+        rows['predictions'] = int(
+            storage.read('select count(*) as n from r_taxi_stand_pred')
+            ['n'][0])
+
+    return {
+        'benchmark': 'pipeline',
+        'taxis': n_taxis,
+        'stands': n_stands,
+        'minutes': minutes,
+        'ingest_seconds_per_minute':
+        {name: round(s / minutes, 5) for name, s in ingest.items()},
+        'predict_seconds':
+        {name: round(s, 5) for name, s in predict.items()},
+        'rows': rows
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scale', action='store_true',
+                        help='synthetic fleets of 10k to 100k taxis')
+    parser.add_argument('--taxis', type=int, default=None)
+    parser.add_argument('--stands', type=int, default=350)
+    parser.add_argument('--minutes', type=int, default=16)
+    parser.add_argument('--output', default=None,
+                        help='also append the json lines to this file')
+    args = parser.parse_args(argv)
+
+    configs = SCALES if args.scale else ((args.taxis, args.stands), )
+    for n_taxis, n_stands in configs:
+        result = run(n_taxis, n_stands, args.minutes)
+        line = json.dumps(result)
+        print(line, flush=True)
+        if args.output:
+            with open(args.output, 'a') as f:
+                f.write(line + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+'''
+Runtime and peak memory of preprocessing on a synthetic 24h x 350 stand
+frame, original (row-wise apply + per stand asfreq) against vectorized.
+
+    python -m benchmarks.bench_preprocessing
+'''
+import json
+import time
+import tracemalloc
+
+import pandas as pd
+
+from benchmarks import reference
+from benchmarks.synthetic import get_data_frame
+from taxi_compass.features import preprocessing
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main(n_stands=350, minutes=24 * 60):
+    taxi_df_pred = get_data_frame(n_stands=n_stands, minutes=minutes)
+    before, before_s, before_peak = measure(reference.preprocessing,
+                                            taxi_df_pred)
+    after, after_s, after_peak = measure(preprocessing, taxi_df_pred)
+    pd.testing.assert_frame_equal(before, after)
+    print(json.dumps({
+        'benchmark': 'preprocessing',
+        'rows_in': len(taxi_df_pred),
+        'rows_out': len(after),
+        'seconds_before': round(before_s, 3),
+        'seconds_after': round(after_s, 3),
+        'peak_mb_before': round(before_peak / 2**20, 1),
+        'peak_mb_after': round(after_peak / 2**20, 1)
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+'''
+End-to-end latency of RemotePredictor against a local fake ML Engine
+endpoint, for several chunk sizes and levels of concurrency, plus the JSON
+bytes sent before/after compaction.
+
+The fake endpoint sleeps request_overhead seconds plus row_cost seconds per
+row to stand in for the hosted model.
+
+    python -m benchmarks.bench_remote_inference
+'''
+import json
+import time
+
+import numpy as np
+
+from benchmarks.fake_ml_engine import fake_service_factory
+from benchmarks.stub_server import StubServer
+from taxi_compass.inference import RemotePredictor, compact_instances
+
+
+def slow_model_route(request_overhead=0.08, row_cost=2e-5):
+    def route(query, body):
+        instances = json.loads(body)['instances']
+        time.sleep(request_overhead + row_cost * len(instances))
+        return 200, {'predictions': [0.0] * len(instances)}
+
+    return route
+
+
+def model_inputs(n_stands=350, minutes=60):
+    rng = np.random.default_rng(0)
+    n = n_stands * minutes
+    minute = np.tile(np.arange(minutes), n_stands)
+    return np.column_stack(
+        (np.repeat(np.arange(1, n_stands + 1),
+                   minutes), rng.poisson(1.5, n), rng.choice([0.0, 0.2], n),
+         np.ones(n), np.zeros(n), np.full(n, np.sin(2 * np.pi * 9 / 24)),
+         np.full(n, np.cos(2 * np.pi * 9 / 24)),
+         np.sin(minute * 2 * np.pi / 60),
+         np.cos(minute * 2 * np.pi / 60))).astype(np.float32)
+
+
+def main():
+    X = model_inputs()
+    print(json.dumps({
+        'benchmark': 'remote_inference_payload',
+        'rows': len(X),
+        'json_bytes_before': len(json.dumps({'instances': X.tolist()})),
+        'json_bytes_after': len(json.dumps({'instances':
+                                            compact_instances(X)}))
+    }))
+    with StubServer({
+            '/v1/projects/taxi-compass-lewagon/models/xgb:predict':
+            slow_model_route()
+    }) as stub:
+        for max_rows in (len(X), 5000, 2000, 1000):
+            for max_workers in (1, 4, 8):
+                predictor = RemotePredictor(
+                    'taxi-compass-lewagon',
+                    None,
+                    'xgb',
+                    max_rows=max_rows,
+                    max_bytes=10**9,
+                    max_workers=max_workers,
+                    service_factory=fake_service_factory(stub.url))
+                predictor.predict(X[:10])
+                start = time.perf_counter()
+                predictor.predict(X)
+                print(json.dumps({
+                    'benchmark': 'remote_inference',
+                    'rows': len(X),
+                    'chunk_rows': max_rows,
+                    'workers': max_workers,
+                    'seconds': round(time.perf_counter() - start, 3)
+                }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''
+p50 latency of one tsfinder nearest stand lookup, before and after keeping
+the taxi stands warm in StandCache.
+
+"before" is what every request used to do: json.load the geojson, rebuild
+ts_df with a Python loop, then haversine against all taxi stands plus a
+DataFrame copy and sort. Here the geojson is read from the local copy, so
+the GCS download the function also paid is not included.
+
+    python -m benchmarks.bench_tsfinder
+'''
+import json
+import time
+
+import numpy as np
+
+from benchmarks.replay import OfflineStandCache
+from taxi_compass.geo import haversine_km
+from taxi_compass.stands import (LOCAL_TAXI_STAND_GEOJSON_PATH,
+                                 parse_taxi_stands)
+
+
+def cold_lookup(taxi_lat, taxi_lon, taxi_length):
+    with open(LOCAL_TAXI_STAND_GEOJSON_PATH) as geofile:
+        ts_df = parse_taxi_stands(json.load(geofile))
+    df = ts_df.copy()
+    df['distance'] = haversine_km(np.deg2rad(taxi_lat), np.deg2rad(taxi_lon),
+                                  np.deg2rad(df['lat'].to_numpy()),
+                                  np.deg2rad(df['lon'].to_numpy()))
+    df.sort_values(by='distance', inplace=True)
+    return df[['ts_id']].iloc[:taxi_length].values.flatten().tolist()
+
+
+def warm_lookup(stand_cache, taxi_lat, taxi_lon, taxi_length):
+    _, index = stand_cache.get()
+    stand_idx, _ = index.query_knn(taxi_lat, taxi_lon, taxi_length)
+    return index.ts_ids[stand_idx[0]].tolist()
+
+
+def p50_ms(func, origins, *args):
+    timings = []
+    for lat, lon in origins:
+        start = time.perf_counter()
+        func(*args, lat, lon, 20)
+        timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1000
+
+
+def main(n_requests=200):
+    rng = np.random.default_rng(0)
+    origins = np.column_stack((1.285 + rng.random(n_requests) * 0.12,
+                               103.74 + rng.random(n_requests) * 0.12))
+
+    stand_cache = OfflineStandCache(check_interval=3600)
+    stand_cache.get()
+
+    before = p50_ms(cold_lookup, origins)
+    after = p50_ms(warm_lookup, origins, stand_cache)
+    print(json.dumps({
+        'benchmark': 'tsfinder_nearest_stand',
+        'requests': n_requests,
+        'p50_ms_before': round(before, 3),
+        'p50_ms_after': round(after, 3)
+    }))
+
+
+if __name__ == '__main__':
+    main()
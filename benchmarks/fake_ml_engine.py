@@ -0,0 +1,50 @@
+'''
+Stand-in for the ML Engine service object, talking to a local stub server
+instead of googleapis.com, so RemotePredictor can be tested and timed
+without a deployed model.
+'''
+import json
+
+import requests
+
+
+class FakeRequest:
+    def __init__(self, session, url, body):
+        self.session = session
+        self.url = url
+        self.body = body
+
+    def execute(self):
+        r = self.session.post(self.url, data=json.dumps(self.body))
+        r.raise_for_status()
+        return r.json()
+
+
+class FakeProjects:
+    def __init__(self, service):
+        self.service = service
+
+    def predict(self, name, body):
+        return FakeRequest(self.service.session,
+                           self.service.base_url + '/v1/' + name + ':predict',
+                           body)
+
+
+class FakeMLService:
+    '''
+    Same call chain as the discovery service:
+    service.projects().predict(name=..., body=...).execute()
+    '''
+    builds = 0
+
+    def __init__(self, base_url):
+        FakeMLService.builds += 1
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def projects(self):
+        return FakeProjects(self)
+
+
+def fake_service_factory(base_url):
+    return lambda region: FakeMLService(base_url)
@@ -0,0 +1,160 @@
+'''
+The implementations the optimized code replaced, kept as they were so tests
+can check the new code gives the same output and benchmarks can time both.
+'''
+import datetime
+
+import numpy as np
+import pandas as pd
+
+
+def get_weekday(time):
+    time = time.weekday()
+    if time == 5 or time == 6:
+        return 1
+    return 0
+
+
+def preprocessing(taxi_df_pred):
+    df = taxi_df_pred[["taxi_st_num","taxi_update_time","taxi_count","rainfall","mrt_final_status"]].copy()
+    df["taxi_st_num"] = df["taxi_st_num"].astype('int64')
+    df = df.sort_values(by=["taxi_st_num", "taxi_update_time"],ascending=True).reset_index(drop=True)
+    df[["rainfall"]] = df[["rainfall"]].fillna(df.groupby(['taxi_st_num'])[["rainfall"]].ffill())
+    df[["mrt_final_status","rainfall"]] = df[["mrt_final_status","rainfall"]].fillna(value=0)
+    df = df.groupby(["taxi_st_num","taxi_update_time","taxi_count","rainfall"]).agg('min').reset_index().drop_duplicates(subset=["taxi_st_num","taxi_update_time"])
+    df = df.set_index(["taxi_st_num","taxi_update_time"])
+    # "60S" in the original, newer pandas only accepts the lowercase alias
+    df = df.groupby(level=0).apply(lambda x: x.reset_index(level=0, drop=True).asfreq("60s")).reset_index()
+    df[["taxi_count","rainfall","mrt_final_status"]] = df[["taxi_count","rainfall","mrt_final_status"]].fillna(df.groupby(['taxi_st_num'])[["taxi_count","rainfall","mrt_final_status"]].ffill())
+    df["hour"] = df["taxi_update_time"].dt.hour
+    df["minute"] = df["taxi_update_time"].dt.minute
+    df['hr_sin'] = np.sin(df["hour"]*(2.*np.pi/24))
+    df['hr_cos'] = np.cos(df["hour"]*(2.*np.pi/24))
+    df['min_sin'] = np.sin(df["minute"]*(2.*np.pi/60))
+    df['min_cos'] = np.cos(df["minute"]*(2.*np.pi/60))
+    df["taxi_update_time"] = df["taxi_update_time"].dt.tz_localize("Asia/Singapore")
+    df["weekend_bool"] = df.apply(lambda x : get_weekday(x["taxi_update_time"]), axis=1)
+    return df
+
+
+def array_creation(df, n_stands=350):
+    # n_stands was hardcoded to 350 and every stand printed a progress line
+    X_mas = np.array([])
+    X_mas_pred = pd.DataFrame()
+
+    bins = [0, 1, 2, 3, 4, 10000]
+    labels = [0, 1, 2, 3, 4]
+    for i in range(n_stands):
+        X = df.loc[df["taxi_st_num"] == i+1][["taxi_st_num","taxi_update_time","taxi_count", "rainfall","mrt_final_status",
+                                            "weekend_bool","hr_sin","hr_cos","min_sin","min_cos"]].copy()
+
+        X = X.dropna()
+        X_pred = X[["taxi_st_num","taxi_update_time"]]
+
+        X = X.drop(columns=["taxi_update_time"]).to_numpy()
+
+        X = X.reshape(1, X.shape[0], X.shape[1])
+
+        if len(X_mas) == 0:
+            X_mas = X
+            X_mas_pred = X_pred
+        else:
+            X_mas = np.vstack((X_mas, X))
+            X_mas_pred = pd.concat([X_mas_pred, X_pred],ignore_index=True)
+
+    return (X_mas, X_mas_pred)
+
+
+def color_guide(count):
+    colors = {
+        0: 'lightgreen',
+        1: 'green',
+        2: 'green',
+        3: 'blue',
+        4: 'blue'
+    }
+    if count > 4:
+        return 'black'
+    else:
+        return colors[count]
+
+
+def stand_map(coordinates, results_df):
+    # app.py built the map like this on every rerun, legend template included
+    import folium
+    from branca.element import Template, MacroElement
+    from taxi_compass.stand_map import LEGEND_TEMPLATE
+
+    m = folium.Map(location=[coordinates[0], coordinates[1]],
+                   zoom_start=14,
+                   tiles='openstreetmap')
+
+    folium.Marker(
+        location=[coordinates[0], coordinates[1]],
+        popup='You are here',
+        icon=folium.Icon(color="red", icon="car", prefix='fa'),
+    ).add_to(m)
+
+    for index,row in results_df.iterrows():
+        folium.Marker(
+            location=[row.latitude, row.longitude],
+            popup=f'Predicted Taxi Count Here: {row.prediction}',
+            icon=folium.Icon(color=color_guide(row.prediction),
+                            icon="car"),
+        ).add_to(m)
+
+    macro = MacroElement()
+    macro._template = Template(LEGEND_TEMPLATE)
+    macro.add_to(m)
+    return m
+
+
+def get_first_time(update_time, stn_first_time):
+    today_date = update_time.date()
+    first_time = str(today_date) + ' ' + str(stn_first_time)
+    return datetime.datetime.strptime(first_time, '%Y-%m-%d %H:%M:%S')
+
+
+def get_last_time(update_time, stn_last_train):
+    tmr_date = update_time.date()  + datetime.timedelta(days = 1)
+    today_date = update_time.date()
+    if datetime.datetime.strptime(stn_last_train, '%H:%M:%S').time() < datetime.time(2,0):
+        last_time = str(tmr_date) + ' ' + str(stn_last_train)
+    else:
+        last_time = str(today_date) + ' ' + str(stn_last_train)
+    return datetime.datetime.strptime(last_time, '%Y-%m-%d %H:%M:%S')
+
+
+def check_operation_bool(update_time, start_train, last_train):
+    if (start_train <= update_time) and (last_train >= update_time):
+        return 1.0
+    return 0.0
+
+
+def mrt_status_frame(mrt_list_df, alerts, update_time):
+    '''
+    Rows of h_mrt_status_availability: every station of mrt_list_df with
+    whether it is in operation at update_time (Singapore time) and not in a
+    segment affected by the TrainServiceAlerts json
+    '''
+    mrt_list_df = mrt_list_df.set_index('stn_id')
+    status = alerts["value"]["Status"]
+    if status != 1:
+        stations_list = []
+        for d in alerts["value"]["AffectedSegments"]:
+            stations_list += d["Stations"].split(",")
+        station_df = pd.DataFrame(stations_list, columns=["stn_id"])
+        station_df["non_disruption_bool"] = 0
+        station_df = station_df.set_index('stn_id')
+        mrt_list_df.update(station_df)
+
+    mrt_list_df.reset_index(inplace=True)
+
+    mrt_list_df.loc[:,"stn_first_train_dt"] = mrt_list_df.apply(lambda x : get_last_time(update_time, x["stn_first_train"]), axis=1)
+    mrt_list_df.loc[:,"stn_last_train_dt"] = mrt_list_df.apply(lambda x : get_last_time(update_time, x["stn_last_train"]), axis=1)
+    mrt_list_df.loc[:,"in_operation_bool"] = mrt_list_df.apply(lambda x : check_operation_bool(update_time, x["stn_first_train_dt"],
+                                                                                        x["stn_last_train_dt"]), axis=1)
+    mrt_list_df["final_status"] = mrt_list_df["in_operation_bool"] * mrt_list_df["non_disruption_bool"]
+    mrt_list_df["update_time"] = update_time.strftime("%Y-%m-%d %H:%M:%S")
+    mrt_list_df = mrt_list_df.drop(columns=["stn_first_train_dt","stn_last_train_dt"])
+    return mrt_list_df
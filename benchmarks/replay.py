@@ -0,0 +1,124 @@
+'''
+Recorded feeds replayed by a local stub server, and synthetic taxi fleets
+and taxi stands to replay them at larger scales
+'''
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from taxi_compass.stands import (StandCache, LOCAL_TAXI_STAND_GEOJSON_PATH,
+                                 parse_taxi_stands)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tests',
+                        'fixtures')
+MRT_LIST_PATH = os.path.join(FIXTURES, 'mrtsg.csv')
+
+# Where the synthetic taxis and taxi stands are placed
+SG_LAT = (1.25, 1.45)
+SG_LON = (103.65, 104.0)
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return json.load(f)
+
+
+class OfflineStandCache(StandCache):
+    '''
+    No GCS credentials needed, always falls back to the bundled copy
+    '''
+    def get_blob(self):
+        raise RuntimeError('replay runs offline')
+
+
+def load_stands():
+    with open(LOCAL_TAXI_STAND_GEOJSON_PATH) as geofile:
+        return parse_taxi_stands(json.load(geofile))
+
+
+def synthetic_stands(n_stands, seed=0):
+    '''
+    The real taxi stands, then kml_<n> stands at random places in Singapore
+    up to n_stands
+    '''
+    ts_df = load_stands()
+    extra = n_stands - len(ts_df)
+    if extra <= 0:
+        return ts_df.iloc[:n_stands].reset_index(drop=True)
+    rng = np.random.default_rng(seed)
+    first = ts_df['ts_id'].str[4:].astype(int).max() + 1
+    return pd.concat([
+        ts_df,
+        pd.DataFrame({
+            'ts_id': [f'kml_{i}' for i in range(first, first + extra)],
+            'lat': rng.uniform(*SG_LAT, extra),
+            'lon': rng.uniform(*SG_LON, extra)
+        })
+    ], ignore_index=True)
+
+
+def synthetic_fleet(n_taxis, ts_df, near_stand=0.3, seed=0):
+    '''
+    (n_taxis, 2) lat, lon: a share near_stand of them waiting within ~150 m
+    of a taxi stand, the others anywhere in Singapore
+    '''
+    rng = np.random.default_rng(seed)
+    n_near = int(n_taxis * near_stand)
+    stand = rng.integers(0, len(ts_df), n_near)
+    near = ts_df[['lat', 'lon']].to_numpy()[stand] + \
+        rng.normal(0, 0.001, (n_near, 2))
+    far = np.column_stack((rng.uniform(*SG_LAT, n_taxis - n_near),
+                           rng.uniform(*SG_LON, n_taxis - n_near)))
+    return np.vstack((near, far))
+
+
+def lta_pages(taxi_coords, page_size=500):
+    '''
+    Taxi-Availability pages of taxi_coords, like LTA DataMall returns them
+    '''
+    rows = [{'Latitude': lat, 'Longitude': lon} for lat, lon in taxi_coords]
+    return [{'value': rows[start:start + page_size]}
+            for start in range(0, len(rows), page_size)]
+
+
+def replay_routes(pages=None, page_size=None):
+    '''
+    Stub server routes for the LTA Taxi-Availability pages (the recorded
+    ones by default), TrainServiceAlerts, and the data.gov.sg rainfall and
+    taxi-availability feeds
+    '''
+    if pages is None:
+        recorded = fixture('lta_taxi_availability.json')
+        pages, page_size = recorded['pages'], recorded['page_size']
+    page_size = page_size or 500
+
+    def lta_page(query, body):
+        index = int(query.get('$skip', 0)) // page_size
+        if index < len(pages):
+            return 200, pages[index]
+        return 200, {'value': []}
+
+    def payload(name):
+        recorded = fixture(name)
+        return lambda query, body: (200, recorded)
+
+    return {
+        '/Taxi-Availability': lta_page,
+        '/TrainServiceAlerts': payload('train_service_alerts.json'),
+        '/rainfall': payload('rainfall.json'),
+        '/taxi-availability': payload('taxi_availability.json'),
+    }
+
+
+def replay_urls(stub):
+    '''
+    The feed urls of taxi_compass.ingest pointing at the stub server
+    '''
+    return {
+        'lta_taxi_availability': stub.url + '/Taxi-Availability',
+        'train_service_alerts': stub.url + '/TrainServiceAlerts',
+        'rainfall': stub.url + '/rainfall',
+        'taxi_availability': stub.url + '/taxi-availability'
+    }
@@ -0,0 +1,62 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubServer:
+    '''
+    Local HTTP server replaying recorded payloads.
+
+    routes maps a path to a function receiving the parsed query string and
+    the request body, and returning (status, payload). Every request is kept
+    in self.requests as (path, query) so tests can check what was called.
+    '''
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_any(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                with stub.lock:
+                    stub.requests.append((url.path, query))
+                if url.path not in stub.routes:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                status, payload = stub.routes[url.path](query, body)
+                if not isinstance(payload, bytes):
+                    payload = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = handle_any
+            do_POST = handle_any
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,41 @@
+'''
+Synthetic inputs shaped like the real ones, for tests and benchmarks
+'''
+import numpy as np
+import pandas as pd
+
+
+def get_data_frame(n_stands=350,
+                   minutes=60,
+                   start='2022-01-14 23:30',
+                   missing=0.1,
+                   seed=0):
+    '''
+    Frame with the columns get_data returns: one row per taxi stand per
+    minute, with some minutes missing, some duplicated rows and gaps in
+    rainfall and mrt_final_status like the left joins produce
+    '''
+    rng = np.random.default_rng(seed)
+    stand = np.repeat(np.arange(1, n_stands + 1), minutes)
+    minute = np.tile(np.arange(minutes), n_stands)
+    keep = rng.random(len(stand)) >= missing
+    stand, minute = stand[keep], minute[keep]
+    # a few minutes come twice (several mrt stations for one taxi stand)
+    dup = rng.random(len(stand)) < 0.02
+    stand = np.r_[stand, stand[dup]]
+    minute = np.r_[minute, minute[dup]]
+    n = len(stand)
+
+    rainfall = rng.choice([0.0, 0.0, 0.0, 0.2, 1.4], n)
+    rainfall[rng.random(n) < 0.3] = np.nan
+    mrt_final_status = rng.choice([1.0, 1.0, 1.0, 0.0], n)
+    mrt_final_status[rng.random(n) < 0.5] = np.nan
+    return pd.DataFrame({
+        'taxi_st_id': np.char.add('kml_', stand.astype(str)),
+        'taxi_st_num': stand.astype(str),
+        'taxi_count': rng.poisson(1.5, n),
+        'taxi_update_time': pd.Timestamp(start) +
+        pd.to_timedelta(minute, unit='m'),
+        'rainfall': rainfall,
+        'mrt_final_status': mrt_final_status
+    })
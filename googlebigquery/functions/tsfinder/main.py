@@ -1,110 +1,178 @@
+import os
 import json
-import pandas as pd
 import numpy as np
-import requests
-from datetime import datetime, timedelta
-from google.cloud import bigquery, storage
+from taxi_compass.instrument import run, stage
+from taxi_compass.stands import (StandCache, BUCKET_NAME,
+                                 BUCKET_TAXI_STAND_GEOJSON_PATH)
 
-def get_taxi_stands(taxi_stands_json):
-    '''
-    Parse the geojson with taxi stands into a set of taxi stand id and lat,lon
-    This information is static, so no timestamp is required
+# Taxi stands, their radian lat/lon and the KD-tree live here between
+# requests of the same instance. The bucket is only checked again for a new
+# version of the geojson every TSFINDER_STAND_CHECK_INTERVAL seconds.
+stand_cache = StandCache(BUCKET_NAME,
+                         BUCKET_TAXI_STAND_GEOJSON_PATH,
+                         check_interval=int(
+                             os.environ.get('TSFINDER_STAND_CHECK_INTERVAL',
+                                            300)))
 
-    Run this function once. We could store this data frame and not run
-    this function every time, but for educational purposes I'm keeping all here
-    so is easier to understand where things come from
-    '''
-    taxi_stands_dict = []
-    for ts in taxi_stands_json['features']:
-        taxi_stands_dict.append({
-            'ts_id': ts['properties']['Name'],
-            'lat': ts['geometry']['coordinates'][1],
-            'lon': ts['geometry']['coordinates'][0]
-        })
-    ts_df = pd.DataFrame(taxi_stands_dict)
-    return ts_df
 
-
-def find_nearest_taxi_stand(ts_df,
+def find_nearest_taxi_stand(index,
                             taxi_lat=1.281261,
                             taxi_lon=103.846358,
                             taxi_length=5):
     '''
-    Given all the static positions of the nearby taxi stands
-    we can get the distance with all of them, and return the nearest 10 taxi stands.
-
-    We can assume that a taxi is IN the taxi stand when the distance is < 100 m = 0.1 km
-
-    Python wise we'll be using broadcasting method, so we do the difference of all taxi stands (ts)
-    with a given taxi_lat and taxi_lon in one shot, not in a for loop.
+    Given the StandIndex with all the static positions of the taxi stands,
+    return the ids of the nearest taxi_length taxi stands, nearest first.
     '''
-    taxi_lat = np.float64(taxi_lat)
-    taxi_lon = np.float64(taxi_lon)
-    taxi_lat_rad = np.deg2rad(taxi_lat)
-    taxi_lon_rad = np.deg2rad(taxi_lon)
-
-    ts_lat = np.array(ts_df['lat'].tolist())
-    ts_lat_rad = np.deg2rad(ts_lat)
+    ts_ids, _ = index.nearest(np.float64(taxi_lat), np.float64(taxi_lon),
+                              taxi_length)
+    return ts_ids.tolist()
 
-    ts_lon = np.array(ts_df['lon'].tolist())
-    ts_lon_rad = np.deg2rad(ts_lon)
 
-    dlat = ts_lat_rad - taxi_lat_rad
-    dlon = ts_lon_rad - taxi_lon_rad
-
-    d = np.sin(
-        dlat /
-        2)**2 + np.cos(ts_lat_rad) * np.cos(taxi_lat_rad) * np.sin(dlon / 2)**2
-    distance = 2 * 6371 * np.arcsin(np.sqrt(d))
+def find_nearest_taxi_stands_batch(index, taxi_lat, taxi_lon, taxi_length,
+                                   radius_km):
+    '''
+    Nearest taxi stands for many origins in one vectorized pass.
+
+    taxi_length and radius_km are arrays with one value per origin: keep at
+    most taxi_length taxi stands, and only those within radius_km. Origins
+    with a radius are served by a radius query, the others by a k-nearest
+    query. Returns the taxi stand ids and distances (km) of every origin as
+    two flat arrays, plus how many of them belong to each origin, in origin
+    order.
+    '''
+    origin = np.arange(len(taxi_lat))
+    in_radius = np.isfinite(radius_km)
+    parts = []
+
+    o = origin[in_radius]
+    if len(o):
+        taxi_idx, stand_idx, distance = index.query_radius(
+            taxi_lat[o], taxi_lon[o], radius_km[o], taxi_length[o])
+        parts.append((o[taxi_idx], stand_idx, distance))
+
+    o = origin[~in_radius]
+    if len(o) and taxi_length[o].max() > 0:
+        stand_idx, distance = index.query_knn(taxi_lat[o], taxi_lon[o],
+                                              taxi_length[o].max())
+        keep = np.arange(stand_idx.shape[1]) < taxi_length[o][:, None]
+        parts.append((np.repeat(o, keep.sum(axis=1)), stand_idx[keep],
+                      distance[keep]))
+
+    if not parts:
+        return (np.array([], dtype=index.ts_ids.dtype), np.array([]),
+                np.zeros(len(origin), dtype=int))
+    origin_idx, stand_idx, distance = (np.concatenate(p) for p in zip(*parts))
+    order = np.argsort(origin_idx, kind='stable')
+    return (index.ts_ids[stand_idx[order]], distance[order],
+            np.bincount(origin_idx, minlength=len(origin)))
+
+
+def parse_origins(request_json, n_stands):
+    '''
+    Read the origins of a batch request into arrays. Origins without length
+    fall back to the request length (or 5), origins with only radius_km get
+    every taxi stand within their radius.
+    '''
+    origins = request_json['origins']
+    default_length = request_json.get('length')
+    default_radius = request_json.get('radius_km')
+    taxi_lat = np.array([o['latitude'] for o in origins], dtype=np.float64)
+    taxi_lon = np.array([o['longitude'] for o in origins], dtype=np.float64)
+    taxi_length, radius_km = [], []
+    for o in origins:
+        length = o.get('length', default_length)
+        radius = o.get('radius_km', default_radius)
+        if length is None:
+            length = n_stands if radius is not None else 5
+        taxi_length.append(min(int(length), n_stands))
+        radius_km.append(np.inf if radius is None else float(radius))
+    return taxi_lat, taxi_lon, np.array(taxi_length, dtype=int), np.array(
+        radius_km, dtype=np.float64)
+
+
+def batch_response(ts_ids, distance, counts, response_format='json'):
+    '''
+    JSON arrays (one list per origin), or an Arrow IPC stream with one row
+    per (origin, taxi stand) when response_format is 'arrow'
+    '''
+    if response_format == 'arrow':
+        import pyarrow as pa
+        origin = np.repeat(np.arange(len(counts), dtype=np.int32), counts)
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        rank = np.arange(len(ts_ids), dtype=np.int32) - starts
+        table = pa.table({
+            'origin': origin,
+            'rank': rank.astype(np.int32),
+            'ts_id': pa.array(ts_ids.astype(str)),
+            'distance_km': distance
+        })
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return (sink.getvalue().to_pybytes(), 200, {
+            'Content-Type': 'application/vnd.apache.arrow.stream'
+        })
 
-    df = ts_df.copy()
-    df['distance'] = distance
-    df.sort_values(by='distance', inplace=True)
-    return df[['ts_id']].iloc[:taxi_length].values.flatten().tolist()
+    # one list per origin, np.split would still give one for no origins
+    splits = np.cumsum(counts)[:-1]
+    ts_id_parts = np.split(ts_ids, splits) if len(counts) else []
+    distance_parts = np.split(distance, splits) if len(counts) else []
+    body = {
+        'ts_ids': [ids.tolist() for ids in ts_id_parts],
+        'distances_km': [np.round(d, 5).tolist() for d in distance_parts]
+    }
+    return (json.dumps(body), 200, {'Content-Type': 'application/json'})
 
 
 # if __name__ == "__main__":
 def taxi_stop_finder(request):
     '''
-    1. Get taxi stands static
+    1. Get taxi stands static (warm from stand_cache)
     2. Return nearby taxi stands
+
+    Single origin requests {"latitude", "longitude", "length"} get the
+    dash-joined ids as before. Batch requests send {"origins": [{"latitude",
+    "longitude", optional "length", optional "radius_km"}, ...]} plus an
+    optional "format" ("json" or "arrow").
     '''
-    ### GCP Storage - - - - - - - - - - - - - - - - - - - - - -
-    BUCKET_NAME = 'static-file-storage'
-    BUCKET_TAXI_STAND_GEOJSON_PATH = 'lta-taxi-stop-geojson.geojson'
-
-    # Add Client() here
-    storage_client = storage.Client()
-    path = f"gs://{BUCKET_NAME}/{BUCKET_TAXI_STAND_GEOJSON_PATH}"
-    bucket = storage_client.bucket(BUCKET_NAME)
-    blob = bucket.blob(BUCKET_TAXI_STAND_GEOJSON_PATH)
-
-    with blob.open('r') as geofile:
-        # with open(public_path) as geofile:
-        '''
-        Take geojson file provided by LTA where the taxi stands coordinates are provided
-        '''
-        taxi_stands_json = json.load(geofile)
-        print('loaded json successfully from bucket')
-
-    # Here comes the request info with the taxi lat lon
-    request_json = request.get_json()
-    taxi_lat=request_json['latitude']
-    taxi_lon=request_json['longitude']
-    taxi_length = request_json['length']
-    ts_df = get_taxi_stands(taxi_stands_json)
-    nearby_taxi_stands = find_nearest_taxi_stand(ts_df, taxi_lat, taxi_lon,
-                                                 taxi_length)
+    with run('tsfinder'):
+        with stage('stands') as s:
+            ts_df, index = stand_cache.get()
+            s.record(rows=len(index))
+
+        # Here comes the request info with the taxi lat lon
+        request_json = request.get_json()
+        if 'origins' in request_json:
+            with stage('query') as s:
+                taxi_lat, taxi_lon, taxi_length, radius_km = parse_origins(
+                    request_json, len(index))
+                ts_ids, distance, counts = find_nearest_taxi_stands_batch(
+                    index, taxi_lat, taxi_lon, taxi_length, radius_km)
+                s.record(ts_ids)
+            with stage('response') as s:
+                response = batch_response(ts_ids, distance, counts,
+                                          request_json.get('format', 'json'))
+                s.record(response[0])
+            return response
+
+        taxi_lat=request_json['latitude']
+        taxi_lon=request_json['longitude']
+        taxi_length = request_json['length']
+        with stage('query'):
+            nearby_taxi_stands = find_nearest_taxi_stand(index, taxi_lat,
+                                                         taxi_lon, taxi_length)
 
     return ('-'.join(nearby_taxi_stands), 200)
 
 
 ## Requirements
-# google-cloud-bigquery==2.31.0
+# google-cloud-storage
 # numpy==1.18.5
 # pandas==1.3.1
-# requests==2.26.0
 # pyarrow==6.0.1
-# json
+# scipy==1.5.4
+# taxi_compass
 
 # Testing: {"latitude":1.281260 , "longitude":103.8443}
+# Batch: {"origins": [{"latitude":1.281260 , "longitude":103.8443},
+#                     {"latitude":1.3521, "longitude":103.8198, "radius_km":0.5}]}
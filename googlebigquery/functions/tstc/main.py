@@ -1,87 +1,64 @@
-import json
-import pandas as pd
+import os
 import numpy as np
-import requests
 from datetime import datetime, timedelta
-from google.cloud import bigquery, storage
+from taxi_compass.feeds import stand_count_frame
+from taxi_compass.geo import StandIndex, count_taxis_per_stand
+from taxi_compass.lta import get_taxi_coordinates, make_session
+from taxi_compass.rainfall import fetch_stand_rainfall, get_rainfall_session
+from taxi_compass.stands import get_stand_cache
+from taxi_compass.history import get_history
+from taxi_compass.instrument import run, stage
+from taxi_compass.writer import get_writer
 
-def get_taxi_stands(taxi_stands_json):
-    '''
-    Parse the geojson with taxi stands into a set of taxi stand id and lat,lon
-    This information is static, so no timestamp is required
+# How near a taxi to a taxi stand is considered inside the taxi stand (km)
+CUTOFF_DISTANCE = float(os.environ.get('TSTC_CUTOFF_DISTANCE', 0.200))
+
+# A taxi is counted in at most this many taxi stands, the nearest ones
+MAX_STANDS_PER_TAXI = 10
+
+# 'index' assigns taxis with the KD-tree StandIndex, 'numpy' with chunked
+# broadcasting of every taxi against every taxi stand
+ASSIGNMENT_ENGINE = os.environ.get('TSTC_ASSIGNMENT_ENGINE', 'index')
+
+# The taxi stands are static, so the spatial index is built once per process
+# and reused by every invocation that lands on the same instance
+stand_index = None
 
-    Run this function once. We could store this data frame and not run
-    this function every time, but for educational purposes I'm keeping all here
-    so is easier to understand where things come from
+# Pages of the LTA API requested at the same time, over a pooled session
+LTA_CONCURRENCY = int(os.environ.get('TSTC_LTA_CONCURRENCY', 4))
+lta_session = None
+
+
+def get_stand_index(ts_df):
+    '''
+    Return the process wide StandIndex, rebuilding it only when the
+    taxi stands given are not the ones already indexed
     '''
-    taxi_stands_dict = []
-    for ts in taxi_stands_json['features']:
-        taxi_stands_dict.append({
-            'ts_id': ts['properties']['Name'],
-            'lat': ts['geometry']['coordinates'][1],
-            'lon': ts['geometry']['coordinates'][0]
-        })
-    ts_df = pd.DataFrame(taxi_stands_dict)
-    return ts_df
+    global stand_index
+    if stand_index is None or not np.array_equal(stand_index.ts_ids,
+                                                 ts_df['ts_id'].to_numpy()):
+        stand_index = StandIndex.from_dataframe(ts_df)
+    return stand_index
+
 
 def get_taxi_coordinates_from_lta():
     '''
     LTA DATAMALL provides up to 500 rows of taxi info,
     so we need to run the API call several times until we have
     aggregated all results. All the taxi coordinates aggregated will
-    be returned by this function
-    '''
-    taxi_coordinates = []
-    for index in range(20):
-        skip = 0 + 500 * index
-        #     print(f'skip at {skip}')
-        uri = f'http://datamall2.mytransport.sg/ltaodataservice/Taxi-Availability?$skip={skip}'
-        headers = {
-            'AccountKey': 'BehS/IpVR0KOFQ+BgFqM5g==',
-            'accept': 'application/json'
-        }  #this is by default
-        r = requests.get(url=uri, headers=headers).json()
-        if len(requests.get(url=uri, headers=headers).json()["value"]) == 0:
-            break
-        taxi_coordinates += r['value']
-    return taxi_coordinates
-
-def find_nearest_taxi_stand(ts_df,taxi_lat=1.281261, taxi_lon=103.846358):
-    '''
-    Given all the static positions of the nearby taxi stands
-    we can get the distance with all of them, and return the nearest 10 taxi stands.
-
-    We can assume that a taxi is IN the taxi stand when the distance is < 100 m = 0.1 km
+    be returned by this function as a (N, 2) array of lat, lon
 
-    Python wise we'll be using broadcasting method, so we do the difference of all taxi stands (ts)
-    with a given taxi_lat and taxi_lon in one shot, not in a for loop.
+    Pages are fetched concurrently over the pooled lta_session, which
+    survives between invocations of the same instance.
     '''
-    taxi_lat = np.float64(taxi_lat)
-    taxi_lon = np.float64(taxi_lon)
-    taxi_lat_rad = np.deg2rad(taxi_lat)
-    taxi_lon_rad = np.deg2rad(taxi_lon)
-
-    ts_lat = np.array(ts_df['lat'].tolist())
-    ts_lat_rad = np.deg2rad(ts_lat)
-
-    ts_lon = np.array(ts_df['lon'].tolist())
-    ts_lon_rad = np.deg2rad(ts_lon)
-
-    dlat = ts_lat_rad - taxi_lat_rad
-    dlon = ts_lon_rad - taxi_lon_rad
-
-    d = np.sin(
-        dlat /
-        2)**2 + np.cos(ts_lat_rad) * np.cos(taxi_lat_rad) * np.sin(dlon / 2)**2
-    distance = 2 * 6371 * np.arcsin(np.sqrt(d))
-
-    df = ts_df.copy()
-    df['distance'] = distance
-    df.sort_values(by='distance', inplace=True)
-    return df.iloc[:10]
-
-
-def count_taxis_in_ts(ts_df):
+    global lta_session
+    if lta_session is None:
+        lta_session = make_session(pool_size=LTA_CONCURRENCY)
+    return get_taxi_coordinates(lta_session, concurrency=LTA_CONCURRENCY)
+
+def count_taxis_in_ts(ts_df,
+                      cutoff_distance=CUTOFF_DISTANCE,
+                      engine=ASSIGNMENT_ENGINE):
     '''
     First retrieve the taxi coordinates using the LTA API for available taxis
 
@@ -92,78 +69,74 @@ def count_taxis_in_ts(ts_df):
 
     Cutoff distance represents how near a taxi to a taxi stand is consider
     inside the taxi stand. Cutoff distance of 0.1 represents 100m = 0.1km
-    '''
-    coordinates=get_taxi_coordinates_from_lta()
-    timestamp = datetime.now() + timedelta(hours=8) # Singapore time
-
-    cutoff_distance = 0.200  # Measured in km
 
-    ts_counter = dict(
-        zip(ts_df['ts_id'].tolist(), [0 for _ in ts_df['ts_id'].tolist()]))
-
-    for taxi_coordinates in coordinates:
-        lon = taxi_coordinates['Longitude']
-        lat = taxi_coordinates['Latitude']
-        d_df = find_nearest_taxi_stand(ts_df, lat, lon)
-        d_df = d_df[d_df['distance'] < cutoff_distance]
-        for ts in d_df['ts_id'].tolist():
-            ts_counter[ts] += 1
-
-    tmp_taxi_stand_counter = pd.DataFrame.from_dict(ts_counter, orient='index')
-    tmp_taxi_stand_counter.reset_index(inplace=True)
-    tmp_taxi_stand_counter['timestamp'] = timestamp
-    tmp_taxi_stand_counter = tmp_taxi_stand_counter.rename(columns={
-        0: 'taxi_count',
-        'index': 'ts_id'
-    })
-    return ts_df.merge(tmp_taxi_stand_counter)
+    All taxis of the snapshot are assigned in one batch (StandIndex query or
+    NumPy broadcasting depending on engine): a taxi counts for its nearest
+    MAX_STANDS_PER_TAXI taxi stands under the cutoff distance.
 
+    The rainfall of every taxi stand, interpolated from the current readings
+    of the weather stations, is written with the counts.
+    '''
+    with stage('fetch') as s:
+        taxi_coords = get_taxi_coordinates_from_lta()
+        # its own short try, a failing weather feed does not hold up the
+        # counts with the retries of the LTA session
+        rainfall = fetch_stand_rainfall(ts_df, get_rainfall_session())
+        s.record(taxi_coords)
+    timestamp = datetime.now() + timedelta(hours=8) # Singapore time
 
-def gcp_load_df_into_bigquery(df):
+    with stage('assign') as s:
+        if engine == 'numpy':
+            counts = count_taxis_per_stand(taxi_coords,
+                                           ts_df[['lat', 'lon']].to_numpy(),
+                                           cutoff_distance,
+                                           MAX_STANDS_PER_TAXI)
+        else:
+            counts = get_stand_index(ts_df).count_within(taxi_coords[:, 0],
+                                                         taxi_coords[:, 1],
+                                                         cutoff_distance,
+                                                         MAX_STANDS_PER_TAXI)
+        tstc = stand_count_frame(ts_df, counts, timestamp, rainfall)
+        s.record(tstc)
+    return tstc
+
+
+def load_df_into_storage(df):
     '''
-    Write a dataframe into google bigquery
+    Write a dataframe to h_taxi_stand_taxi_count, in google bigquery or
+    the local storage picked with TAXI_COMPASS_STORAGE. Snapshots go through
+    the buffered writer, which loads several minutes at once (see
+    taxi_compass.writer for the flush settings). With
+    TAXI_COMPASS_HISTORY_DIR set they are also added to the count history
+    matrix on disk
     '''
-    client = bigquery.Client(project='taxi-compass-lewagon')
-    table_id = 'api_dataset.h_taxi_stand_taxi_count'
-
-    job = client.load_table_from_dataframe(df, table_id)
-
-    job.result()  # Wait for the job to complete.
-
-    table = client.get_table(table_id)  # Make an API request.
-    print("Loaded {} rows and {} columns to {}".format(table.num_rows,
-                                                       len(table.schema),
-                                                       table_id))
+    with stage('write') as s:
+        get_writer('h_taxi_stand_taxi_count').write(df)
+        history = get_history()
+        if history is not None:
+            history.import_frame(df)
+        s.record(df)
 
 
 # if __name__ == "__main__":
 def taxi_stop_taxi_count(request):
     '''
-    1. Get taxi stands static
+    1. Get taxi stands static, kept by the process wide StandCache (the
+       bundled stand catalog while the bucket geojson is unchanged)
     2. Count taxis in them
     3. Write into big query
     '''
-    ### GCP Storage - - - - - - - - - - - - - - - - - - - - - -
-    BUCKET_NAME = 'static-file-storage'
-    BUCKET_TAXI_STAND_GEOJSON_PATH = 'lta-taxi-stop-geojson.geojson'
-
-    # Add Client() here
-    storage_client = storage.Client()
-    path = f"gs://{BUCKET_NAME}/{BUCKET_TAXI_STAND_GEOJSON_PATH}"
-    bucket = storage_client.bucket(BUCKET_NAME)
-    blob = bucket.blob(BUCKET_TAXI_STAND_GEOJSON_PATH)
-
-    with blob.open('r') as geofile:
-        # with open(public_path) as geofile:
-        '''
-        Take geojson file provided by LTA where the taxi stands coordinates are provided
-        '''
-        taxi_stands_json = json.load(geofile)
-        print('loaded json successfully from bucket')
-
-    ts_df = get_taxi_stands(taxi_stands_json)
-    tstc = count_taxis_in_ts(ts_df)
-    gcp_load_df_into_bigquery(tstc)
+    request_json = request.get_json(silent=True) or {}
+    cutoff_distance = float(request_json.get('cutoff_distance',
+                                             CUTOFF_DISTANCE))
+
+    # stage timings are logged with TAXI_COMPASS_INSTRUMENT=summary/detailed
+    with run('tstc'):
+        with stage('stands') as s:
+            ts_df, _ = get_stand_cache().get()
+            s.record(ts_df)
+        tstc = count_taxis_in_ts(ts_df, cutoff_distance)
+        load_df_into_storage(tstc)
 
     return ("Done!", 200)
 
@@ -174,4 +147,6 @@ def taxi_stop_taxi_count(request):
 # pandas==1.3.1
 # requests==2.26.0
 # pyarrow==6.0.1
+# scipy==1.5.4
+# taxi_compass
 # json
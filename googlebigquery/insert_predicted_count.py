@@ -1,120 +1,89 @@
+import datetime
+import os
 import pandas as pd
-import numpy as np
 
-import googleapiclient.discovery
-from google.api_core.client_options import ClientOptions
-
-from google.cloud import bigquery
-
-def get_data():
-    bqclient = bigquery.Client()
-
-    # Download query results.
-    query_string = """
-    select x.taxi_st_id,  substr(x.taxi_st_id,5) taxi_st_num,  x.taxi_count, x.taxi_update_time, x.weather_stn_id, c.rainfall, c.weather_update_time, x.mrt_stn_id, e.mrt_final_status, e.mrt_update_time
+from taxi_compass.features import array_creation, preprocessing
+from taxi_compass.inference import get_local_predictor, get_remote_predictor
+from taxi_compass.instrument import instrumented, run, stage
+from taxi_compass.predictions import write_version
+from taxi_compass.storage import get_storage
+
+# 'remote' sends the rows to the model hosted on ML Engine, 'local' runs
+# the XGBoost model in this process
+PREDICT_BACKEND = os.environ.get('PREDICT_BACKEND', 'remote')
+PREDICT_BATCH_SIZE = int(os.environ.get('PREDICT_BATCH_SIZE', 100000))
+PREDICT_THREADS = os.environ.get('PREDICT_THREADS')
+PREDICT_CHUNK_ROWS = int(os.environ.get('PREDICT_CHUNK_ROWS', 5000))
+PREDICT_CONCURRENCY = int(os.environ.get('PREDICT_CONCURRENCY', 4))
+
+# Rows of the last hours of taxi counts, with the rainfall interpolated at
+# every taxi stand when the counts were written, joined with the mrt status
+# of the same minute. The queries only differ in SQL dialect.
+QUERY_DATA = {
+    'bigquery': """
+    select x.taxi_st_id,  substr(x.taxi_st_id,5) taxi_st_num,  x.taxi_count, x.taxi_update_time, x.rainfall, x.mrt_stn_id, e.mrt_final_status, e.mrt_update_time
     from (
-    select a.taxi_st_id, a.taxi_count, a.taxi_update_time, b.weather_stn_id, d.mrt_stn_id
+    select a.taxi_st_id, a.taxi_count, a.taxi_update_time, a.rainfall, d.mrt_stn_id
     from (
-    SELECT ts_id as taxi_st_id, taxi_count, cast(timestamp_trunc(timestamp, minute) as datetime) as taxi_update_time
+    SELECT ts_id as taxi_st_id, taxi_count, cast(timestamp_trunc(timestamp, minute) as datetime) as taxi_update_time, rainfall
     FROM `taxi-compass-lewagon.api_dataset.h_taxi_stand_taxi_count`
-    WHERE timestamp > TIMESTAMP_add(CURRENT_TIMESTAMP() , INTERVAL 464 minute)
+    WHERE timestamp > TIMESTAMP_add(TIMESTAMP(@now) , INTERVAL 464 minute)
     ) a
-    left join
-    (
-    select weather_stn_id, taxi_st_id from `taxi-compass-lewagon.api_dataset.c_taxi_stand_weather_stn`
-    ) b on a.taxi_st_id = b.taxi_st_id
     left join 
     (
     select taxi_st_id, mrt_stn as mrt_stn_id from `taxi-compass-lewagon.api_dataset.c_mrt_stn_taxi_stand`
     where mrt_stn is not null
     ) d on a.taxi_st_id = d.taxi_st_id
     )x
-    left join 
-    (
-    select station_id as weather_stn_id, rainfall, datetime_trunc(datetime (update_time), minute) as weather_update_time
-    from `taxi-compass-lewagon.api_dataset.h_weather_rainfall`
-    where datetime(update_time) > datetime_SUB(CURRENT_DATETIME() , INTERVAL 1 hour)
-    ) c on x.weather_stn_id = c.weather_stn_id and x.taxi_update_time = c.weather_update_time
     left join
     (
     select stn_id as mrt_stn_id, final_status as mrt_final_status, datetime_trunc(datetime (update_time), minute) as mrt_update_time 
     from `taxi-compass-lewagon.api_dataset.h_mrt_status_availability`
-    where datetime(update_time) > datetime_SUB(CURRENT_DATETIME() , INTERVAL 1 hour)
+    where datetime(update_time) > datetime_SUB(@now , INTERVAL 1 hour)
+    ) e on x.taxi_update_time = e.mrt_update_time and x.mrt_stn_id = e.mrt_stn_id
+    """,
+    'sqlite': """
+    select x.taxi_st_id,  substr(x.taxi_st_id,5) taxi_st_num,  x.taxi_count, x.taxi_update_time, x.rainfall, x.mrt_stn_id, e.mrt_final_status, e.mrt_update_time
+    from (
+    select a.taxi_st_id, a.taxi_count, a.taxi_update_time, a.rainfall, d.mrt_stn_id
+    from (
+    SELECT ts_id as taxi_st_id, taxi_count, strftime('%Y-%m-%d %H:%M:00', timestamp) as taxi_update_time, rainfall
+    FROM h_taxi_stand_taxi_count
+    WHERE timestamp > datetime(:now, '+464 minutes')
+    ) a
+    left join
+    (
+    select taxi_st_id, mrt_stn as mrt_stn_id from c_mrt_stn_taxi_stand
+    where mrt_stn is not null
+    ) d on a.taxi_st_id = d.taxi_st_id
+    )x
+    left join
+    (
+    select stn_id as mrt_stn_id, final_status as mrt_final_status, strftime('%Y-%m-%d %H:%M:00', update_time) as mrt_update_time
+    from h_mrt_status_availability
+    where update_time > datetime(:now, '-1 hour')
     ) e on x.taxi_update_time = e.mrt_update_time and x.mrt_stn_id = e.mrt_stn_id
     """
-
-    taxi_df_pred = (
-        bqclient.query(query_string)
-        .result()
-        .to_dataframe(
-            # Optionally, explicitly request to use the BigQuery Storage API. As of
-            # google-cloud-bigquery version 1.26.0 and above, the BigQuery Storage
-            # API is used by default.
-            create_bqstorage_client=True,
-        )
-    )
+}
+
+@instrumented()
+def get_data(storage=None, now=None):
+    '''
+    Query the model input rows from the storage (BigQuery by default, see
+    taxi_compass.storage). now is the current UTC time, which the time
+    windows of the query are relative to.
+    '''
+    storage = storage or get_storage()
+    now = now or datetime.datetime.now(datetime.timezone.utc).replace(
+        tzinfo=None, microsecond=0)
+    params = {'now': now if storage.dialect == 'bigquery' else str(now)}
+    taxi_df_pred = storage.read(QUERY_DATA[storage.dialect], params)
+    for column in ["taxi_update_time", "mrt_update_time"]:
+        taxi_df_pred[column] = pd.to_datetime(taxi_df_pred[column])
     
     print("gbq query successful...")
     return taxi_df_pred
 
-def get_weekday(time):
-    time = time.weekday()
-    if time == 5 or time == 6:
-        return 1
-    return 0
-
-def preprocessing(taxi_df_pred):
-    df = taxi_df_pred[["taxi_st_num","taxi_update_time","taxi_count","rainfall","mrt_final_status"]].copy()
-    df["taxi_st_num"] = df["taxi_st_num"].astype('int64')
-    df = df.sort_values(by=["taxi_st_num", "taxi_update_time"],ascending=True).reset_index(drop=True)
-    df[["rainfall"]] = df[["rainfall"]].fillna(df.groupby(['taxi_st_num'])[["rainfall"]].ffill())
-    df[["mrt_final_status","rainfall"]] = df[["mrt_final_status","rainfall"]].fillna(value=0)
-    df = df.groupby(["taxi_st_num","taxi_update_time","taxi_count","rainfall"]).agg('min').reset_index().drop_duplicates(subset=["taxi_st_num","taxi_update_time"])
-    df = df.set_index(["taxi_st_num","taxi_update_time"])
-    df = df.groupby(level=0).apply(lambda x: x.reset_index(level=0, drop=True).asfreq("60S")).reset_index()
-    df[["taxi_count","rainfall","mrt_final_status"]] = df[["taxi_count","rainfall","mrt_final_status"]].fillna(df.groupby(['taxi_st_num'])[["taxi_count","rainfall","mrt_final_status"]].ffill())
-    df["hour"] = df["taxi_update_time"].dt.hour
-    df["minute"] = df["taxi_update_time"].dt.minute
-    df['hr_sin'] = np.sin(df["hour"]*(2.*np.pi/24))
-    df['hr_cos'] = np.cos(df["hour"]*(2.*np.pi/24))
-    df['min_sin'] = np.sin(df["minute"]*(2.*np.pi/60))
-    df['min_cos'] = np.cos(df["minute"]*(2.*np.pi/60))
-    df["taxi_update_time"] = df["taxi_update_time"].dt.tz_localize("Asia/Singapore")
-    df["weekend_bool"] = df.apply(lambda x : get_weekday(x["taxi_update_time"]), axis=1)
-    
-    print("preprocessing succesful...")
-    
-    return df
-
-def array_creation(df):
-    X_mas = np.array([])
-    X_mas_pred = pd.DataFrame()
-
-    bins = [0, 1, 2, 3, 4, 10000]
-    labels = [0, 1, 2, 3, 4]
-    for i in range(350):
-        print(i+1,len(df.loc[df["taxi_st_num"] == i+1]), "started...")
-        X = df.loc[df["taxi_st_num"] == i+1][["taxi_st_num","taxi_update_time","taxi_count", "rainfall","mrt_final_status",
-                                            "weekend_bool","hr_sin","hr_cos","min_sin","min_cos"]].copy()
-
-        X = X.dropna()
-        X_pred = X[["taxi_st_num","taxi_update_time"]]
-        
-        X = X.drop(columns=["taxi_update_time"]).to_numpy()
-        
-        X = X.reshape(1, X.shape[0], X.shape[1])
-        
-        if len(X_mas) == 0:
-            X_mas = X
-            X_mas_pred = X_pred
-        else:
-            X_mas = np.vstack((X_mas, X))
-            X_mas_pred = pd.concat([X_mas_pred, X_pred],ignore_index=True)
-
-    print("array creation successful...")
-    
-    return (X_mas, X_mas_pred)
-
 def predict_json(project, region, model, instances, version=None):
     """Send json data to a deployed model for prediction.
 
@@ -122,91 +91,81 @@ def predict_json(project, region, model, instances, version=None):
         project (str): project where the Cloud ML Engine Model is deployed.
         region (str): regional endpoint to use; set to None for ml.googleapis.com
         model (str): model name.
-        instances ([Mapping[str: Any]]): Keys should be the names of Tensors
-            your deployed model expects as inputs. Values should be datatypes
-            convertible to Tensors, or (potentially nested) lists of datatypes
-            convertible to tensors.
+        instances: rows of model inputs, a 2D array or list of lists.
         version: str, version of the model to target.
     Returns:
-        Mapping[str: any]: dictionary of prediction results defined by the
-            model.
+        numpy array with one prediction per instance.
     """
-    # Create the ML Engine service object.
-    # To authenticate set the environment variable
-    # GOOGLE_APPLICATION_CREDENTIALS=<path_to_service_account_file>
-    prefix = "{}-ml".format(region) if region else "ml"
-    api_endpoint = "https://{}.googleapis.com".format(prefix)
-    client_options = ClientOptions(api_endpoint=api_endpoint)
-    service = googleapiclient.discovery.build(
-        'ml', 'v1', client_options=client_options)
-    name = 'projects/{}/models/{}'.format(project, model)
-
-    if version is not None:
-        name += '/versions/{}'.format(version)
-
-    response = service.projects().predict(
-        name=name,
-        body={'instances': instances}
-    ).execute()
-
-    if 'error' in response:
-        raise RuntimeError(response['error'])
-
-    return response['predictions']
-
-def predict(X_mas, X_mas_pred):
+    # The client caches the ML Engine service objects and sends the rows
+    # in concurrent chunks, see taxi_compass.inference.RemotePredictor
+    predictor = get_remote_predictor(project,
+                                     region,
+                                     model,
+                                     version,
+                                     max_rows=PREDICT_CHUNK_ROWS,
+                                     max_workers=PREDICT_CONCURRENCY)
+    return predictor.predict(instances)
+
+@instrumented()
+def predict(X_mas, X_mas_pred, mask):
     PROJECT_ID = 'taxi-compass-lewagon'
     REGION = "asia-southeast1"
     MODEL = "xgb_class_model"
     MODEL_VERSION = "version3"
     
-    X_mas1 = X_mas.reshape(X_mas.shape[0]*X_mas.shape[1], 9)
-    pred = predict_json(PROJECT_ID, REGION, MODEL, X_mas1.tolist() , version=MODEL_VERSION)
+    # only the real rows, in the same order as X_mas_pred
+    X_mas1 = X_mas[mask]
+    if PREDICT_BACKEND == 'local':
+        pred = get_local_predictor(
+            batch_size=PREDICT_BATCH_SIZE,
+            n_threads=int(PREDICT_THREADS) if PREDICT_THREADS else None
+        ).predict(X_mas1)
+    else:
+        pred = predict_json(PROJECT_ID, REGION, MODEL, X_mas1, version=MODEL_VERSION)
     X_mas_pred["timestamp_pred"] = X_mas_pred["taxi_update_time"].dt.tz_localize(None) + pd.to_timedelta(15, unit='m')
     X_mas_pred["timestamp_pred"] = X_mas_pred["timestamp_pred"].astype(str)
     X_mas_pred["taxi_st_id"] = "kml_" + X_mas_pred["taxi_st_num"].astype("str")
     y_res = pd.concat((X_mas_pred[["taxi_st_id","timestamp_pred"]], pd.DataFrame(pred, columns=["taxi_count_pred"])), axis=1)
-    y_res["minute"] = y_res.groupby(['taxi_st_id']).cumcount()+1
     
     print("predict successful...")
     
     return y_res
 
-def delete_all_rows():
-    client = bigquery.Client()
-
-    dml_statement = (
-        "delete from `taxi-compass-lewagon.api_dataset.r_taxi_stand_pred` WHERE true")
-    query_job = client.query(dml_statement)  # API request
-    query_job.result()  # Waits for statement to finish
-    
-    print("delete successful...")
-    
-    return "delete successful..."
-    
-def insert_rows(y_res):
-    client = bigquery.Client(project='taxi-compass-lewagon')
-    table_id = 'api_dataset.r_taxi_stand_pred'
-    
-    job = client.load_table_from_dataframe(
-        y_res, table_id
-    )
-
-    job.result()  # Wait for the job to complete.
-
-    table = client.get_table(table_id)  # Make an API request.
-
-    print("insert successful...")
-    
-    return "insert successful..."
-
-def predicted_count():
-    taxi_df_pred = get_data()
-    df = preprocessing(taxi_df_pred)
-    X_mas, X_mas_pred = array_creation(df)
-    y_res = predict(X_mas, X_mas_pred)
-    delete_all_rows()
-    insert_rows(y_res)
+def merge_rows(y_res, storage=None):
+    '''
+    Upsert the new predictions into r_taxi_stand_pred keyed on
+    (taxi_st_id, timestamp_pred) and drop the horizons that are now in the
+    past. Unlike delete + reload, the table is never empty for the app and
+    only the changed rows are written. The new version marker then tells
+    the app's prediction cache to reload.
+
+    The rows carry no per-run column (like the position of the horizon in
+    the run), so a run one minute after the last one only inserts the new
+    horizon and deletes the expired one when the predictions are the same.
+    '''
+    storage = storage or get_storage()
+    with stage('merge_rows') as s:
+        storage.upsert('r_taxi_stand_pred',
+                       y_res,
+                       keys=['taxi_st_id', 'timestamp_pred'],
+                       expire_column='timestamp_pred',
+                       expire_before=y_res['timestamp_pred'].min())
+        write_version(storage, y_res)
+        s.record(y_res)
+
+    print("merge successful...")
+
+    return "merge successful..."
+
+def predicted_count(request=None, storage=None, now=None):
+    # stage timings are logged with TAXI_COMPASS_INSTRUMENT=summary/detailed
+    with run('predicted_count'):
+        storage = storage or get_storage()
+        taxi_df_pred = get_data(storage, now)
+        df = preprocessing(taxi_df_pred)
+        X_mas, X_mas_pred, mask = array_creation(df)
+        y_res = predict(X_mas, X_mas_pred, mask)
+        merge_rows(y_res, storage)
     
     print("all successful...")
     
@@ -1,38 +1,20 @@
-from google.cloud import bigquery
-import pandas as pd
-import numpy as np
 import requests
-import datetime
+
+from taxi_compass.feeds import TAXI_AVAILABILITY_URL, taxi_availability_frame
+from taxi_compass.storage import get_storage
 
 """
-    To query taxi location, every 5 minutes, then input to BigQuery
+    To query taxi location, every 5 minutes, then input to BigQuery (or the
+    local storage, see taxi_compass.storage)
 """
 
 if __name__ == "__main__":
 
     # Prepare dataframe
-    taxi_url = "https://api.data.gov.sg/v1/transport/taxi-availability"
-    r = requests.get(taxi_url)
-    coordinates = r.json()["features"][0]["geometry"]["coordinates"]
-    timestamp = r.json()["features"][0]["properties"]["timestamp"]
-    taxi_available = pd.DataFrame(np.array(coordinates), columns=["lon","lat"])
-    taxi_available["update_time"] = str(datetime.datetime.strptime(timestamp,"%Y-%m-%dT%H:%M:%S+08:00"))
-
-    client = bigquery.Client(project='taxi-compass-lewagon')
-    table_id = 'api_dataset.h_taxi_availability'
-    
-    job = client.load_table_from_dataframe(
-        taxi_available, table_id
-    )
-
-    job.result()  # Wait for the job to complete.
+    r = requests.get(TAXI_AVAILABILITY_URL)
+    taxi_available = taxi_availability_frame(r.json())
 
-    table = client.get_table(table_id)  # Make an API request.
-    print(
-        "Loaded {} rows and {} columns to {}".format(
-            table.num_rows, len(table.schema), table_id
-        )
-    )
+    get_storage().append('h_taxi_availability', taxi_available)
     
 # requirements: 
 # google-cloud-bigquery==2.31.0
@@ -1,44 +1,14 @@
-from google.cloud import bigquery
-import pandas as pd
-import numpy as np
 import requests
-import datetime
 
-if __name__ == "__main__":
-    gov = 'https://api.data.gov.sg/v1'
-    weather_api = '/environment/rainfall'
-
-    url = gov+weather_api
-    response = requests.get(url).json()
-
-    timestamp_str = response['items'][0]['timestamp']
-    timestamp = str(datetime.datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%S+08:00'))
-    weather_list = []
-    for index,value in enumerate(response['items'][0]['readings']):
-        weather_list.append(
-            {'station_id':response['metadata']['stations'][index]['id'], 
-            'station_lat':response['metadata']['stations'][index]['location']['latitude'],
-            'station_lon':response['metadata']['stations'][index]['location']['longitude'],
-            'rainfall':float(response['items'][0]['readings'][index]['value']),
-            'update_time': timestamp})
+from taxi_compass.feeds import RAINFALL_URL, rainfall_frame
+from taxi_compass.writer import get_writer
 
-    weather_df = pd.DataFrame(weather_list)
-
-    client = bigquery.Client(project='taxi-compass-lewagon')
-    table_id = 'api_dataset.h_weather_rainfall'
-
-    job = client.load_table_from_dataframe(
-        weather_df, table_id
-    )
+if __name__ == "__main__":
+    response = requests.get(RAINFALL_URL).json()
 
-    job.result()  # Wait for the job to complete.
+    weather_df = rainfall_frame(response)
 
-    table = client.get_table(table_id)  # Make an API request.
-    print(
-        "Loaded {} rows and {} columns to {}".format(
-            table.num_rows, len(table.schema), table_id
-        )
-    )
+    get_writer('h_weather_rainfall').write(weather_df)
     
 # requirements: 
 # google-cloud-bigquery==2.31.0
@@ -0,0 +1,223 @@
+'''
+The taxi stands compiled once into a binary catalog.
+
+Every consumer used to rebuild the taxi stands from the LTA geojson with a
+loop over its features (and a regex over every Description for the stand
+type). compile_catalog() does that once, together with the planning areas
+and the mrt stations of every stand from mrt_stn_taxi_st_id.csv, and writes
+a directory of .npy arrays with a meta.json:
+
+    ts_ids          fixed width unicode ids, geojson order
+    lat, lon        float64 degrees
+    lat_rad,        float64 radians, what StandIndex works with
+    lon_rad
+    type_code       int8 into meta['types']
+    pln_area_code   int16 into meta['pln_areas'], -1 when unknown
+    mrt_offsets,    the mrt stations of stand s are
+    mrt_codes       meta['mrt_stns'][mrt_codes[mrt_offsets[s]:
+                    mrt_offsets[s + 1]]]
+
+load_catalog() memory maps the arrays, so loading it takes milliseconds and
+the pages are shared by the processes reading it. meta.json records the
+format version and the md5 of the geojson the catalog was compiled from
+(base64, like GCS reports it) so a consumer can tell it is still current.
+
+    python -m taxi_compass.catalog      # recompile the bundled catalog
+'''
+import argparse
+import base64
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from taxi_compass.geo import StandIndex
+from taxi_compass.stands import (LOCAL_CATALOG_PATH,
+                                 LOCAL_TAXI_STAND_GEOJSON_PATH)
+
+CATALOG_FORMAT = 1
+
+CATALOG_PATH = LOCAL_CATALOG_PATH
+MRT_LINKS_PATH = 'raw_data/mrt_stn_taxi_st_id.csv'
+
+# Stand types of the LTA geojson, code 0 when the Description has none
+STAND_TYPES = ('', 'TAXI STAND', 'TAXI STOP', 'TAXI PICK UP')
+
+ARRAYS = ('ts_ids', 'lat', 'lon', 'lat_rad', 'lon_rad', 'type_code',
+          'pln_area_code', 'mrt_offsets', 'mrt_codes')
+
+
+def stand_types(descriptions):
+    '''
+    TAXI STAND, TAXI STOP or TAXI PICK UP from the html Description of every
+    feature, '' when there is none
+    '''
+    return pd.Series(descriptions).str.extract(
+        r'(TAXI STAND|TAXI STOP|TAXI PICK UP)', expand=False).fillna('')
+
+
+def geojson_md5(geojson_bytes):
+    return base64.b64encode(hashlib.md5(geojson_bytes).digest()).decode()
+
+
+def compile_catalog(geojson_bytes, mrt_links_df=None, resolver=None,
+                    path=CATALOG_PATH):
+    '''
+    Compile the LTA geojson (as bytes), the mrt_stn, taxi_st_id links and
+    the planning areas from resolver (a PlanningAreaResolver) into a catalog
+    at path. Returns the meta written
+    '''
+    features = json.loads(geojson_bytes)['features']
+    ts_ids = np.array([f['properties']['Name'] for f in features], dtype=str)
+    coordinates = np.array([f['geometry']['coordinates'][:2]
+                            for f in features], dtype=np.float64)
+    lon, lat = coordinates.T if len(features) else (np.empty(0), ) * 2
+    types = stand_types([f['properties'].get('Description', '')
+                         for f in features])
+    arrays = {
+        'ts_ids': ts_ids,
+        'lat': lat,
+        'lon': lon,
+        'lat_rad': np.deg2rad(lat),
+        'lon_rad': np.deg2rad(lon),
+        'type_code': types.map(STAND_TYPES.index).to_numpy(dtype=np.int8)
+    }
+
+    pln_areas = resolver.resolve(lat, lon) if resolver is not None \
+        else np.full(len(ts_ids), None, dtype=object)
+    pln_area_names = sorted({a for a in pln_areas if a is not None})
+    arrays['pln_area_code'] = np.array(
+        [-1 if a is None else pln_area_names.index(a) for a in pln_areas],
+        dtype=np.int16)
+
+    links = pd.DataFrame(columns=['mrt_stn', 'taxi_st_id']) \
+        if mrt_links_df is None else mrt_links_df.dropna()
+    stand = pd.Series(np.arange(len(ts_ids)), index=ts_ids)
+    links = links[links['taxi_st_id'].isin(stand.index)].assign(
+        stand=lambda d: stand[d['taxi_st_id']].to_numpy()).sort_values(
+            'stand', kind='stable')
+    mrt_stns = sorted(links['mrt_stn'].unique())
+    arrays['mrt_offsets'] = np.searchsorted(
+        links['stand'].to_numpy(), np.arange(len(ts_ids) + 1)).astype(
+            np.int32)
+    arrays['mrt_codes'] = np.searchsorted(
+        mrt_stns, links['mrt_stn'].to_numpy()).astype(np.int16)
+
+    meta = {
+        'format': CATALOG_FORMAT,
+        'geojson_md5': geojson_md5(geojson_bytes),
+        'stands': len(ts_ids),
+        'types': list(STAND_TYPES),
+        'pln_areas': pln_area_names,
+        'mrt_stns': mrt_stns
+    }
+    os.makedirs(path, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(path, f'{name}.npy'), arrays[name])
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return meta
+
+
+class StandCatalog:
+    '''
+    A compiled catalog, every array memory mapped read only
+    '''
+    def __init__(self, path=CATALOG_PATH):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['format'] != CATALOG_FORMAT:
+            raise ValueError(f'stand catalog at {path} has format '
+                             f'{self.meta["format"]}, expected '
+                             f'{CATALOG_FORMAT}, recompile it')
+        for name in ARRAYS:
+            setattr(self, name,
+                    np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r'))
+        self.version = ('catalog', self.meta['geojson_md5'])
+
+    def __len__(self):
+        return len(self.ts_ids)
+
+    def ts_df(self):
+        '''
+        ts_id, lat, lon of every taxi stand, like parse_taxi_stands
+        '''
+        return pd.DataFrame({
+            'ts_id': self.ts_ids.astype(object),
+            'lat': np.asarray(self.lat),
+            'lon': np.asarray(self.lon)
+        })
+
+    def index(self):
+        return StandIndex(self.ts_ids.astype(object), self.lat, self.lon,
+                          self.lat_rad, self.lon_rad)
+
+    def stand_types(self):
+        return np.array(self.meta['types'], dtype=object)[self.type_code]
+
+    def pln_areas(self):
+        '''
+        Planning area of every taxi stand, None when it is not known
+        '''
+        names = np.array(self.meta['pln_areas'] + [None], dtype=object)
+        return names[self.pln_area_code]
+
+    def stand_stop_df(self):
+        '''
+        The rows of c_taxi_stand
+        '''
+        return pd.DataFrame({
+            'taxi_st_type': self.stand_types(),
+            'taxi_st_lat': np.asarray(self.lat),
+            'taxi_st_lon': np.asarray(self.lon),
+            'taxi_pln_area': self.pln_areas()
+        })
+
+    def mrt_links(self):
+        '''
+        mrt_stn, taxi_st_id of every taxi stand near an mrt station
+        '''
+        stand = np.repeat(np.arange(len(self)), np.diff(self.mrt_offsets))
+        return pd.DataFrame({
+            'mrt_stn': np.array(self.meta['mrt_stns'],
+                                dtype=object)[self.mrt_codes],
+            'taxi_st_id': self.ts_ids[stand].astype(object)
+        })
+
+
+default_catalog = None
+
+
+def load_catalog(path=CATALOG_PATH):
+    '''
+    The StandCatalog at path, kept for the process when it is the bundled
+    one
+    '''
+    global default_catalog
+    if path != CATALOG_PATH:
+        return StandCatalog(path)
+    if default_catalog is None:
+        default_catalog = StandCatalog(path)
+    return default_catalog
+
+
+def main(argv=None):
+    from taxi_compass.planning_area import PlanningAreaResolver
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--geojson', default=LOCAL_TAXI_STAND_GEOJSON_PATH)
+    parser.add_argument('--mrt-links', default=MRT_LINKS_PATH)
+    parser.add_argument('--output', default=CATALOG_PATH)
+    args = parser.parse_args(argv)
+
+    with open(args.geojson, 'rb') as f:
+        geojson_bytes = f.read()
+    mrt_links_df = pd.read_csv(args.mrt_links, encoding='utf-8-sig')
+    meta = compile_catalog(geojson_bytes, mrt_links_df,
+                           PlanningAreaResolver(), args.output)
+    print(f'compiled {meta["stands"]} taxi stands into {args.output}')
+
+
+if __name__ == '__main__':
+    main()
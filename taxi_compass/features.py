@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from taxi_compass.geo import group_rank
+from taxi_compass.instrument import instrumented
+
+ONE_MINUTE = pd.Timedelta(minutes=1)
+
+
+def minute_grid(df):
+    '''
+    (taxi_st_num, taxi_update_time) MultiIndex with every minute from the
+    first to the last update of each taxi stand, the same rows asfreq("60s")
+    gives stand by stand, built in one go with repeat + arange
+    '''
+    bounds = df.groupby('taxi_st_num', sort=True)['taxi_update_time'].agg(
+        ['min', 'max'])
+    steps = ((bounds['max'] - bounds['min']) // ONE_MINUTE).to_numpy() + 1
+    stand = np.repeat(bounds.index.to_numpy(), steps)
+    offset = group_rank(stand)
+    first = np.repeat(bounds['min'].to_numpy(), steps)
+    times = first + offset * ONE_MINUTE.to_timedelta64()
+    return pd.MultiIndex.from_arrays([stand, times],
+                                     names=['taxi_st_num', 'taxi_update_time'])
+
+
+@instrumented()
+def preprocessing(taxi_df_pred):
+    '''
+    Clean the rows of get_data into one row per taxi stand per minute with
+    the time features the model expects.
+
+    Minutes missing for a taxi stand are added with a single reindex over
+    the (taxi stand x minute) grid and filled forward within each taxi
+    stand, and weekend_bool comes from .dt.weekday, so there is no Python
+    level loop over groups or rows.
+    '''
+    filled = ["taxi_count", "rainfall", "mrt_final_status"]
+    df = taxi_df_pred[["taxi_st_num", "taxi_update_time", "taxi_count",
+                       "rainfall", "mrt_final_status"]].copy()
+    df["taxi_st_num"] = df["taxi_st_num"].astype('int64')
+    df = df.sort_values(by=["taxi_st_num", "taxi_update_time"],
+                        ascending=True).reset_index(drop=True)
+    df[["rainfall"]] = df[["rainfall"]].fillna(
+        df.groupby(['taxi_st_num'])[["rainfall"]].ffill())
+    df[["mrt_final_status", "rainfall"]] = df[["mrt_final_status",
+                                               "rainfall"]].fillna(value=0)
+    df = df.groupby(["taxi_st_num", "taxi_update_time", "taxi_count",
+                     "rainfall"]).agg('min').reset_index().drop_duplicates(
+                         subset=["taxi_st_num", "taxi_update_time"])
+    df = df.set_index(["taxi_st_num", "taxi_update_time"]).reindex(
+        minute_grid(df)).reset_index()
+    df[filled] = df[filled].fillna(df.groupby(['taxi_st_num'])[filled].ffill())
+    df["hour"] = df["taxi_update_time"].dt.hour
+    df["minute"] = df["taxi_update_time"].dt.minute
+    df['hr_sin'] = np.sin(df["hour"] * (2. * np.pi / 24))
+    df['hr_cos'] = np.cos(df["hour"] * (2. * np.pi / 24))
+    df['min_sin'] = np.sin(df["minute"] * (2. * np.pi / 60))
+    df['min_cos'] = np.cos(df["minute"] * (2. * np.pi / 60))
+    df["taxi_update_time"] = df["taxi_update_time"].dt.tz_localize(
+        "Asia/Singapore")
+    df["weekend_bool"] = (df["taxi_update_time"].dt.weekday >= 5).astype(
+        'int64')
+
+    print("preprocessing succesful...")
+
+    return df
+
+
+# Model inputs, in the order the model was trained with
+FEATURE_COLUMNS = [
+    "taxi_st_num", "taxi_count", "rainfall", "mrt_final_status",
+    "weekend_bool", "hr_sin", "hr_cos", "min_sin", "min_cos"
+]
+
+
+@instrumented()
+def array_creation(df, stands=None, dtype=np.float32):
+    '''
+    Build the (stands, timesteps, features) model input from preprocessing.
+
+    Rows are sorted by taxi stand once and written straight into a
+    preallocated array, each taxi stand in its own slice, in the order of
+    stands (every taxi_st_num in df by default). Taxi stands with fewer
+    minutes are padded with zeros at the end and mask tells which cells
+    hold real rows, so X_mas[mask] gives the rows in the same order as
+    X_mas_pred, the (taxi_st_num, taxi_update_time) of each of them.
+    '''
+    X = df[["taxi_st_num", "taxi_update_time"] + FEATURE_COLUMNS[1:]].dropna()
+    if stands is None:
+        stands = np.unique(X["taxi_st_num"].to_numpy())
+    stands = pd.Index(stands)
+
+    stand_pos = stands.get_indexer(X["taxi_st_num"])
+    order = np.argsort(stand_pos, kind='stable')
+    order = order[stand_pos[order] >= 0]
+    stand_pos = stand_pos[order]
+    step = group_rank(stand_pos)
+    timesteps = int(step.max()) + 1 if len(step) else 0
+
+    X_mas = np.zeros((len(stands), timesteps, len(FEATURE_COLUMNS)),
+                     dtype=dtype)
+    mask = np.zeros((len(stands), timesteps), dtype=bool)
+    X_mas[stand_pos, step] = X[FEATURE_COLUMNS].to_numpy(dtype=dtype)[order]
+    mask[stand_pos, step] = True
+    X_mas_pred = X[["taxi_st_num",
+                    "taxi_update_time"]].iloc[order].reset_index(drop=True)
+
+    print("array creation successful...")
+
+    return (X_mas, X_mas_pred, mask)
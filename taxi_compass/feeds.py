@@ -0,0 +1,230 @@
+'''
+The public feeds the collectors read, and how each response becomes the
+rows of its table
+'''
+import datetime
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+GOV_API_URL = 'https://api.data.gov.sg/v1'
+TAXI_AVAILABILITY_URL = GOV_API_URL + '/transport/taxi-availability'
+RAINFALL_URL = GOV_API_URL + '/environment/rainfall'
+TRAIN_SERVICE_ALERTS_URL = ('http://datamall2.mytransport.sg/ltaodataservice/'
+                            'TrainServiceAlerts')
+
+BUCKET_NAME = 'static-file-storage'
+BUCKET_MRT_STN_LIST_PATH = 'mrtsg.csv'
+# Local copy of the mrt station list, read instead of the bucket when set
+MRT_LIST_PATH = os.environ.get('TAXI_COMPASS_MRT_LIST_PATH')
+
+
+def parse_gov_timestamp(timestamp_str):
+    return datetime.datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%S+08:00')
+
+
+def taxi_availability_frame(response):
+    '''
+    Rows of h_taxi_availability from the data.gov.sg taxi-availability json
+    '''
+    feature = response["features"][0]
+    coordinates = feature["geometry"]["coordinates"]
+    timestamp = feature["properties"]["timestamp"]
+    taxi_available = pd.DataFrame(np.array(coordinates).reshape(-1, 2),
+                                  columns=["lon", "lat"])
+    taxi_available["update_time"] = str(parse_gov_timestamp(timestamp))
+    return taxi_available
+
+
+def rainfall_frame(response):
+    '''
+    Rows of h_weather_rainfall from the data.gov.sg rainfall json, one per
+    weather station
+    '''
+    timestamp = str(parse_gov_timestamp(response['items'][0]['timestamp']))
+    stations = response['metadata']['stations']
+    readings = response['items'][0]['readings']
+    return pd.DataFrame({
+        'station_id': [stations[i]['id'] for i in range(len(readings))],
+        'station_lat':
+        [stations[i]['location']['latitude'] for i in range(len(readings))],
+        'station_lon':
+        [stations[i]['location']['longitude'] for i in range(len(readings))],
+        'rainfall': [float(reading['value']) for reading in readings],
+        'update_time': timestamp
+    })
+
+
+def load_mrt_list(path=MRT_LIST_PATH):
+    '''
+    The mrt stations with their first and last train, from path or from the
+    bucket
+    '''
+    if path:
+        return pd.read_csv(path).fillna(1)
+    from google.cloud import storage
+    storage_client = storage.Client()
+    bucket = storage_client.bucket(BUCKET_NAME)
+    blob = bucket.blob(BUCKET_MRT_STN_LIST_PATH)
+    with blob.open('r') as mrt_csv:
+        return pd.read_csv(mrt_csv).fillna(1)
+
+
+# A last train before this time of day runs after midnight, on the next day
+LAST_TRAIN_WRAP = 2 * 3600
+SECONDS_PER_DAY = 24 * 3600
+
+# The mrt station list is read again after this many seconds
+MRT_LIST_REFRESH_SECONDS = int(
+    os.environ.get('TAXI_COMPASS_MRT_LIST_REFRESH_SECONDS', 3600))
+
+mrt_schedule = None
+mrt_schedule_loaded_at = None
+
+
+def seconds_of_day(times):
+    '''
+    H:MM:SS strings as seconds since midnight, NaN for anything else
+    '''
+    parts = pd.Series(times).astype(str).str.extract(
+        r'^(\d{1,2}):(\d{2}):(\d{2})$').astype(np.float64)
+    return (parts[0] * 3600 + parts[1] * 60 + parts[2]).to_numpy()
+
+
+def affected_stations(alerts):
+    '''
+    Station ids in the segments of a TrainServiceAlerts json that is not
+    normal service (Status 1)
+    '''
+    if alerts["value"]["Status"] == 1:
+        return []
+    stations_list = []
+    for d in alerts["value"]["AffectedSegments"]:
+        stations_list += d["Stations"].split(",")
+    return stations_list
+
+
+class MrtSchedule:
+    '''
+    The first and last train of every station of the mrt station list as
+    seconds of the day, parsed once, so the status of all the stations at
+    any minutes is a few array comparisons.
+
+    A last train before LAST_TRAIN_WRAP (2am) runs after midnight: it is
+    stored as seconds after the midnight starting the service day, e.g.
+    0:13:00 as 87180, and a time of day t is also checked as t + 24h
+    against it, to catch the end of the previous day's service.
+    '''
+    def __init__(self, mrt_list_df):
+        self.stations = mrt_list_df.reset_index(drop=True)
+        self.stn_ids = self.stations['stn_id'].to_numpy()
+        self.first = seconds_of_day(self.stations['stn_first_train'])
+        last = seconds_of_day(self.stations['stn_last_train'])
+        self.last = np.where(last < LAST_TRAIN_WRAP, last + SECONDS_PER_DAY,
+                             last)
+        self.non_disruption = self.stations['non_disruption_bool'].to_numpy(
+            dtype=np.float64)
+
+    def __len__(self):
+        return len(self.stn_ids)
+
+    def in_operation(self, update_times):
+        '''
+        (times, stations) 1.0 where the station is between its first and
+        last train at that time, 0.0 otherwise (also when the schedule of
+        the station could not be read)
+        '''
+        update_times = pd.DatetimeIndex(np.atleast_1d(update_times))
+        t = ((update_times - update_times.normalize()) /
+             pd.Timedelta(seconds=1)).to_numpy()[:, None]
+        today = (self.first <= t) & (t <= self.last)
+        after_midnight = t + SECONDS_PER_DAY <= self.last
+        return (today | after_midnight).astype(np.float64)
+
+    def disruption(self, alerts):
+        '''
+        non_disruption_bool of every station: 0 in the affected segments of
+        alerts, the station list value elsewhere
+        '''
+        affected = np.isin(self.stn_ids, affected_stations(alerts))
+        return np.where(affected, 0.0, self.non_disruption)
+
+    def status_frame(self, alerts, update_time):
+        '''
+        Rows of h_mrt_status_availability: every station with whether it is
+        in operation at update_time (Singapore time) and not in a segment
+        affected by the TrainServiceAlerts json
+        '''
+        mrt_list_df = self.stations.copy()
+        mrt_list_df["in_operation_bool"] = self.in_operation(update_time)[0]
+        mrt_list_df["non_disruption_bool"] = self.disruption(alerts)
+        mrt_list_df["final_status"] = mrt_list_df["in_operation_bool"] * \
+            mrt_list_df["non_disruption_bool"]
+        mrt_list_df["update_time"] = update_time.strftime("%Y-%m-%d %H:%M:%S")
+        return mrt_list_df
+
+    def history_frame(self, start, minutes, alerts=None):
+        '''
+        Rows of h_mrt_status_availability for every minute from start on,
+        to back-fill training data: the schedule of every minute, and the
+        disruptions of alerts (the station list values without it) for all
+        of them. Minute by minute, then station by station
+        '''
+        update_times = pd.date_range(pd.Timestamp(start).floor('min'),
+                                     periods=minutes,
+                                     freq='min')
+        in_operation = self.in_operation(update_times)
+        non_disruption = self.non_disruption if alerts is None \
+            else self.disruption(alerts)
+        history = self.stations.iloc[np.tile(np.arange(len(self)),
+                                             minutes)].reset_index(drop=True)
+        history["in_operation_bool"] = in_operation.ravel()
+        history["non_disruption_bool"] = np.tile(non_disruption, minutes)
+        history["final_status"] = history["in_operation_bool"] * \
+            history["non_disruption_bool"]
+        history["update_time"] = np.repeat(
+            update_times.strftime("%Y-%m-%d %H:%M:%S"), len(self))
+        return history
+
+
+def get_mrt_schedule(path=MRT_LIST_PATH, clock=time.monotonic):
+    '''
+    The process wide MrtSchedule, read again from path (or the bucket) every
+    MRT_LIST_REFRESH_SECONDS instead of at every call
+    '''
+    global mrt_schedule, mrt_schedule_loaded_at
+    now = clock()
+    if mrt_schedule is None or \
+            now - mrt_schedule_loaded_at >= MRT_LIST_REFRESH_SECONDS:
+        mrt_schedule = MrtSchedule(load_mrt_list(path))
+        mrt_schedule_loaded_at = now
+        print('loaded mrt_list file successfully')
+    return mrt_schedule
+
+
+def mrt_status_frame(mrt_list, alerts, update_time):
+    '''
+    Rows of h_mrt_status_availability at update_time (Singapore time), see
+    MrtSchedule.status_frame. mrt_list is a MrtSchedule or the station list
+    '''
+    if not isinstance(mrt_list, MrtSchedule):
+        mrt_list = MrtSchedule(mrt_list)
+    return mrt_list.status_frame(alerts, update_time)
+
+
+def stand_count_frame(ts_df, counts, timestamp, rainfall=None):
+    '''
+    Rows of h_taxi_stand_taxi_count: ts_df (ts_id, lat, lon) with the
+    taxi_count of every taxi stand at timestamp, and its rainfall (see
+    taxi_compass.rainfall), empty when not known
+    '''
+    tmp_taxi_stand_counter = pd.DataFrame({
+        'ts_id': ts_df['ts_id'].tolist(),
+        'taxi_count': counts
+    })
+    tmp_taxi_stand_counter['timestamp'] = timestamp
+    tmp_taxi_stand_counter['rainfall'] = np.nan if rainfall is None \
+        else np.asarray(rainfall, dtype=np.float64)
+    return ts_df.merge(tmp_taxi_stand_counter)
@@ -0,0 +1,281 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_KM = 6371
+
+
+def haversine_km(lat1_rad, lon1_rad, lat2_rad, lon2_rad):
+    '''
+    Great circle distance in km between points given in radians.
+    Works with scalars or any arrays that broadcast together.
+    '''
+    dlat = lat2_rad - lat1_rad
+    dlon = lon2_rad - lon1_rad
+    d = np.sin(dlat / 2)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(
+        dlon / 2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(d))
+
+
+def to_unit_sphere(lat_rad, lon_rad):
+    '''
+    Convert lat,lon (radians) into x,y,z points on the unit sphere.
+    The straight line (chord) distance between two of these points grows
+    with the great circle distance, so a plain KD-tree can answer
+    "within R km" questions exactly.
+    '''
+    cos_lat = np.cos(lat_rad)
+    return np.column_stack(
+        (cos_lat * np.cos(lon_rad), cos_lat * np.sin(lon_rad),
+         np.sin(lat_rad)))
+
+
+def chord_length(distance_km):
+    '''
+    Chord length on the unit sphere for a great circle distance in km
+    '''
+    return 2 * np.sin(np.asarray(distance_km) / (2 * EARTH_RADIUS_KM))
+
+
+def chord_to_km(chord):
+    '''
+    Great circle distance in km for a chord length on the unit sphere
+    '''
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def group_rank(group_ids):
+    '''
+    Position of every element inside its group, for group_ids already sorted
+    so that each group is contiguous, e.g. [3, 3, 5, 8, 8, 8] -> [0, 1, 0, 0,
+    1, 2]
+    '''
+    group_ids = np.asarray(group_ids)
+    if group_ids.size == 0:
+        return np.array([], dtype=np.intp)
+    group_start = np.r_[0, np.flatnonzero(np.diff(group_ids)) + 1]
+    group_size = np.diff(np.r_[group_start, group_ids.size])
+    return np.arange(group_ids.size) - np.repeat(group_start, group_size)
+
+
+def count_taxis_per_stand(taxi_coords, stand_coords, cutoff_distance,
+                          max_stands=None, chunk_size=2048):
+    '''
+    Pure NumPy batch counting: number of taxis closer than cutoff_distance
+    (km) to each taxi stand.
+
+    taxi_coords is a (N, 2) array and stand_coords a (M, 2) array, both with
+    lat, lon columns in degrees. Taxis are processed chunk_size at a time
+    against all the taxi stands with broadcasting, so peak memory stays
+    around chunk_size * M floats no matter how big the fleet is. When
+    max_stands is given, a taxi only counts for its nearest max_stands
+    taxi stands under the cutoff.
+    '''
+    taxi_rad = np.deg2rad(np.asarray(taxi_coords, dtype=np.float64))
+    stand_rad = np.deg2rad(np.asarray(stand_coords, dtype=np.float64))
+    taxi_rad = taxi_rad.reshape(-1, 2)
+    stand_lat, stand_lon = stand_rad[:, 0], stand_rad[:, 1]
+    stand_cos_lat = np.cos(stand_lat)
+    n_stands = len(stand_rad)
+
+    stand_hits = []
+    for start in range(0, len(taxi_rad), chunk_size):
+        chunk = taxi_rad[start:start + chunk_size]
+        lat = chunk[:, 0:1]
+        lon = chunk[:, 1:2]
+        d = np.sin((stand_lat - lat) / 2)**2 + np.cos(lat) * stand_cos_lat * \
+            np.sin((stand_lon - lon) / 2)**2
+        distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(d))
+        inside = distance < cutoff_distance
+        if max_stands is not None and max_stands < n_stands:
+            crowded = inside.sum(axis=1) > max_stands
+            if crowded.any():
+                kth = np.partition(distance[crowded], max_stands - 1,
+                                   axis=1)[:, max_stands - 1:max_stands]
+                inside[crowded] &= distance[crowded] <= kth
+        stand_hits.append(np.nonzero(inside)[1])
+
+    if not stand_hits:
+        return np.zeros(n_stands, dtype=np.int64)
+    return np.bincount(np.concatenate(stand_hits), minlength=n_stands)
+
+
+class StandIndex:
+    '''
+    Spatial index over the static taxi stands.
+
+    Taxi stands do not move, so we build a KD-tree over them once per process
+    and then assign a whole snapshot of taxis in one batched query instead of
+    computing the distance of every taxi against every taxi stand.
+
+    lat_rad and lon_rad, when the caller already has them (the compiled stand
+    catalog stores them), are used as they are instead of converted again.
+    '''
+    def __init__(self, ts_ids, lat, lon, lat_rad=None, lon_rad=None):
+        self.ts_ids = np.asarray(ts_ids)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat_rad = np.deg2rad(self.lat) if lat_rad is None \
+            else np.asarray(lat_rad, dtype=np.float64)
+        self.lon_rad = np.deg2rad(self.lon) if lon_rad is None \
+            else np.asarray(lon_rad, dtype=np.float64)
+        self.tree = cKDTree(to_unit_sphere(self.lat_rad, self.lon_rad))
+
+    @classmethod
+    def from_dataframe(cls, ts_df):
+        '''
+        Build the index from a ts_df with ts_id, lat and lon columns
+        '''
+        return cls(ts_df['ts_id'].to_numpy(), ts_df['lat'].to_numpy(),
+                   ts_df['lon'].to_numpy())
+
+    def __len__(self):
+        return len(self.ts_ids)
+
+    def query_radius(self, taxi_lat, taxi_lon, cutoff_distance,
+                     max_stands=None):
+        '''
+        Find every (origin, taxi stand) pair closer than cutoff_distance (km).
+
+        Returns three aligned arrays: origin position, taxi stand position and
+        distance in km, ordered by origin and then by distance. When
+        max_stands is given, only the nearest max_stands taxi stands are kept
+        per origin. cutoff_distance and max_stands can be a single value or
+        one value per origin.
+        '''
+        taxi_lat_rad = np.deg2rad(
+            np.atleast_1d(np.asarray(taxi_lat, dtype=np.float64)))
+        taxi_lon_rad = np.deg2rad(
+            np.atleast_1d(np.asarray(taxi_lon, dtype=np.float64)))
+        empty = (np.array([], dtype=np.intp), np.array([], dtype=np.intp),
+                 np.array([], dtype=np.float64))
+        if taxi_lat_rad.size == 0:
+            return empty
+        cutoff_distance = np.broadcast_to(
+            np.asarray(cutoff_distance, dtype=np.float64), taxi_lat_rad.shape)
+
+        # The tree only shortlists candidates (with a small margin for
+        # rounding), the exact haversine decides who is inside the cutoff
+        taxi_tree = cKDTree(to_unit_sphere(taxi_lat_rad, taxi_lon_rad))
+        radius = chord_length(cutoff_distance.max()) * (1 + 1e-9) + 1e-12
+        pairs = taxi_tree.sparse_distance_matrix(self.tree,
+                                                 radius,
+                                                 output_type='ndarray')
+        taxi_idx = pairs['i'].astype(np.intp)
+        stand_idx = pairs['j'].astype(np.intp)
+        distance = haversine_km(taxi_lat_rad[taxi_idx],
+                                taxi_lon_rad[taxi_idx],
+                                self.lat_rad[stand_idx],
+                                self.lon_rad[stand_idx])
+        inside = distance < cutoff_distance[taxi_idx]
+        taxi_idx, stand_idx, distance = (taxi_idx[inside], stand_idx[inside],
+                                         distance[inside])
+        if taxi_idx.size == 0:
+            return empty
+
+        order = np.lexsort((stand_idx, distance, taxi_idx))
+        taxi_idx, stand_idx, distance = (taxi_idx[order], stand_idx[order],
+                                         distance[order])
+        if max_stands is not None:
+            max_stands = np.broadcast_to(np.asarray(max_stands),
+                                         taxi_lat_rad.shape)
+            keep = group_rank(taxi_idx) < max_stands[taxi_idx]
+            taxi_idx, stand_idx, distance = (taxi_idx[keep], stand_idx[keep],
+                                             distance[keep])
+        return taxi_idx, stand_idx, distance
+
+    def count_within(self, taxi_lat, taxi_lon, cutoff_distance,
+                     max_stands=None):
+        '''
+        Number of taxis closer than cutoff_distance (km) to each taxi stand,
+        aligned with ts_ids
+        '''
+        _, stand_idx, _ = self.query_radius(taxi_lat, taxi_lon,
+                                            cutoff_distance, max_stands)
+        return np.bincount(stand_idx, minlength=len(self))
+
+    def query_knn(self, lat, lon, k):
+        '''
+        The k nearest taxi stands of every origin. Returns two (n, k) arrays,
+        taxi stand positions and distances in km, nearest first.
+        '''
+        lat_rad = np.deg2rad(np.atleast_1d(np.asarray(lat, dtype=np.float64)))
+        lon_rad = np.deg2rad(np.atleast_1d(np.asarray(lon, dtype=np.float64)))
+        k = min(k, len(self))
+        if k <= 0:
+            return (np.zeros((len(lat_rad), 0), dtype=np.intp),
+                    np.zeros((len(lat_rad), 0)))
+        chord, stand_idx = self.tree.query(to_unit_sphere(lat_rad, lon_rad),
+                                           k=k)
+        chord = np.asarray(chord).reshape(len(lat_rad), k)
+        stand_idx = np.asarray(stand_idx).reshape(len(lat_rad), k)
+        return stand_idx, chord_to_km(chord)
+
+    def nearest(self, lat, lon, k):
+        '''
+        Ids and distances (km) of the k nearest taxi stands of one origin
+        '''
+        stand_idx, distance = self.query_knn(lat, lon, k)
+        return self.ts_ids[stand_idx[0]], distance[0]
+
+    def within(self, lat, lon, radius_km):
+        '''
+        Ids and distances (km) of all the taxi stands closer than radius_km
+        to one origin, nearest first
+        '''
+        _, stand_idx, distance = self.query_radius(lat, lon, radius_km)
+        return self.ts_ids[stand_idx], distance
+
+
+def idw_weights(distance, power=2):
+    '''
+    Inverse distance weights of the (n, k) distances of n origins to their
+    k nearest points, every row summing to 1. A point at distance 0 takes
+    the whole weight of its row.
+    '''
+    distance = np.asarray(distance, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        inverse = distance**-float(power)
+    exact = distance == 0
+    hit = exact.any(axis=1)
+    inverse[hit] = exact[hit]
+    total = inverse.sum(axis=1, keepdims=True)
+    return np.divide(inverse, total, out=np.zeros_like(inverse),
+                     where=total > 0)
+
+
+def nearest_facilities(stand_ids, stand_lat, stand_lon, facility_ids,
+                       facility_lat, facility_lon, k=1, power=2,
+                       max_distance=None):
+    '''
+    The k nearest facilities (weather stations, mrt stations or any other
+    point layer) of every taxi stand, from one KD-tree query over the
+    facilities instead of the distance of every taxi stand to every
+    facility.
+
+    Returns a DataFrame with one row per (taxi stand, facility): ts_id,
+    facility_id, rank (0 for the nearest), distance in km, and the inverse
+    distance weight of the facility among the k of its taxi stand, to
+    interpolate a reading of the facilities at the taxi stand. Facilities
+    farther than max_distance (km) are left out, a taxi stand with none
+    closer has no rows.
+    '''
+    facilities = StandIndex(facility_ids, facility_lat, facility_lon)
+    stand_ids = np.asarray(stand_ids)
+    if len(facilities) and len(stand_ids):
+        facility_idx, distance = facilities.query_knn(stand_lat, stand_lon, k)
+    else:
+        facility_idx = np.zeros((len(stand_ids), 0), dtype=np.intp)
+        distance = np.zeros((len(stand_ids), 0))
+    keep = np.ones(distance.shape, dtype=bool)
+    if max_distance is not None:
+        keep = distance <= max_distance
+    weight = idw_weights(np.where(keep, distance, np.inf), power)
+    k = distance.shape[1]
+    return pd.DataFrame({
+        'ts_id': np.repeat(stand_ids, k)[keep.ravel()],
+        'facility_id': facilities.ts_ids[facility_idx[keep]],
+        'rank': np.tile(np.arange(k), len(stand_ids))[keep.ravel()],
+        'distance': distance[keep],
+        'weight': weight[keep]
+    })
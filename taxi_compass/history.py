@@ -0,0 +1,186 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Where the collectors also keep the count history on disk, unset to only
+# write to the storage
+HISTORY_DIR = os.environ.get('TAXI_COMPASS_HISTORY_DIR')
+
+MINUTES_PER_DAY = 24 * 60
+ONE_MINUTE = pd.Timedelta(minutes=1)
+
+
+class CountHistory:
+    '''
+    Taxi counts of h_taxi_stand_taxi_count as a (taxi stand x minute)
+    matrix on disk.
+
+    Every day is one .npy file of shape (taxi stands, 1440), opened as a
+    memory map, where cell [s, m] is the count of taxi stand s at minute m
+    of that day (Singapore time, like the timestamp column). uint8 takes
+    about 0.5 MB per day for 350 taxi stands; counts above the largest value
+    of the dtype are clipped to it, use dtype='uint16' if that matters. The
+    largest value itself marks a minute with no snapshot (MISSING).
+
+    stands.csv is the taxi stand dictionary: the row of a ts_id in the
+    matrix and its lat, lon. New taxi stands are added at the end, so the
+    rows of older days never move.
+
+    window() of one day is a view on the memory map, so reading the last
+    minutes for a prediction or a range of days for training only touches
+    those cells, no scan over rows.
+    '''
+    def __init__(self, root, dtype='uint8'):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        meta_path = os.path.join(root, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                dtype = json.load(f)['dtype']
+        else:
+            with open(meta_path, 'w') as f:
+                json.dump({'dtype': dtype}, f)
+        self.dtype = np.dtype(dtype)
+        self.MISSING = np.iinfo(self.dtype).max
+        self.days = {}
+
+        stands_path = os.path.join(root, 'stands.csv')
+        if os.path.exists(stands_path):
+            self.stands = pd.read_csv(stands_path)
+        else:
+            self.stands = pd.DataFrame({'ts_id': [], 'lat': [], 'lon': []})
+        self.stand_ids = pd.Index(self.stands['ts_id'])
+
+    def __len__(self):
+        return len(self.stands)
+
+    def add_stands(self, ts_df):
+        '''
+        Add the taxi stands of ts_df (ts_id, lat, lon) that are not in the
+        dictionary yet, and return the matrix row of every row of ts_df
+        '''
+        ts_df = ts_df[['ts_id', 'lat', 'lon']]
+        new = ts_df[self.stand_ids.get_indexer(ts_df['ts_id']) < 0]
+        new = new.drop_duplicates('ts_id')
+        if len(new):
+            self.stands = pd.concat([self.stands, new], ignore_index=True)
+            self.stand_ids = pd.Index(self.stands['ts_id'])
+            path = os.path.join(self.root, 'stands.csv')
+            self.stands.to_csv(path + '.tmp', index=False)
+            os.replace(path + '.tmp', path)
+        return self.stand_ids.get_indexer(ts_df['ts_id'])
+
+    def day_path(self, day):
+        return os.path.join(self.root, f'{day:%Y-%m-%d}.npy')
+
+    def day(self, day, create=False):
+        '''
+        Memory map of one day, grown to the current number of taxi stands
+        when it was created with fewer. None if there is no file and create
+        is False
+        '''
+        day = pd.Timestamp(day).normalize()
+        matrix = self.days.get(day)
+        if matrix is not None and matrix.shape[0] >= len(self):
+            return matrix
+        path = self.day_path(day)
+        if os.path.exists(path):
+            matrix = np.load(path, mmap_mode='r+')
+            if matrix.shape[0] < len(self):
+                grown = np.full((len(self), MINUTES_PER_DAY), self.MISSING,
+                                dtype=self.dtype)
+                grown[:matrix.shape[0]] = matrix
+                np.save(path + '.tmp.npy', grown)
+                os.replace(path + '.tmp.npy', path)
+                matrix = np.load(path, mmap_mode='r+')
+        elif create:
+            matrix = np.lib.format.open_memmap(path,
+                                               mode='w+',
+                                               dtype=self.dtype,
+                                               shape=(len(self),
+                                                      MINUTES_PER_DAY))
+            matrix[:] = self.MISSING
+        else:
+            return None
+        self.days[day] = matrix
+        return matrix
+
+    def write(self, stand_idx, timestamps, counts):
+        '''
+        Store counts at (stand_idx, minute of timestamps), one value per
+        element of the three arrays
+        '''
+        minutes = pd.DatetimeIndex(timestamps).floor('min')
+        days = minutes.normalize()
+        offset = ((minutes - days) // ONE_MINUTE).to_numpy()
+        counts = np.minimum(np.asarray(counts), self.MISSING - 1)
+        for day in days.unique():
+            rows = (days == day)
+            matrix = self.day(day, create=True)
+            matrix[stand_idx[rows], offset[rows]] = counts[rows]
+            matrix.flush()
+
+    def import_frame(self, df):
+        '''
+        Add rows in the h_taxi_stand_taxi_count schema (ts_id, lat, lon,
+        taxi_count, timestamp)
+        '''
+        stand_idx = self.add_stands(df)
+        self.write(stand_idx, df['timestamp'], df['taxi_count'].to_numpy())
+        return len(df)
+
+    def window(self, start, minutes):
+        '''
+        (taxi stands, minutes) counts from start on, MISSING where there
+        was no snapshot. Within one day this is a read-only view on the
+        memory map, across days a copy of the slices
+        '''
+        start = pd.Timestamp(start).floor('min')
+        parts = []
+        while minutes > 0:
+            day = start.normalize()
+            first = (start - day) // ONE_MINUTE
+            last = min(first + minutes, MINUTES_PER_DAY)
+            matrix = self.day(day)
+            if matrix is None:
+                part = np.full((len(self), last - first), self.MISSING,
+                               dtype=self.dtype)
+            else:
+                part = matrix[:, first:last]
+                part = part.view(np.ndarray)
+                part.flags.writeable = False
+            parts.append(part)
+            minutes -= last - first
+            start = day + pd.Timedelta(days=1)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts, axis=1)
+
+    def export_frame(self, start, minutes):
+        '''
+        The minutes of window(start, minutes) that hold a count, as rows in
+        the h_taxi_stand_taxi_count schema, ordered by timestamp then by
+        taxi stand
+        '''
+        counts = self.window(start, minutes)
+        minute, stand = np.nonzero(counts.T != self.MISSING)
+        stands = self.stands.iloc[stand].reset_index(drop=True)
+        stands['taxi_count'] = counts[stand, minute].astype('int64')
+        stands['timestamp'] = pd.Timestamp(start).floor('min') + \
+            pd.to_timedelta(minute, unit='m')
+        return stands
+
+
+history = None
+
+
+def get_history():
+    '''
+    Process wide CountHistory in HISTORY_DIR, or None when it is not set
+    '''
+    global history
+    if history is None and HISTORY_DIR:
+        history = CountHistory(HISTORY_DIR)
+    return history
@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# XGBoost classifier predicting the taxi count bin (0-4) 15 minutes ahead.
+# model.json is notebooks/model.bst saved in the JSON format that newer
+# XGBoost versions can still load.
+MODEL_PATH = os.environ.get(
+    'TAXI_COMPASS_MODEL_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'notebooks',
+                 'model.json'))
+
+
+class LocalPredictor:
+    '''
+    Run the XGBoost model in process instead of calling the hosted model.
+
+    The booster is loaded once, then every predict runs inplace_predict on
+    contiguous float32 batches of batch_size rows, using n_threads threads
+    (all cores when None).
+    '''
+    def __init__(self, model_path=MODEL_PATH, batch_size=100000,
+                 n_threads=None):
+        import xgboost as xgb
+        self.booster = xgb.Booster(model_file=model_path)
+        if n_threads is not None:
+            self.booster.set_param({'nthread': n_threads})
+        self.batch_size = batch_size
+
+    def predict(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if len(X) == 0:
+            return np.array([], dtype=np.float64)
+        pred = [
+            self.booster.inplace_predict(X[start:start + self.batch_size])
+            for start in range(0, len(X), self.batch_size)
+        ]
+        return np.concatenate(pred).astype(np.float64)
+
+
+local_predictor = None
+
+
+def get_local_predictor(**kwargs):
+    '''
+    Process wide LocalPredictor, the model file is only read the first time
+    '''
+    global local_predictor
+    if local_predictor is None:
+        local_predictor = LocalPredictor(**kwargs)
+    return local_predictor
+
+
+def build_ml_service(region):
+    '''
+    ML Engine service object for the regional endpoint (ml.googleapis.com
+    when region is None). To authenticate set the environment variable
+    GOOGLE_APPLICATION_CREDENTIALS=<path_to_service_account_file>
+    '''
+    import googleapiclient.discovery
+    from google.api_core.client_options import ClientOptions
+    prefix = "{}-ml".format(region) if region else "ml"
+    api_endpoint = "https://{}.googleapis.com".format(prefix)
+    client_options = ClientOptions(api_endpoint=api_endpoint)
+    return googleapiclient.discovery.build('ml',
+                                           'v1',
+                                           client_options=client_options,
+                                           cache_discovery=False)
+
+
+def compact_instances(X, decimals=4):
+    '''
+    Rows as JSON ready lists with fewer bytes: values rounded to decimals
+    and columns holding only whole numbers (taxi_st_num, taxi_count, flags)
+    sent as ints, so 12.0 goes as 12 and 0.866025403784 as 0.8660.
+
+    Non zero values smaller than the rounding step (cos(pi/2) = 6.1e-17)
+    are kept as they are, rounding them to 0 moves them across the model's
+    splits at 0 and changes the prediction.
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    tiny = (np.abs(X) < 10.0**-decimals) & (X != 0)
+    X = np.where(tiny, X, np.round(X, decimals))
+    if X.size == 0:
+        return []
+    columns = [
+        column.astype(np.int64).tolist() if np.all(column == np.round(column))
+        else column.tolist() for column in X.T
+    ]
+    return [list(row) for row in zip(*columns)]
+
+
+class RemotePredictor:
+    '''
+    Client for the model deployed on Cloud ML Engine.
+
+    Rows are compacted, split into chunks of at most max_rows rows and about
+    max_bytes of JSON (ML Engine refuses bodies over 1.5MB), and sent by a
+    pool of max_workers threads. Each thread keeps its own discovery service
+    (the underlying httplib2 is not thread safe), built once and reused by
+    later calls. Failed chunks are retried with exponential backoff, and
+    predictions come back in the order of the rows.
+    '''
+    def __init__(self,
+                 project,
+                 region,
+                 model,
+                 version=None,
+                 max_rows=5000,
+                 max_bytes=1400000,
+                 max_workers=4,
+                 retries=3,
+                 backoff=0.5,
+                 decimals=4,
+                 service_factory=build_ml_service):
+        self.name = 'projects/{}/models/{}'.format(project, model)
+        if version is not None:
+            self.name += '/versions/{}'.format(version)
+        self.region = region
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.decimals = decimals
+        self.service_factory = service_factory
+        self.local = threading.local()
+        self.executor = None
+
+    def service(self):
+        if getattr(self.local, 'service', None) is None:
+            self.local.service = self.service_factory(self.region)
+        return self.local.service
+
+    def chunks(self, instances):
+        '''
+        Split instances so each request stays under max_rows and max_bytes
+        '''
+        if not instances:
+            return []
+        # bytes per row from rows spread over the whole batch, plus 10%
+        sample = instances[::max(1, len(instances) // 100)]
+        row_bytes = 1.1 * len(json.dumps(sample)) / len(sample)
+        size = max(1, min(self.max_rows, int(self.max_bytes // row_bytes)))
+        return [
+            instances[start:start + size]
+            for start in range(0, len(instances), size)
+        ]
+
+    def predict_chunk(self, instances):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.service().projects().predict(
+                    name=self.name, body={
+                        'instances': instances
+                    }).execute()
+                if 'error' in response:
+                    raise RuntimeError(response['error'])
+                return response['predictions']
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                # a broken connection may have left the service unusable
+                self.local.service = None
+                time.sleep(self.backoff * 2**attempt)
+
+    def predict(self, X):
+        chunks = self.chunks(compact_instances(X, self.decimals))
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        pred = []
+        for chunk_pred in self.executor.map(self.predict_chunk, chunks):
+            pred += chunk_pred
+        return np.array(pred, dtype=np.float64)
+
+
+remote_predictors = {}
+
+
+def get_remote_predictor(project, region, model, version=None, **kwargs):
+    '''
+    Process wide RemotePredictor for a deployed model version, so its
+    services and threads are reused across runs of the same instance
+    '''
+    key = (project, region, model, version)
+    if key not in remote_predictors:
+        remote_predictors[key] = RemotePredictor(project, region, model,
+                                                 version, **kwargs)
+    return remote_predictors[key]
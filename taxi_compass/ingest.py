@@ -0,0 +1,313 @@
+'''
+One long running process that collects every feed, instead of a cloud
+function or script per feed.
+
+    python -m taxi_compass.ingest [--duration SECONDS] [--stats-port PORT]
+
+Each feed runs on its own interval in an asyncio task. The HTTP calls and
+the writes run in threads over one pooled requests session, the taxi
+stands (and their StandIndex) and the mrt station list stay in memory, and
+the snapshots go to the storage through a BufferedWriter per table. The
+lag and throughput of every feed are printed every --stats-interval seconds
+and served as json on --stats-port.
+
+The feed URLs come from the environment (TAXI_COMPASS_*_URL), so the
+service can run locally against recorded feeds.
+'''
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import time
+
+from taxi_compass.feeds import (MRT_LIST_PATH, RAINFALL_URL,
+                                TAXI_AVAILABILITY_URL,
+                                TRAIN_SERVICE_ALERTS_URL, MrtSchedule,
+                                load_mrt_list, rainfall_frame,
+                                stand_count_frame, taxi_availability_frame)
+from taxi_compass.lta import (LTA_ACCOUNT_KEY, LTA_TAXI_AVAILABILITY_URL,
+                              get_taxi_coordinates, make_session)
+from taxi_compass.rainfall import stand_rainfall
+from taxi_compass.stands import StandCache
+from taxi_compass.storage import get_storage
+from taxi_compass.writer import DEDUP_KEYS, BufferedWriter
+
+URLS = {
+    'lta_taxi_availability':
+    os.environ.get('TAXI_COMPASS_LTA_TAXI_AVAILABILITY_URL',
+                   LTA_TAXI_AVAILABILITY_URL),
+    'taxi_availability':
+    os.environ.get('TAXI_COMPASS_TAXI_AVAILABILITY_URL',
+                   TAXI_AVAILABILITY_URL),
+    'rainfall':
+    os.environ.get('TAXI_COMPASS_RAINFALL_URL', RAINFALL_URL),
+    'train_service_alerts':
+    os.environ.get('TAXI_COMPASS_TRAIN_SERVICE_ALERTS_URL',
+                   TRAIN_SERVICE_ALERTS_URL),
+}
+
+# Seconds between two runs of each feed
+INTERVALS = {
+    'taxi_stand_count': 60,
+    'mrt_status': 60,
+    'weather_rainfall': 300,
+    'taxi_availability': 300,
+}
+
+# Same settings as the tstc function
+CUTOFF_DISTANCE = float(os.environ.get('TSTC_CUTOFF_DISTANCE', 0.200))
+MAX_STANDS_PER_TAXI = 10
+
+# The mrt station list is read again after this many seconds
+STATIC_REFRESH_SECONDS = 3600
+
+
+def singapore_now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(
+        tzinfo=None) + datetime.timedelta(hours=8)
+
+
+class Feed:
+    '''
+    A table filled by calling collect(service) every interval seconds,
+    with the counters of its runs
+    '''
+    def __init__(self, name, table, interval, collect):
+        self.name = name
+        self.table = table
+        self.interval = interval
+        self.collect = collect
+        self.runs = 0
+        self.errors = 0
+        self.rows = 0
+        self.last_error = None
+        self.last_lag = None
+        self.max_lag = 0.0
+        self.busy_seconds = 0.0
+
+    def stats(self, elapsed):
+        return {
+            'table': self.table,
+            'interval_s': self.interval,
+            'runs': self.runs,
+            'errors': self.errors,
+            'rows': self.rows,
+            'rows_per_s': round(self.rows / elapsed, 3) if elapsed else 0.0,
+            'last_lag_s': None if self.last_lag is None else round(
+                self.last_lag, 4),
+            'max_lag_s': round(self.max_lag, 4),
+            'mean_run_s': round(self.busy_seconds / self.runs, 4)
+            if self.runs else None,
+            'last_error': self.last_error
+        }
+
+
+def collect_taxi_stand_count(service):
+    ts_df, index = service.stand_cache.get()
+    taxi_coords = get_taxi_coordinates(
+        service.session,
+        url=service.urls['lta_taxi_availability'],
+        account_key=service.account_key,
+        concurrency=service.concurrency)
+    counts = index.count_within(taxi_coords[:, 0], taxi_coords[:, 1],
+                                CUTOFF_DISTANCE, MAX_STANDS_PER_TAXI)
+    # the latest rainfall snapshot, the feed only changes every 5 minutes
+    rainfall = None
+    if service.rainfall is not None:
+        rainfall = stand_rainfall(ts_df, service.rainfall)
+    return stand_count_frame(ts_df, counts, service.clock(), rainfall)
+
+
+def collect_mrt_status(service):
+    r = service.session.get(service.urls['train_service_alerts'],
+                            headers={'AccountKey': service.account_key},
+                            timeout=10)
+    r.raise_for_status()
+    return service.mrt_schedule().status_frame(r.json(), service.clock())
+
+
+def collect_weather_rainfall(service):
+    r = service.session.get(service.urls['rainfall'], timeout=10)
+    r.raise_for_status()
+    service.rainfall = rainfall_frame(r.json())
+    return service.rainfall
+
+
+def collect_taxi_availability(service):
+    r = service.session.get(service.urls['taxi_availability'], timeout=10)
+    r.raise_for_status()
+    return taxi_availability_frame(r.json())
+
+
+def default_feeds(intervals=INTERVALS):
+    return [
+        Feed('taxi_stand_count', 'h_taxi_stand_taxi_count',
+             intervals['taxi_stand_count'], collect_taxi_stand_count),
+        Feed('mrt_status', 'h_mrt_status_availability',
+             intervals['mrt_status'], collect_mrt_status),
+        Feed('weather_rainfall', 'h_weather_rainfall',
+             intervals['weather_rainfall'], collect_weather_rainfall),
+        Feed('taxi_availability', 'h_taxi_availability',
+             intervals['taxi_availability'], collect_taxi_availability),
+    ]
+
+
+class IngestService:
+    '''
+    Run feeds on their own intervals until stopped.
+
+    Runs are scheduled on a fixed grid (start + n * interval). A run that
+    takes longer than its interval skips the ticks it missed rather than
+    running back to back. The lag of a run is how long after its tick the
+    snapshot was handed to the writer. A failed run is counted and logged,
+    and the feed carries on with the next tick.
+    '''
+    def __init__(self,
+                 feeds=None,
+                 storage=None,
+                 stand_cache=None,
+                 mrt_list_path=MRT_LIST_PATH,
+                 account_key=LTA_ACCOUNT_KEY,
+                 concurrency=4,
+                 clock=singapore_now,
+                 urls=None,
+                 writer_kwargs=None):
+        self.feeds = feeds or default_feeds()
+        self.storage = storage or get_storage()
+        self.stand_cache = stand_cache or StandCache()
+        self.mrt_list_path = mrt_list_path
+        self.account_key = account_key
+        self.concurrency = concurrency
+        self.clock = clock
+        self.urls = {**URLS, **(urls or {})}
+        self.session = make_session(pool_size=concurrency + len(self.feeds))
+        self.writers = {
+            feed.table: BufferedWriter(feed.table,
+                                       DEDUP_KEYS.get(feed.table),
+                                       self.storage, **(writer_kwargs or {}))
+            for feed in self.feeds
+        }
+        self.schedule = None
+        self.mrt_list_loaded_at = None
+        self.rainfall = None
+        self.started_at = None
+        self.stopping = None
+
+    def mrt_schedule(self):
+        now = time.monotonic()
+        if self.schedule is None or \
+                now - self.mrt_list_loaded_at >= STATIC_REFRESH_SECONDS:
+            self.schedule = MrtSchedule(load_mrt_list(self.mrt_list_path))
+            self.mrt_list_loaded_at = now
+        return self.schedule
+
+    def run_once(self, feed):
+        '''
+        Collect one snapshot of feed and hand it to its writer (blocking)
+        '''
+        df = feed.collect(self)
+        self.writers[feed.table].write(df)
+        return len(df)
+
+    async def run_feed(self, feed):
+        loop = asyncio.get_running_loop()
+        tick = loop.time()
+        while not self.stopping.is_set():
+            began = loop.time()
+            try:
+                rows = await asyncio.to_thread(self.run_once, feed)
+                feed.rows += rows
+            except Exception as e:
+                feed.errors += 1
+                feed.last_error = repr(e)
+                print(f'{feed.name} failed: {e!r}')
+            done = loop.time()
+            feed.runs += 1
+            feed.busy_seconds += done - began
+            feed.last_lag = done - tick
+            feed.max_lag = max(feed.max_lag, feed.last_lag)
+
+            missed = int((done - tick) // feed.interval)
+            tick += (missed + 1) * feed.interval
+            try:
+                await asyncio.wait_for(self.stopping.wait(),
+                                       timeout=max(0.0, tick - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at if self.started_at \
+            else 0.0
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'feeds': {feed.name: feed.stats(elapsed)
+                      for feed in self.feeds}
+        }
+
+    async def report(self, interval):
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                print(json.dumps(self.stats()))
+
+    async def serve_stats(self, port, host='127.0.0.1'):
+        '''
+        Answer every HTTP request on port with the stats as json
+        '''
+        async def handle(reader, writer):
+            await reader.readline()
+            body = json.dumps(self.stats()).encode()
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                         b'Content-Type: application/json\r\n' +
+                         f'Content-Length: {len(body)}\r\n'.encode() +
+                         b'Connection: close\r\n\r\n' + body)
+            await writer.drain()
+            writer.close()
+
+        return await asyncio.start_server(handle, host, port)
+
+    def stop(self):
+        self.stopping.set()
+
+    async def run(self, duration=None, stats_interval=None, stats_port=None):
+        '''
+        Run all the feeds until stop() or for duration seconds, then flush
+        the writers. Returns the final stats
+        '''
+        self.stopping = asyncio.Event()
+        self.started_at = time.monotonic()
+        tasks = [asyncio.create_task(self.run_feed(feed))
+                 for feed in self.feeds]
+        if stats_interval:
+            tasks.append(asyncio.create_task(self.report(stats_interval)))
+        server = await self.serve_stats(stats_port) if stats_port else None
+        if duration is not None:
+            asyncio.get_running_loop().call_later(duration, self.stop)
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            if server is not None:
+                server.close()
+            for writer in self.writers.values():
+                await asyncio.to_thread(writer.flush)
+        return self.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--duration', type=float, default=None,
+                        help='stop after this many seconds')
+    parser.add_argument('--stats-interval', type=float, default=60)
+    parser.add_argument('--stats-port', type=int, default=None)
+    args = parser.parse_args()
+
+    service = IngestService()
+    stats = asyncio.run(service.run(args.duration, args.stats_interval,
+                                    args.stats_port))
+    print(json.dumps(stats))
+
+
+if __name__ == '__main__':
+    main()
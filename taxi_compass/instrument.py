@@ -0,0 +1,228 @@
+'''
+Stage timings of the pipeline as structured (json) log lines.
+
+TAXI_COMPASS_INSTRUMENT picks how much is recorded:
+
+    off       nothing, the stages run as they are (default)
+    summary   one line per run with the wall time, CPU time, peak RSS
+              growth, rows and bytes of each of its stages
+    detailed  also one line per stage as it ends, and with
+              TAXI_COMPASS_PROFILE_DIR set a cProfile dump of every run
+              (<run>-<timestamp>.prof, read it with pstats or snakeviz)
+
+The peak resident memory of a process only ever grows, so a stage reports
+by how much it raised it (peak_rss_growth_mb, 0 when an earlier stage
+already went higher) and the run the peak of the whole process so far
+(process_peak_rss_mb).
+
+Cloud Functions turn json lines on stdout with a "severity" into structured
+log entries, so the numbers can be filtered and charted in Cloud Logging.
+'''
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+MODE = os.environ.get('TAXI_COMPASS_INSTRUMENT', 'off')
+PROFILE_DIR = os.environ.get('TAXI_COMPASS_PROFILE_DIR')
+
+# Runs in progress, per thread, so stages know which run they belong to
+local = threading.local()
+
+# The last finished run of each name, for a stats endpoint or a test
+last_runs = {}
+
+
+def peak_rss_mb():
+    '''
+    Peak resident memory of the process so far, None where the resource
+    module is not available
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024**2 if sys.platform == 'darwin' else 1024), 1)
+
+
+def size_of(result):
+    '''
+    (rows, bytes) of a stage result: a DataFrame, an array or a tuple of
+    them, counting the first element's rows and every element's bytes
+    '''
+    if isinstance(result, tuple):
+        sizes = [size_of(r) for r in result]
+        sizes = [s for s in sizes if s[0] is not None]
+        if not sizes:
+            return None, None
+        return sizes[0][0], sum(s[1] for s in sizes)
+    if hasattr(result, 'memory_usage') and hasattr(result, 'columns'):
+        return len(result), int(result.memory_usage(index=True).sum())
+    if hasattr(result, 'nbytes') and hasattr(result, 'shape'):
+        return (result.shape[0] if result.ndim else 1), int(result.nbytes)
+    if isinstance(result, (bytes, str)):
+        return None, len(result)
+    return None, None
+
+
+def emit(record):
+    record.setdefault('severity', 'INFO')
+    print(json.dumps(record), flush=True)
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.bytes = None
+        self.wall_s = None
+        self.cpu_s = None
+        self.peak_rss_growth_mb = None
+
+    def record(self, result=None, rows=None, nbytes=None):
+        '''
+        Rows and bytes the stage produced, from its result or given
+        '''
+        if result is not None:
+            rows, nbytes = size_of(result)
+        if rows is not None:
+            self.rows = rows
+        if nbytes is not None:
+            self.bytes = nbytes
+
+    def metrics(self):
+        return {
+            'wall_s': self.wall_s,
+            'cpu_s': self.cpu_s,
+            'peak_rss_growth_mb': self.peak_rss_growth_mb,
+            'rows': self.rows,
+            'bytes': self.bytes
+        }
+
+
+def stage_totals(stages):
+    '''
+    Metrics per stage name, summed over the stages that ran more than once
+    '''
+    totals = {}
+    for s in stages:
+        metrics = s.metrics()
+        if s.name not in totals:
+            totals[s.name] = dict(metrics, calls=1)
+            continue
+        total = totals[s.name]
+        total['calls'] += 1
+        for key in ('wall_s', 'cpu_s', 'peak_rss_growth_mb', 'rows',
+                    'bytes'):
+            if metrics[key] is not None:
+                total[key] = round((total[key] or 0) + metrics[key], 6)
+    return totals
+
+
+class Run:
+    def __init__(self, name, mode):
+        self.name = name
+        self.mode = mode
+        self.stages = []
+
+
+def current_run():
+    stack = getattr(local, 'runs', None)
+    return stack[-1] if stack else None
+
+
+@contextlib.contextmanager
+def stage(name, mode=None):
+    '''
+    Time the block as stage name of the current run. Yields a Stage, call
+    its record() to add rows and bytes
+    '''
+    run_ = current_run()
+    mode = run_.mode if run_ is not None else (mode or MODE)
+    s = Stage(name)
+    if mode == 'off':
+        yield s
+        return
+    wall, cpu = time.perf_counter(), time.process_time()
+    peak = peak_rss_mb()
+    try:
+        yield s
+    finally:
+        s.wall_s = round(time.perf_counter() - wall, 6)
+        s.cpu_s = round(time.process_time() - cpu, 6)
+        if peak is not None:
+            s.peak_rss_growth_mb = round(peak_rss_mb() - peak, 1)
+        if run_ is not None:
+            run_.stages.append(s)
+        if mode == 'detailed' or run_ is None:
+            emit({'message': f'stage {name}',
+                  'run': run_ and run_.name,
+                  'stage': name, **s.metrics()})
+
+
+def instrumented(name=None):
+    '''
+    Decorator running the function as a stage, with the rows and bytes of
+    what it returns
+    '''
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name) as s:
+                result = func(*args, **kwargs)
+                s.record(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def run(name, mode=None):
+    '''
+    Group the stages of one invocation (a handler call, a prediction run)
+    and log their totals when it ends
+    '''
+    mode = mode or MODE
+    if mode == 'off':
+        yield None
+        return
+    run_ = Run(name, mode)
+    local.runs = getattr(local, 'runs', []) + [run_]
+    profiler = None
+    # only the outermost run is profiled, one profiler can be active
+    if mode == 'detailed' and PROFILE_DIR and len(local.runs) == 1:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield run_
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profile_path = os.path.join(
+                PROFILE_DIR, f'{name}-{time.strftime("%Y%m%dT%H%M%S")}.prof')
+            profiler.dump_stats(profile_path)
+        local.runs = local.runs[:-1]
+        record = {
+            'message': f'run {name}',
+            'run': name,
+            'wall_s': round(time.perf_counter() - wall, 6),
+            'cpu_s': round(time.process_time() - cpu, 6),
+            'process_peak_rss_mb': peak_rss_mb(),
+            'stages': stage_totals(run_.stages)
+        }
+        if profiler is not None:
+            record['profile'] = profile_path
+        last_runs[name] = record
+        emit(record)
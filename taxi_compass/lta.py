@@ -0,0 +1,100 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+LTA_TAXI_AVAILABILITY_URL = ('http://datamall2.mytransport.sg/ltaodataservice/'
+                             'Taxi-Availability')
+LTA_ACCOUNT_KEY = os.environ.get('LTA_ACCOUNT_KEY', 'BehS/IpVR0KOFQ+BgFqM5g==')
+
+# LTA DataMall returns up to 500 rows per call, paginated with $skip
+PAGE_SIZE = 500
+MAX_PAGES = 20
+
+
+def make_session(pool_size=8, retries=3, backoff_factor=0.5):
+    '''
+    requests.Session with a pool of keep-alive connections, so all the pages
+    reuse the same few connections instead of opening a new one per call.
+    Failed calls (connection errors, 429 and 5xx) are retried with
+    exponential backoff.
+    '''
+    retry = Retry(total=retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(['GET']))
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_page(session, url, skip, account_key=LTA_ACCOUNT_KEY, timeout=10):
+    '''
+    Call the Taxi-Availability API once and return its rows
+    '''
+    headers = {'AccountKey': account_key, 'accept': 'application/json'}
+    r = session.get(url=f'{url}?$skip={skip}',
+                    headers=headers,
+                    timeout=timeout)
+    r.raise_for_status()
+    return r.json()['value']
+
+
+def rows_to_array(rows):
+    '''
+    Turn the LTA rows into a (N, 2) array of lat, lon
+    '''
+    coordinates = np.empty((len(rows), 2), dtype=np.float64)
+    for i, row in enumerate(rows):
+        coordinates[i, 0] = row['Latitude']
+        coordinates[i, 1] = row['Longitude']
+    return coordinates
+
+
+def get_taxi_coordinates(session=None,
+                         url=LTA_TAXI_AVAILABILITY_URL,
+                         account_key=LTA_ACCOUNT_KEY,
+                         concurrency=4,
+                         max_pages=MAX_PAGES,
+                         page_size=PAGE_SIZE,
+                         timeout=10):
+    '''
+    LTA DATAMALL provides up to 500 rows of taxi info per call, so we fetch
+    the pages concurrently, concurrency pages at a time, and stop after the
+    first page that comes back empty (or not full).
+
+    Returns a (N, 2) float64 array with the lat, lon of all available taxis.
+    '''
+    session = session or make_session(pool_size=concurrency)
+    pages = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for first_page in range(0, max_pages, concurrency):
+            skips = [
+                page_size * index for index in range(
+                    first_page, min(first_page + concurrency, max_pages))
+            ]
+            results = executor.map(
+                lambda skip: fetch_page(session, url, skip, account_key,
+                                        timeout), skips)
+            last_page = False
+            for rows in results:
+                if len(rows) == 0:
+                    last_page = True
+                    break
+                pages.append(rows_to_array(rows))
+                if len(rows) < page_size:
+                    last_page = True
+                    break
+            if last_page:
+                break
+
+    if not pages:
+        return np.empty((0, 2), dtype=np.float64)
+    return np.vstack(pages)
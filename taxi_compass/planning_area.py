@@ -0,0 +1,312 @@
+'''
+Planning area of a point, resolved offline from planning area polygons
+instead of one OneMap request per taxi stand.
+
+The polygon geojson (Polygon or MultiPolygon features with a PLN_AREA_N)
+is read once into edge arrays and bounding boxes. A batch of points is
+first matched against the bounding boxes, then only the candidate points of
+an area are ray cast against its edges (even-odd rule, so holes are
+handled).
+
+The real boundaries are the URA Master Plan planning area boundary geojson
+published on data.gov.sg; point TAXI_COMPASS_PLANNING_AREA_PATH at it. It
+is not bundled. What is bundled, and used by default, is
+derived-stand-areas.geojson: NOT planning area boundaries but the Voronoi
+cells of the taxi stands OneMap gave a planning area for
+(raw_data/taxi_stand_df.csv), grouped by that area and clipped to
+Singapore. Locating a point in it gives the planning area of the nearest
+of those taxi stands, which is the OneMap answer for the known taxi stands
+and an approximation for any other point.
+
+Results are kept in a csv keyed by coordinates rounded to
+COORDINATE_DECIMALS, in the temp directory unless
+TAXI_COMPASS_PLANNING_AREA_CACHE_PATH says otherwise. The cache records the
+md5 of the polygon file its answers came from and is ignored when the file
+changed. When there is no usable cache it is seeded with the OneMap answers
+bundled in taxi_compass/data.
+
+    python -m taxi_compass.planning_area    # derive the bundled files again
+'''
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import Voronoi
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+DERIVED_STAND_AREAS_PATH = os.path.join(DATA_DIR,
+                                        'derived-stand-areas.geojson')
+PLANNING_AREA_PATH = os.environ.get('TAXI_COMPASS_PLANNING_AREA_PATH',
+                                    DERIVED_STAND_AREAS_PATH)
+PLANNING_AREA_CACHE_PATH = os.environ.get(
+    'TAXI_COMPASS_PLANNING_AREA_CACHE_PATH',
+    os.path.join(tempfile.gettempdir(), 'taxi_compass_planning_area.csv'))
+PLANNING_AREA_SEED_PATH = os.path.join(DATA_DIR, 'planning-area-seed.csv')
+ONEMAP_ANSWERS_PATH = 'raw_data/taxi_stand_df.csv'
+
+# min lon, min lat, max lon, max lat of the derived stand areas
+SINGAPORE_BBOX = (103.6, 1.15, 104.1, 1.48)
+
+# About 0.1 m
+COORDINATE_DECIMALS = 6
+
+
+def area_name(properties):
+    '''
+    PLN_AREA_N of a boundary feature, from its properties or from the html
+    table in Description of the data.gov.sg kml export
+    '''
+    if 'PLN_AREA_N' in properties:
+        return properties['PLN_AREA_N']
+    match = re.search(r'<th>PLN_AREA_N</th>\s*<td>(.*?)</td>',
+                      properties.get('Description', ''))
+    return match.group(1) if match else properties.get('Name')
+
+
+def feature_rings(geometry):
+    '''
+    Every ring (outer and holes) of a Polygon or MultiPolygon as (n, 2)
+    lon, lat arrays
+    '''
+    polygons = geometry['coordinates']
+    if geometry['type'] == 'Polygon':
+        polygons = [polygons]
+    return [
+        np.asarray(ring, dtype=np.float64)[:, :2] for polygon in polygons
+        for ring in polygon
+    ]
+
+
+class PlanningAreas:
+    '''
+    names[a] and its edges (x1, y1, x2, y2 in lon, lat) with the bounding
+    box bbox[a] (min lon, min lat, max lon, max lat)
+    '''
+    def __init__(self, features):
+        self.names = []
+        self.edges = []
+        bbox = []
+        for feature in features:
+            rings = feature_rings(feature['geometry'])
+            points = np.vstack(rings)
+            self.names.append(area_name(feature['properties']))
+            self.edges.append(
+                np.vstack([
+                    np.hstack((ring, np.roll(ring, -1, axis=0)))
+                    for ring in rings
+                ]))
+            bbox.append(np.concatenate((points.min(axis=0),
+                                        points.max(axis=0))))
+        self.names = np.array(self.names, dtype=object)
+        self.bbox = np.array(bbox).reshape(-1, 4)
+
+    @classmethod
+    def from_geojson(cls, path=PLANNING_AREA_PATH):
+        with open(path) as f:
+            return cls(json.load(f)['features'])
+
+    def __len__(self):
+        return len(self.names)
+
+    def locate(self, lat, lon):
+        '''
+        Planning area name of every point, None outside all of them. A point
+        on the border of two areas gets the first one
+        '''
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        result = np.full(len(lat), None, dtype=object)
+        candidates = (self.bbox[:, 0] <= lon[:, None]) & \
+            (lon[:, None] <= self.bbox[:, 2]) & \
+            (self.bbox[:, 1] <= lat[:, None]) & \
+            (lat[:, None] <= self.bbox[:, 3])
+        for a in np.flatnonzero(candidates.any(axis=0)):
+            points = np.flatnonzero(candidates[:, a] &
+                                    (result == None))  # noqa: E711
+            if len(points) == 0:
+                continue
+            x, y = lon[points, None], lat[points, None]
+            x1, y1, x2, y2 = self.edges[a].T
+            straddles = (y1 > y) != (y2 > y)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+            inside = (straddles & (x < x_cross)).sum(axis=1) % 2 == 1
+            result[points[inside]] = self.names[a]
+        return result
+
+
+def file_md5(path):
+    '''
+    md5 hex digest of the file at path, None when there is none
+    '''
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def coordinate_keys(lat, lon):
+    return list(
+        zip(np.round(np.asarray(lat, dtype=np.float64), COORDINATE_DECIMALS),
+            np.round(np.asarray(lon, dtype=np.float64), COORDINATE_DECIMALS)))
+
+
+class PlanningAreaResolver:
+    '''
+    Planning areas of batches of points, from the csv cache first and from
+    the polygons (read only when a point is not cached) for the rest.
+    New results are written back to the cache with the md5 of the polygon
+    file, and a cache written from another file is not used
+    '''
+    def __init__(self,
+                 boundary_path=PLANNING_AREA_PATH,
+                 cache_path=PLANNING_AREA_CACHE_PATH,
+                 seed_path=PLANNING_AREA_SEED_PATH):
+        self.boundary_path = boundary_path
+        self.cache_path = cache_path
+        self.seed_path = seed_path
+        self.areas = None
+        self.boundary_md5 = file_md5(boundary_path)
+        self.cache = self.read_cache()
+
+    def read_cache(self):
+        '''
+        The cache when it was written from the same polygon file, else the
+        seed: lat, lon, pln_area csvs
+        '''
+        df = None
+        if self.cache_path and os.path.exists(self.cache_path):
+            df = pd.read_csv(self.cache_path)
+            if 'boundary_md5' not in df or \
+                    not df['boundary_md5'].eq(self.boundary_md5).all():
+                print(f'ignoring the planning area cache {self.cache_path}, '
+                      f'it was written from another polygon file')
+                df = None
+        if df is None and self.seed_path and os.path.exists(self.seed_path):
+            df = pd.read_csv(self.seed_path)
+        if df is None:
+            return {}
+        df = df.dropna(subset=['pln_area'])
+        return dict(zip(coordinate_keys(df['lat'], df['lon']),
+                        df['pln_area']))
+
+    def write_cache(self):
+        if not self.cache_path:
+            return
+        keys = list(self.cache)
+        pd.DataFrame({
+            'lat': [k[0] for k in keys],
+            'lon': [k[1] for k in keys],
+            'pln_area': list(self.cache.values()),
+            'boundary_md5': self.boundary_md5
+        }).to_csv(self.cache_path, index=False)
+
+    def resolve(self, lat, lon):
+        '''
+        Planning area name of every point, None where neither the cache nor
+        the polygons have one
+        '''
+        keys = coordinate_keys(lat, lon)
+        result = np.array([self.cache.get(k) for k in keys], dtype=object)
+        missing = np.flatnonzero(result == None)  # noqa: E711
+        if len(missing) == 0:
+            return result
+        if self.areas is None:
+            if not os.path.exists(self.boundary_path):
+                print(f'{len(missing)} points not in the planning area cache '
+                      f'and no boundary file at {self.boundary_path}')
+                return result
+            self.areas = PlanningAreas.from_geojson(self.boundary_path)
+        found = self.areas.locate(np.asarray(lat)[missing],
+                                  np.asarray(lon)[missing])
+        result[missing] = found
+        for i, area in zip(missing, found):
+            if area is not None:
+                self.cache[keys[i]] = area
+        self.write_cache()
+        print(f'resolved {sum(a is not None for a in found)} of '
+              f'{len(missing)} points from the planning area polygons')
+        return result
+
+
+def clip_polygon(polygon, bbox):
+    '''
+    Sutherland-Hodgman clip of a convex (n, 2) lon, lat polygon to bbox
+    '''
+    for axis, bound, keep_below in ((0, bbox[0], False), (1, bbox[1], False),
+                                    (0, bbox[2], True), (1, bbox[3], True)):
+        clipped = []
+        for start, end in zip(polygon, np.roll(polygon, -1, axis=0)):
+            start_in = (start[axis] <= bound) == keep_below
+            end_in = (end[axis] <= bound) == keep_below
+            if start_in:
+                clipped.append(start)
+            if start_in != end_in:
+                t = (bound - start[axis]) / (end[axis] - start[axis])
+                clipped.append(start + t * (end - start))
+        if not clipped:
+            return np.empty((0, 2))
+        polygon = np.array(clipped)
+    return polygon
+
+
+def derive_stand_areas(lat, lon, areas, bbox=SINGAPORE_BBOX):
+    '''
+    Nearest known point areas as planning area features: the Voronoi cell
+    of every point with a known area clipped to bbox, one MultiPolygon of
+    cells per area. Not the planning area boundaries, see the module
+    docstring
+    '''
+    points = pd.DataFrame({'lon': lon, 'lat': lat, 'area': areas})
+    points = points.dropna().drop_duplicates(['lon', 'lat'])
+    xy = points[['lon', 'lat']].to_numpy(dtype=np.float64)
+    # far away points close every cell of the real ones
+    width = max(bbox[2] - bbox[0], bbox[3] - bbox[1])
+    far = np.array([[bbox[0] - 10 * width, bbox[1] - 10 * width],
+                    [bbox[2] + 10 * width, bbox[1] - 10 * width],
+                    [bbox[2] + 10 * width, bbox[3] + 10 * width],
+                    [bbox[0] - 10 * width, bbox[3] + 10 * width]])
+    voronoi = Voronoi(np.vstack((xy, far)))
+    cells = {}
+    for i, area in enumerate(points['area']):
+        region = voronoi.regions[voronoi.point_region[i]]
+        cell = clip_polygon(voronoi.vertices[region], bbox)
+        if len(cell) >= 3:
+            ring = np.vstack((cell, cell[:1])).round(7).tolist()
+            cells.setdefault(area, []).append([ring])
+    return [{
+        'type': 'Feature',
+        'properties': {'PLN_AREA_N': area},
+        'geometry': {'type': 'MultiPolygon', 'coordinates': cells[area]}
+    } for area in sorted(cells)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='derive the bundled stand areas and seed from the '
+        'OneMap answers for the taxi stands')
+    parser.add_argument('--answers', default=ONEMAP_ANSWERS_PATH)
+    parser.add_argument('--stand-areas', default=DERIVED_STAND_AREAS_PATH)
+    parser.add_argument('--seed', default=PLANNING_AREA_SEED_PATH)
+    args = parser.parse_args(argv)
+
+    answers = pd.read_csv(args.answers).dropna(subset=['pln_area'])
+    seed = pd.DataFrame({'lat': answers['taxi_st_lat'],
+                         'lon': answers['taxi_st_lon'],
+                         'pln_area': answers['pln_area']})
+    seed.to_csv(args.seed, index=False)
+    features = derive_stand_areas(seed['lat'], seed['lon'],
+                                  seed['pln_area'])
+    with open(args.stand_areas, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+    print(f'derived the areas of {len(features)} planning areas from '
+          f'{len(seed)} taxi stands')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+'''
+The predictions of every taxi stand and horizon, kept in memory for the app.
+
+r_taxi_stand_pred only changes when predicted_count runs, so instead of a
+warehouse query per click the app reads the whole table once into a
+(horizons, stands) array and answers from it. After each run the prediction
+job appends a row to r_taxi_stand_pred_version; the cache looks at the
+latest one every check_interval seconds (a one row query) and reloads the
+predictions when it changed, or at the latest ttl seconds after the last
+load.
+'''
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from taxi_compass.storage import get_storage
+
+PREDICTION_TABLE = 'r_taxi_stand_pred'
+VERSION_TABLE = 'r_taxi_stand_pred_version'
+
+PREDICTION_TTL = int(os.environ.get('TAXI_COMPASS_PREDICTION_TTL', 900))
+PREDICTION_CHECK_INTERVAL = int(
+    os.environ.get('TAXI_COMPASS_PREDICTION_CHECK_INTERVAL', 30))
+
+QUERY_PREDICTIONS = """
+    select p.taxi_st_id as ts_id, p.taxi_count_pred as prediction,
+    p.timestamp_pred as timestamp_pred, c.taxi_st_lat as latitude,
+    c.taxi_st_lon as longitude
+    from {predictions} as p
+    left join {stands} as c
+    on p.taxi_st_id = c.taxi_st_id
+    """
+
+QUERY_VERSION = "select max(version) as version from {versions}"
+
+
+def singapore_now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(
+        tzinfo=None) + datetime.timedelta(hours=8)
+
+
+def write_version(storage, y_res):
+    '''
+    Append the marker of a new set of predictions, called by the prediction
+    job once they are merged into r_taxi_stand_pred
+    '''
+    version = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    storage.append(
+        VERSION_TABLE,
+        pd.DataFrame({
+            'version': [version],
+            'rows': [len(y_res)],
+            'timestamp_pred_min': [str(y_res['timestamp_pred'].min())],
+            'timestamp_pred_max': [str(y_res['timestamp_pred'].max())]
+        }))
+    return version
+
+
+class PredictionSnapshot:
+    '''
+    One load of r_taxi_stand_pred: counts[h, s] is the prediction of
+    taxi stand ts_ids[s] at horizons[h], NaN where there is none
+    '''
+    def __init__(self, df, version=None):
+        df = df.copy()
+        df['timestamp_pred'] = pd.to_datetime(df['timestamp_pred'])
+        stands = df.drop_duplicates('ts_id').sort_values('ts_id')
+        self.ts_ids = stands['ts_id'].to_numpy()
+        self.lat = stands['latitude'].to_numpy(dtype=np.float64)
+        self.lon = stands['longitude'].to_numpy(dtype=np.float64)
+        self.positions = {ts_id: i for i, ts_id in enumerate(self.ts_ids)}
+        self.horizons = np.sort(df['timestamp_pred'].unique())
+
+        self.counts = np.full((len(self.horizons), len(self.ts_ids)), np.nan,
+                              dtype=np.float32)
+        h = np.searchsorted(self.horizons, df['timestamp_pred'].to_numpy())
+        s = np.searchsorted(self.ts_ids, df['ts_id'].to_numpy())
+        self.counts[h, s] = df['prediction'].to_numpy(dtype=np.float32)
+        self.version = version
+
+    def __len__(self):
+        return int(np.isfinite(self.counts).sum())
+
+    def prediction_dates(self, now=None):
+        '''
+        The horizons still in the future (Singapore time), in the shape of
+        the app's prediction dates query
+        '''
+        now = singapore_now() if now is None else now
+        future = self.horizons[self.horizons > np.datetime64(now)]
+        return pd.DataFrame({
+            'pred_dates': pd.to_datetime(future),
+            'timestamp_pred': pd.to_datetime(future).astype(str)
+        })
+
+    def lookup(self, ts_ids, timestamp_pred):
+        '''
+        Predictions of ts_ids at timestamp_pred, in their order, skipping
+        the taxi stands without one: ts_id, prediction, timestamp_pred,
+        latitude, longitude
+        '''
+        timestamp_pred = np.datetime64(pd.Timestamp(timestamp_pred))
+        h = np.searchsorted(self.horizons, timestamp_pred)
+        s = np.array([self.positions.get(ts_id, -1) for ts_id in ts_ids],
+                     dtype=np.int64)
+        s = s[s >= 0]
+        if h == len(self.horizons) or self.horizons[h] != timestamp_pred:
+            s = s[:0]
+        prediction = self.counts[h, s] if len(s) else np.empty(0, np.float32)
+        s = s[np.isfinite(prediction)]
+        return pd.DataFrame({
+            'ts_id': self.ts_ids[s],
+            'prediction': prediction[np.isfinite(prediction)].astype(
+                np.float64),
+            'timestamp_pred': pd.Timestamp(timestamp_pred),
+            'latitude': self.lat[s],
+            'longitude': self.lon[s]
+        })
+
+
+class PredictionCache:
+    '''
+    Process wide PredictionSnapshot shared by every session of the app.
+
+    get() returns the current snapshot. Every check_interval seconds it
+    reads the latest version marker and reloads when the prediction job
+    wrote a new one, and it reloads anyway ttl seconds after the last load
+    (also when the marker table cannot be read). Only one thread reloads,
+    the snapshot is replaced whole so readers never see half of one.
+    '''
+    def __init__(self,
+                 storage=None,
+                 ttl=PREDICTION_TTL,
+                 check_interval=PREDICTION_CHECK_INTERVAL,
+                 clock=time.monotonic):
+        self.storage = storage
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.loaded_at = None
+        self.checked_at = None
+        self.loads = 0
+
+    def read_version(self):
+        storage = self.storage or get_storage()
+        try:
+            version = storage.read(
+                QUERY_VERSION.format(
+                    versions=storage.table_ref(VERSION_TABLE)))['version'][0]
+        except Exception as e:
+            print(f'could not read the prediction version: {e!r}')
+            return None
+        return None if pd.isna(version) else version
+
+    def load(self, version):
+        storage = self.storage or get_storage()
+        df = storage.read(
+            QUERY_PREDICTIONS.format(
+                predictions=storage.table_ref(PREDICTION_TABLE),
+                stands=storage.table_ref('c_taxi_stand')))
+        self.snapshot = PredictionSnapshot(df, version)
+        self.loaded_at = self.clock()
+        self.loads += 1
+        print(f'loaded {len(self.snapshot)} predictions, version {version}')
+
+    def fresh(self, now):
+        return self.snapshot is not None and \
+            now - self.checked_at < self.check_interval and \
+            now - self.loaded_at < self.ttl
+
+    def get(self):
+        '''
+        Return the PredictionSnapshot, reloading only when it may be stale
+        '''
+        if self.fresh(self.clock()):
+            return self.snapshot
+        with self.lock:
+            now = self.clock()
+            # another session may have reloaded while this one waited
+            if self.fresh(now):
+                return self.snapshot
+            version = self.read_version()
+            if self.snapshot is None or now - self.loaded_at >= self.ttl or \
+                    (version is not None and
+                     version != self.snapshot.version):
+                self.load(version)
+            self.checked_at = now
+        return self.snapshot
+
+    def invalidate(self):
+        '''
+        Reload on the next get(), e.g. right after triggering predictions
+        '''
+        with self.lock:
+            self.loaded_at = None
+            self.snapshot = None
+
+
+default_cache = None
+
+
+def get_prediction_cache():
+    global default_cache
+    if default_cache is None:
+        default_cache = PredictionCache()
+    return default_cache
@@ -0,0 +1,127 @@
+'''
+Rainfall at every taxi stand, interpolated from the weather stations.
+
+The k nearest stations of every taxi stand and their inverse distance
+weights make a sparse (taxi stands, stations) matrix, built once and again
+only when the taxi stands or the stations change. A rainfall snapshot is
+then one sparse product away from a value for every taxi stand, which the
+collectors write in the rainfall column of h_taxi_stand_taxi_count next to
+the counts of the same minute.
+'''
+import os
+
+import numpy as np
+from scipy import sparse
+
+from taxi_compass.feeds import RAINFALL_URL, rainfall_frame
+from taxi_compass.geo import nearest_facilities
+from taxi_compass.lta import make_session
+
+# Stations a taxi stand's rainfall is interpolated from, and the power of
+# the inverse distance weights
+RAINFALL_NEIGHBOURS = int(os.environ.get('TAXI_COMPASS_RAINFALL_NEIGHBOURS',
+                                         3))
+RAINFALL_POWER = float(os.environ.get('TAXI_COMPASS_RAINFALL_POWER', 2))
+
+# The rainfall is read next to the taxi counts, so a failing feed gives up
+# after one short try instead of holding the snapshot up with retries
+RAINFALL_TIMEOUT = float(os.environ.get('TAXI_COMPASS_RAINFALL_TIMEOUT', 3))
+rainfall_session = None
+
+
+class RainfallWeights:
+    '''
+    weights[s, j] is the share of station station_ids[j] in the rainfall of
+    taxi stand ts_ids[s], every row summing to 1
+    '''
+    def __init__(self, ts_ids, lat, lon, station_ids, station_lat,
+                 station_lon, k=RAINFALL_NEIGHBOURS, power=RAINFALL_POWER):
+        self.ts_ids = np.asarray(ts_ids)
+        self.station_ids = np.asarray(station_ids)
+        nearest = nearest_facilities(self.ts_ids, lat, lon, self.station_ids,
+                                     station_lat, station_lon, k, power)
+        stand_pos = {ts_id: i for i, ts_id in enumerate(self.ts_ids)}
+        self.station_pos = {s: j for j, s in enumerate(self.station_ids)}
+        self.weights = sparse.csr_matrix(
+            (nearest['weight'].to_numpy(),
+             (nearest['ts_id'].map(stand_pos).to_numpy(),
+              nearest['facility_id'].map(self.station_pos).to_numpy())),
+            shape=(len(self.ts_ids), len(self.station_ids)))
+
+    @classmethod
+    def from_frames(cls, ts_df, rainfall_df, **kwargs):
+        '''
+        From ts_df (ts_id, lat, lon) and a rainfall snapshot (station_id,
+        station_lat, station_lon)
+        '''
+        return cls(ts_df['ts_id'].to_numpy(), ts_df['lat'].to_numpy(),
+                   ts_df['lon'].to_numpy(),
+                   rainfall_df['station_id'].to_numpy(),
+                   rainfall_df['station_lat'].to_numpy(),
+                   rainfall_df['station_lon'].to_numpy(), **kwargs)
+
+    def matches(self, ts_df, rainfall_df):
+        return np.array_equal(self.ts_ids, ts_df['ts_id'].to_numpy()) and \
+            np.array_equal(self.station_ids,
+                           rainfall_df['station_id'].to_numpy())
+
+    def interpolate(self, rainfall_df):
+        '''
+        Rainfall of every taxi stand for a snapshot (station_id, rainfall).
+        A station without a reading is left out and the weights of the
+        others scaled up, NaN where none of the stations has one
+        '''
+        readings = np.full(len(self.station_ids), np.nan)
+        positions = rainfall_df['station_id'].map(self.station_pos)
+        known = positions.notna().to_numpy()
+        readings[positions[known].astype(np.int64).to_numpy()] = \
+            rainfall_df['rainfall'].to_numpy(dtype=np.float64)[known]
+        present = np.isfinite(readings)
+        totals = self.weights @ np.column_stack(
+            (np.where(present, readings, 0.0), present))
+        return np.divide(totals[:, 0], totals[:, 1],
+                         out=np.full(len(self.ts_ids), np.nan),
+                         where=totals[:, 1] > 0)
+
+
+rainfall_weights = None
+
+
+def stand_rainfall(ts_df, rainfall_df):
+    '''
+    Rainfall at every taxi stand of ts_df for the rainfall_frame snapshot,
+    with the process wide RainfallWeights, rebuilt only when the taxi
+    stands or the stations changed
+    '''
+    global rainfall_weights
+    if rainfall_weights is None or \
+            not rainfall_weights.matches(ts_df, rainfall_df):
+        rainfall_weights = RainfallWeights.from_frames(ts_df, rainfall_df)
+    return rainfall_weights.interpolate(rainfall_df)
+
+
+def get_rainfall_session():
+    '''
+    Process wide session for the rainfall feed, without retries
+    '''
+    global rainfall_session
+    if rainfall_session is None:
+        rainfall_session = make_session(pool_size=1, retries=0)
+    return rainfall_session
+
+
+def fetch_stand_rainfall(ts_df, session=None, url=RAINFALL_URL,
+                         timeout=RAINFALL_TIMEOUT):
+    '''
+    Rainfall at every taxi stand from the current data.gov.sg readings, None
+    when the feed cannot be read (the prediction then fills the gap from
+    the previous minutes)
+    '''
+    session = session or get_rainfall_session()
+    try:
+        r = session.get(url, timeout=timeout)
+        r.raise_for_status()
+        return stand_rainfall(ts_df, rainfall_frame(r.json()))
+    except Exception as e:
+        print(f'could not read the rainfall feed: {e!r}')
+        return None
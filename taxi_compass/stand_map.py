@@ -0,0 +1,214 @@
+'''
+The folium map of the app: the user, the nearby taxi stands coloured by
+their predicted taxi count, and the legend.
+
+All the taxi stands go into one GeoJSON layer of circle markers, whatever
+their number, instead of a Marker and an Icon (and their own script) per
+taxi stand. The colour of a taxi stand is a property of its feature that
+the layer style reads in the browser, so the page only grows by one small
+feature per taxi stand. The legend template is compiled once per process.
+'''
+import numpy as np
+
+# Colour of a taxi stand by predicted taxi count: up to the bound (included)
+COUNT_COLORS = ((0, 'lightgreen'), (2, 'green'), (4, 'blue'))
+MANY_COLOR = 'black'
+USER_COLOR = 'red'
+
+LEGEND_TEMPLATE = """
+{% macro html(this, kwargs) %}
+
+<!doctype html>
+<html lang="en">
+<head>
+  <meta charset="utf-8">
+  <meta name="viewport" content="width=device-width, initial-scale=1">
+  <title>jQuery UI Draggable - Default functionality</title>
+  <link rel="stylesheet"
+        href="//code.jquery.com/ui/1.12.1/themes/base/jquery-ui.css">
+
+  <script src="https://code.jquery.com/jquery-1.12.4.js"></script>
+  <script src="https://code.jquery.com/ui/1.12.1/jquery-ui.js"></script>
+
+  <script>
+  $( function() {
+    $( "#maplegend" ).draggable({
+                    start: function (event, ui) {
+                        $(this).css({
+                            right: "auto",
+                            top: "auto",
+                            bottom: "auto"
+                        });
+                    }
+                });
+});
+
+  </script>
+</head>
+<body>
+
+
+<div id='maplegend' class='maplegend'
+    style='position: absolute; z-index:9999; border:2px solid grey;
+     background-color:rgba(255, 255, 255, 0.8); border-radius:6px;
+     padding: 10px; font-size:14px; right: 20px; bottom: 20px;'>
+
+<div class='legend-title'>Legend</div>
+<div class='legend-scale'>
+  <ul class='legend-labels'>
+    <li><span style='background:red;opacity:0.7;'></span>You</li>
+    <li><span style='background:lightgreen;opacity:0.7;'></span>No Taxis</li>
+    <li><span style='background:green;opacity:0.7;'></span>Few Taxis</li>
+    <li><span style='background:blue;opacity:0.7;'></span>Several Taxis</li>
+    <li><span style='background:black;opacity:0.7;'></span>Lots of Taxis</li>
+
+  </ul>
+</div>
+</div>
+
+</body>
+</html>
+
+<style type='text/css'>
+  .maplegend .legend-title {
+    text-align: left;
+    margin-bottom: 5px;
+    font-weight: bold;
+    font-size: 90%;
+    }
+  .maplegend .legend-scale ul {
+    margin: 0;
+    margin-bottom: 5px;
+    padding: 0;
+    float: left;
+    list-style: none;
+    }
+  .maplegend .legend-scale ul li {
+    font-size: 80%;
+    list-style: none;
+    margin-left: 0;
+    line-height: 18px;
+    margin-bottom: 2px;
+    }
+  .maplegend ul.legend-labels li span {
+    display: block;
+    float: left;
+    height: 16px;
+    width: 30px;
+    margin-right: 5px;
+    margin-left: 0;
+    border: 1px solid #999;
+    }
+  .maplegend .legend-source {
+    font-size: 80%;
+    color: #777;
+    clear: both;
+    }
+  .maplegend a {
+    color: #777;
+    }
+</style>
+{% endmacro %}"""
+
+legend_template = None
+
+
+def prediction_colors(prediction):
+    '''
+    Colour of every predicted taxi count, same steps as the legend
+    '''
+    prediction = np.asarray(prediction, dtype=np.float64)
+    return np.select([prediction <= bound for bound, _ in COUNT_COLORS],
+                     [color for _, color in COUNT_COLORS],
+                     default=MANY_COLOR)
+
+
+def stand_features(results_df):
+    '''
+    GeoJSON FeatureCollection of the taxi stands of results_df (ts_id,
+    prediction, latitude, longitude)
+    '''
+    results_df = results_df.dropna(subset=['latitude', 'longitude'])
+    # the popup and the colour both use the count the popup shows
+    count = np.round(results_df['prediction'].to_numpy(
+        dtype=np.float64)).astype(np.int64)
+    return {
+        'type': 'FeatureCollection',
+        'features': [{
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [lon, lat]
+            },
+            'properties': {
+                'ts_id': ts_id,
+                'prediction': count,
+                'color': color
+            }
+        } for ts_id, lat, lon, count, color in zip(
+            results_df['ts_id'].tolist(), results_df['latitude'].tolist(),
+            results_df['longitude'].tolist(),
+            count.tolist(),
+            prediction_colors(count).tolist())]
+    }
+
+
+# Leaflet colours each circle from its feature, so the style is the same
+# few bytes however many taxi stands there are
+STAND_STYLE = """
+function(feature) {
+    return {color: feature.properties.color,
+            fillColor: feature.properties.color};
+}
+"""
+
+
+def stand_layer(results_df):
+    '''
+    One folium GeoJson layer with a coloured circle marker per taxi stand
+    '''
+    import folium
+    from folium.utilities import JsCode
+    return folium.GeoJson(
+        stand_features(results_df),
+        name='taxi stands',
+        marker=folium.CircleMarker(radius=9,
+                                   weight=1,
+                                   fill=True,
+                                   fill_opacity=0.8),
+        popup=folium.GeoJsonPopup(fields=['prediction'],
+                                  aliases=['Predicted Taxi Count Here:']),
+        tooltip=folium.GeoJsonTooltip(fields=['ts_id'], labels=False),
+        style=JsCode(STAND_STYLE))
+
+
+def legend():
+    '''
+    The legend element, its template is compiled on the first call only
+    '''
+    global legend_template
+    from branca.element import MacroElement, Template
+    if legend_template is None:
+        legend_template = Template(LEGEND_TEMPLATE)
+    macro = MacroElement()
+    macro._template = legend_template
+    return macro
+
+
+def stand_map(coordinates, results_df, zoom_start=14):
+    '''
+    The map centred on coordinates (lat, lon) with the user, the taxi stands
+    of results_df and the legend
+    '''
+    import folium
+    m = folium.Map(location=[coordinates[0], coordinates[1]],
+                   zoom_start=zoom_start,
+                   tiles='openstreetmap')
+    folium.Marker(
+        location=[coordinates[0], coordinates[1]],
+        popup='You are here',
+        icon=folium.Icon(color=USER_COLOR, icon="car", prefix='fa'),
+    ).add_to(m)
+    stand_layer(results_df).add_to(m)
+    legend().add_to(m)
+    return m
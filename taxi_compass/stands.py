@@ -0,0 +1,146 @@
+import json
+import os
+import time
+
+import pandas as pd
+
+from taxi_compass.geo import StandIndex
+
+BUCKET_NAME = 'static-file-storage'
+BUCKET_TAXI_STAND_GEOJSON_PATH = 'lta-taxi-stop-geojson.geojson'
+
+# Copy of the LTA geojson shipped with the package, used when GCS is not
+# reachable
+LOCAL_TAXI_STAND_GEOJSON_PATH = os.path.join(os.path.dirname(__file__),
+                                             'data',
+                                             'lta-taxi-stop-geojson.geojson')
+# The same taxi stands compiled by taxi_compass.catalog
+LOCAL_CATALOG_PATH = os.path.join(os.path.dirname(__file__), 'data',
+                                  'stand_catalog')
+
+
+def parse_taxi_stands(taxi_stands_json):
+    '''
+    Parse the geojson with taxi stands into a set of taxi stand id and lat,lon
+    '''
+    return pd.DataFrame([{
+        'ts_id': ts['properties']['Name'],
+        'lat': ts['geometry']['coordinates'][1],
+        'lon': ts['geometry']['coordinates'][0]
+    } for ts in taxi_stands_json['features']])
+
+
+class StandCache:
+    '''
+    Taxi stands kept warm in memory between invocations of the same instance.
+
+    The first call downloads the geojson from GCS and builds ts_df and the
+    StandIndex (radian lat/lon arrays plus the KD-tree). Later calls return
+    them straight from memory. Every check_interval seconds the blob
+    generation/etag is looked up again and the stands are only reloaded when
+    the file in the bucket changed. A geojson with the same md5 as the one
+    the bundled catalog was compiled from is not downloaded, the catalog is
+    memory mapped instead. If GCS cannot be reached, the bundled catalog (or
+    the bundled copy of the geojson without catalog_path) is used instead.
+    '''
+    def __init__(self,
+                 bucket_name=BUCKET_NAME,
+                 blob_path=BUCKET_TAXI_STAND_GEOJSON_PATH,
+                 local_path=LOCAL_TAXI_STAND_GEOJSON_PATH,
+                 check_interval=300,
+                 catalog_path=LOCAL_CATALOG_PATH):
+        self.bucket_name = bucket_name
+        self.blob_path = blob_path
+        self.local_path = local_path
+        self.catalog_path = catalog_path
+        self.check_interval = check_interval
+        self.storage_client = None
+        self.version = None
+        self.checked_at = None
+        self.ts_df = None
+        self.index = None
+
+    def load(self, taxi_stands_json, version):
+        self.ts_df = parse_taxi_stands(taxi_stands_json)
+        self.index = StandIndex.from_dataframe(self.ts_df)
+        self.version = version
+
+    def load_catalog(self, version=None):
+        '''
+        Load the stands from the compiled catalog, False when there is none
+        '''
+        if not self.catalog_path or not os.path.exists(self.catalog_path):
+            return False
+        from taxi_compass.catalog import load_catalog
+        catalog = load_catalog(self.catalog_path)
+        if version is not None and \
+                catalog.meta['geojson_md5'] != version[-1]:
+            return False
+        self.ts_df = catalog.ts_df()
+        self.index = catalog.index()
+        self.version = catalog.version if version is None else version
+        return True
+
+    def get_blob(self):
+        '''
+        Blob metadata (generation, etag) from GCS, one small API request
+        '''
+        if self.storage_client is None:
+            from google.cloud import storage
+            self.storage_client = storage.Client()
+        bucket = self.storage_client.bucket(self.bucket_name)
+        return bucket.get_blob(self.blob_path)
+
+    def refresh(self):
+        try:
+            blob = self.get_blob()
+            version = (blob.generation, blob.etag,
+                       getattr(blob, 'md5_hash', None))
+            if version != self.version:
+                if self.load_catalog(version):
+                    print('bucket json unchanged, loaded the stand catalog')
+                    return
+                self.load(json.loads(blob.download_as_bytes()), version)
+                print('loaded json successfully from bucket')
+        except Exception as e:
+            if self.index is not None:
+                print(f'could not check taxi stands in bucket, keeping '
+                      f'version {self.version}: {e!r}')
+                return
+            print(f'could not load taxi stands from bucket, using local '
+                  f'copy: {e!r}')
+            if self.load_catalog():
+                return
+            with open(self.local_path) as geofile:
+                self.load(json.load(geofile), ('local', self.local_path))
+
+    def get(self):
+        '''
+        Return (ts_df, index), reloading only when they may be stale
+        '''
+        now = time.monotonic()
+        if self.index is None or self.checked_at is None or \
+                now - self.checked_at >= self.check_interval:
+            self.refresh()
+            self.checked_at = now
+        return self.ts_df, self.index
+
+    def invalidate(self):
+        '''
+        Force a generation check on the next get()
+        '''
+        self.checked_at = None
+
+
+default_stand_cache = None
+
+
+def get_stand_cache():
+    '''
+    StandCache shared by everything in the process, e.g. every session of
+    the app
+    '''
+    global default_stand_cache
+    if default_stand_cache is None:
+        default_stand_cache = StandCache()
+    return default_stand_cache
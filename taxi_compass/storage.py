@@ -0,0 +1,345 @@
+import os
+import sqlite3
+import threading
+
+PROJECT_ID = 'taxi-compass-lewagon'
+DATASET = 'api_dataset'
+
+# 'bigquery' writes to the api_dataset tables in GCP, 'sqlite' to the same
+# table names in one local file, to run the whole pipeline on one box
+STORAGE_BACKEND = os.environ.get('TAXI_COMPASS_STORAGE', 'bigquery')
+SQLITE_PATH = os.environ.get('TAXI_COMPASS_SQLITE_PATH', 'taxi_compass.db')
+
+# Rows sent to SQLite per executemany call
+SQLITE_BATCH_SIZE = 10000
+
+
+class BigQueryStorage:
+    '''
+    Tables of the api_dataset in BigQuery
+    '''
+    dialect = 'bigquery'
+
+    def __init__(self, project=PROJECT_ID, dataset=DATASET, client=None):
+        self.project = project
+        self.dataset = dataset
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google.cloud import bigquery
+            self._client = bigquery.Client(project=self.project)
+        return self._client
+
+    def table_id(self, table):
+        return f'{self.project}.{self.dataset}.{table}'
+
+    def table_ref(self, table):
+        '''
+        How table is written in a query
+        '''
+        return f'`{self.table_id(table)}`'
+
+    def read(self, query, params=None):
+        '''
+        Run a query and return the result as a dataframe. params are named
+        query parameters (@name in the query)
+        '''
+        from google.cloud import bigquery
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter(name, parameter_type(value), value)
+            for name, value in (params or {}).items()
+        ])
+        return self.client.query(query, job_config=job_config).result(
+        ).to_dataframe(create_bqstorage_client=True)
+
+    def append(self, table, df):
+        '''
+        Append df to table with one load job. The dataframe is sent as
+        parquet, so the whole batch goes in columnar in a single request.
+        Columns df has and the table not yet are added to the table
+        '''
+        from google.cloud import bigquery
+        job_config = bigquery.LoadJobConfig(
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            schema_update_options=[
+                bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION
+            ])
+        table_id = self.table_id(table)
+        self.client.load_table_from_dataframe(
+            df, table_id, job_config=job_config).result()
+        print("Loaded {} rows and {} columns to {}".format(
+            len(df), len(df.columns), table_id))
+        return len(df)
+
+    def stream(self, table, df, keys=None):
+        '''
+        Send df with the streaming API instead of a load job: the rows are
+        queryable within seconds, and when keys are given they make the
+        insertId, so BigQuery drops a retried row it already has
+        '''
+        import json
+        rows = json.loads(df.to_json(orient='records', date_format='iso'))
+        row_ids = None
+        if keys:
+            row_ids = ['|'.join(str(row[k]) for k in keys) for row in rows]
+        errors = self.client.insert_rows_json(self.table_id(table),
+                                              rows,
+                                              row_ids=row_ids)
+        if errors:
+            raise RuntimeError(f'streaming insert into {table} failed: '
+                               f'{errors[:3]}')
+        print("Streamed {} rows to {}".format(len(df), self.table_id(table)))
+        return len(df)
+
+    def add_columns(self, table, staging):
+        '''
+        Add the columns of the staging table table does not have yet, so
+        the MERGE can write them
+        '''
+        target = self.client.get_table(self.table_id(table))
+        names = {field.name for field in target.schema}
+        added = [field for field in self.client.get_table(staging).schema
+                 if field.name not in names]
+        if added:
+            target.schema = list(target.schema) + added
+            self.client.update_table(target, ['schema'])
+
+    def upsert(self, table, df, keys, expire_column=None, expire_before=None):
+        '''
+        Load df into <table>_staging, then MERGE it into table on keys:
+        changed rows are updated, new rows inserted, and rows missing from
+        df with expire_column < expire_before deleted. MERGE is a single
+        atomic statement, so readers see the table either before or after,
+        never empty, and unchanged rows are not rewritten.
+        '''
+        from google.cloud import bigquery
+        staging = self.table_id(f'{table}_staging')
+        job_config = bigquery.LoadJobConfig(
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+        self.client.load_table_from_dataframe(
+            df, staging, job_config=job_config).result()
+        self.add_columns(table, staging)
+
+        columns = list(df.columns)
+        values = [c for c in columns if c not in keys]
+        on = ' AND '.join(f'T.{k} = S.{k}' for k in keys)
+        changed = ' OR '.join(f'T.{c} IS DISTINCT FROM S.{c}' for c in values)
+        update = ', '.join(f'{c} = S.{c}' for c in values)
+        insert = ', '.join(columns)
+        insert_values = ', '.join(f'S.{c}' for c in columns)
+        merge = f"""
+        MERGE `{self.table_id(table)}` T
+        USING `{staging}` S
+        ON {on}
+        """
+        if values:
+            merge += f"""WHEN MATCHED AND ({changed})
+        THEN UPDATE SET {update}
+        """
+        merge += f"""WHEN NOT MATCHED BY TARGET
+        THEN INSERT ({insert}) VALUES ({insert_values})
+        """
+        query_parameters = []
+        if expire_column is not None:
+            merge += f"""WHEN NOT MATCHED BY SOURCE
+        AND T.{expire_column} < @expire_before THEN DELETE
+        """
+            query_parameters.append(
+                bigquery.ScalarQueryParameter('expire_before', 'STRING',
+                                              str(expire_before)))
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=query_parameters)
+        return self.client.query(merge, job_config=job_config).result()
+
+
+class SQLiteStorage:
+    '''
+    Local stand-in for the warehouse: the same table names in one SQLite
+    file, so the pipeline can run and be tested on one box
+    '''
+    dialect = 'sqlite'
+
+    def __init__(self, path=':memory:', batch_size=SQLITE_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # the connection is shared by threads, one statement or
+        # transaction at a time
+        self.lock = threading.RLock()
+        if path != ':memory:':
+            # readers (the app) are not blocked while the collectors write
+            self.conn.execute('pragma journal_mode=wal')
+
+    def read(self, query, params=None):
+        import pandas as pd
+        with self.lock:
+            return pd.read_sql_query(query, self.conn, params=params)
+
+    def table_ref(self, table):
+        return table
+
+    def table_exists(self, table):
+        return self.conn.execute(
+            "select 1 from sqlite_master where type = 'table' and name = ?",
+            (table, )).fetchone() is not None
+
+    def create_table(self, table, df):
+        import pandas as pd
+        with self.conn:
+            self.conn.execute(pd.io.sql.get_schema(df, table, con=self.conn))
+
+    def add_columns(self, table, df):
+        '''
+        Add the columns of df table does not have yet, like BigQuery loads
+        with ALLOW_FIELD_ADDITION
+        '''
+        existing = {row[1] for row in
+                    self.conn.execute(f'pragma table_info({table})')}
+        with self.conn:
+            for c in df.columns:
+                if c not in existing:
+                    self.conn.execute(f'alter table {table} add column {c} '
+                                      f'{sqlite_type(df[c])}')
+
+    def append(self, table, df):
+        '''
+        Append df to table, creating it from the dataframe columns the first
+        time. Values are converted column by column (datetimes to text the
+        way to_sql stores them) and inserted in batches of batch_size rows,
+        all in one transaction
+        '''
+        with self.lock:
+            if not self.table_exists(table):
+                self.create_table(table, df)
+            else:
+                self.add_columns(table, df)
+            columns = [sqlite_values(df[c]) for c in df.columns]
+            rows = list(zip(*columns))
+            insert = (f'insert into {table} ({", ".join(df.columns)}) '
+                      f'values ({", ".join("?" * len(df.columns))})')
+            with self.conn:
+                for start in range(0, len(rows), self.batch_size):
+                    self.conn.executemany(insert,
+                                          rows[start:start + self.batch_size])
+        print("Loaded {} rows and {} columns to {}".format(
+            len(df), len(df.columns), table))
+        return len(df)
+
+    def stream(self, table, df, keys=None):
+        '''
+        Rows are visible as soon as they are committed here, so streaming is
+        a plain append, or an upsert on keys to drop rows already stored
+        '''
+        if keys:
+            self.upsert(table, df, keys)
+            return len(df)
+        return self.append(table, df)
+
+    def upsert(self, table, df, keys, expire_column=None, expire_before=None):
+        '''
+        Same as BigQueryStorage.upsert: df goes to <table>_staging first,
+        then one transaction upserts it (SQLite has no MERGE) and deletes
+        the expired rows
+        '''
+        with self.lock:
+            staging = f'{table}_staging'
+            df.to_sql(staging, self.conn, if_exists='replace', index=False)
+
+            columns = list(df.columns)
+            values = [c for c in columns if c not in keys]
+            with self.conn:
+                if not self.table_exists(table):
+                    self.conn.execute(
+                        f'create table {table} as select * from {staging} '
+                        f'where 0')
+                else:
+                    self.add_columns(table, df)
+                self.conn.execute(
+                    f'create unique index if not exists {table}_keys '
+                    f'on {table} ({", ".join(keys)})')
+
+            on = ' AND '.join(f'T.{k} = S.{k}' for k in keys)
+            update = ', '.join(f'{c} = excluded.{c}' for c in values)
+            changed = ' OR '.join(f'{c} IS NOT excluded.{c}' for c in values)
+            conflict = (f'do update set {update} where {changed}'
+                        if values else 'do nothing')
+            with self.conn:
+                self.conn.execute(f"""
+                    insert into {table} ({', '.join(columns)})
+                    select {', '.join(columns)} from {staging} where true
+                    on conflict ({', '.join(keys)}) {conflict}
+                    """)
+                if expire_column is not None:
+                    self.conn.execute(
+                        f"""
+                        delete from {table} as T
+                        where T.{expire_column} < ?
+                        and not exists (select 1 from {staging} S where {on})
+                        """, (str(expire_before), ))
+
+
+def sqlite_type(series):
+    '''
+    Column type pandas gives a series when it creates a SQLite table
+    '''
+    import pandas as pd
+    if pd.api.types.is_bool_dtype(series) or \
+            pd.api.types.is_integer_dtype(series):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(series):
+        return 'REAL'
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'TIMESTAMP'
+    return 'TEXT'
+
+
+def parameter_type(value):
+    '''
+    BigQuery type of a query parameter value
+    '''
+    import datetime
+    if isinstance(value, bool):
+        return 'BOOL'
+    if isinstance(value, int):
+        return 'INT64'
+    if isinstance(value, float):
+        return 'FLOAT64'
+    if isinstance(value, datetime.datetime):
+        return 'DATETIME'
+    return 'STRING'
+
+
+def sqlite_values(series):
+    '''
+    Python values of a column for sqlite3: datetimes become text, numpy
+    scalars plain int/float, missing values None
+    '''
+    import pandas as pd
+    if pd.api.types.is_datetime64_any_dtype(series):
+        values = series.astype(str).to_numpy(dtype=object)
+        values[series.isna().to_numpy()] = None
+        return values.tolist()
+    values = series.astype(object).where(series.notna(), None)
+    return values.tolist()
+
+
+default_storage = None
+
+
+def get_storage():
+    '''
+    Process wide storage picked with TAXI_COMPASS_STORAGE (and
+    TAXI_COMPASS_SQLITE_PATH for the local file)
+    '''
+    global default_storage
+    if default_storage is None:
+        if STORAGE_BACKEND == 'sqlite':
+            default_storage = SQLiteStorage(SQLITE_PATH)
+        elif STORAGE_BACKEND == 'bigquery':
+            default_storage = BigQueryStorage()
+        else:
+            raise ValueError(
+                f'unknown TAXI_COMPASS_STORAGE {STORAGE_BACKEND!r}')
+    return default_storage
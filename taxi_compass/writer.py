@@ -0,0 +1,266 @@
+import atexit
+import fcntl
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+from taxi_compass.storage import get_storage
+
+# 'buffered' coalesces snapshots into one load every FLUSH_SECONDS or
+# FLUSH_ROWS, 'stream' sends every snapshot right away with the streaming API
+WRITE_MODE = os.environ.get('TAXI_COMPASS_WRITE_MODE', 'buffered')
+
+# Latency to visibility: buffered rows are loaded at the latest on the first
+# write after they are FLUSH_SECONDS old. 0 loads every snapshot as it comes.
+FLUSH_SECONDS = float(os.environ.get('TAXI_COMPASS_FLUSH_SECONDS', 0))
+FLUSH_ROWS = int(os.environ.get('TAXI_COMPASS_FLUSH_ROWS', 50000))
+
+# Snapshots waiting for the next load are kept here, one parquet file each,
+# so they survive a crash or the end of the process
+SPOOL_DIR = os.environ.get('TAXI_COMPASS_SPOOL_DIR',
+                           os.path.join(tempfile.gettempdir(),
+                                        'taxi_compass_spool'))
+
+# Columns that identify a snapshot row in each of the history tables
+DEDUP_KEYS = {
+    'h_taxi_stand_taxi_count': ['ts_id', 'timestamp'],
+    'h_weather_rainfall': ['station_id', 'update_time'],
+    'h_mrt_status_availability': ['stn_id', 'update_time'],
+}
+
+
+class BufferedWriter:
+    '''
+    Collect the per-minute snapshots of one table and write them to the
+    storage in fewer, bigger batches.
+
+    Every write is first saved in the spool directory (written to a temp file
+    and renamed, so a file is either complete or absent). The buffer is
+    flushed as one columnar load when it holds max_rows rows or its oldest
+    snapshot is max_age seconds old; only then are the spool files removed.
+
+    Every writer spools into a directory of its own under
+    <spool_dir>/<table>, named after its host and pid, and holds an
+    exclusive flock on the matching .lock file for as long as it lives. A
+    writer created later takes over the directories whose lock it can get,
+    the ones left behind by a crash or a process that exited before a
+    flush, and leaves alone those of writers still running (another cron
+    run or function instance sharing the spool).
+
+    Right before a load the spool files are renamed to .loading. If the
+    process dies between the load and the removal of those files, the rows
+    may already be stored, so a flush with recovered .loading snapshots is
+    an upsert on keys instead of an append, and the second load changes
+    nothing (at-least-once delivery, stored once). Snapshots that were never
+    loaded, and regular flushes, stay plain appends.
+
+    spool_dir=None keeps the buffer in memory only, for long running
+    processes that can afford to lose it. mode='stream' skips the buffer and
+    sends every snapshot with the streaming API.
+    '''
+    def __init__(self,
+                 table,
+                 keys=None,
+                 storage=None,
+                 mode=WRITE_MODE,
+                 max_age=FLUSH_SECONDS,
+                 max_rows=FLUSH_ROWS,
+                 spool_dir=SPOOL_DIR):
+        if mode not in ('buffered', 'stream'):
+            raise ValueError(f'unknown write mode {mode!r}')
+        self.table = table
+        self.keys = keys
+        self.storage = storage or get_storage()
+        self.mode = mode
+        self.max_age = max_age
+        self.max_rows = max_rows
+        self.spool_dir = None
+        self.table_dir = None
+        self.owner_lock = None
+        self.lock = threading.Lock()
+        self.frames = []
+        self.files = []
+        self.rows = 0
+        self.oldest = None
+        self.recovered = False
+        self.started_at = time.time()
+        if spool_dir and mode == 'buffered':
+            self.table_dir = os.path.join(spool_dir, table)
+            os.makedirs(self.table_dir, exist_ok=True)
+            owner = f'{socket.gethostname()}-{os.getpid()}-{time.time_ns()}'
+            self.owner_lock = self.claim(owner)
+            self.spool_dir = os.path.join(self.table_dir, owner)
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self.recover()
+
+    def claim(self, owner):
+        '''
+        Open and flock <owner>.lock, again if a recovering writer removed it
+        in between. Returns the open lock file
+        '''
+        path = os.path.join(self.table_dir, f'{owner}.lock')
+        while True:
+            lock_file = open(path, 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if os.fstat(lock_file.fileno()).st_nlink:
+                return lock_file
+            lock_file.close()
+
+    def close(self):
+        '''
+        Release the spool of this writer, what is left in it is taken over
+        by the next writer of the table
+        '''
+        if self.owner_lock is not None:
+            self.owner_lock.close()
+            self.owner_lock = None
+
+    def recover(self):
+        '''
+        Take over the spool directories of the writers of this table that
+        are gone, and the files spooled directly under the table by older
+        versions of this writer
+        '''
+        for name in sorted(os.listdir(self.table_dir)):
+            path = os.path.join(self.table_dir, name)
+            if name.endswith('.lock') and path != self.owner_lock.name:
+                self.take_over(path)
+            elif name.endswith(('.parquet', '.parquet.loading')) and \
+                    os.path.getmtime(path) < self.started_at:
+                self.adopt(path)
+        if self.files:
+            print(f'recovered {self.rows} spooled rows for {self.table}'
+                  f'{", upserting them" if self.recovered else ""}')
+
+    def take_over(self, lock_path):
+        try:
+            lock_file = open(lock_path, 'a')
+        except FileNotFoundError:
+            return
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # its writer is still running
+                return
+            owner_dir = lock_path[:-len('.lock')]
+            if os.path.isdir(owner_dir):
+                for name in sorted(os.listdir(owner_dir)):
+                    if name.endswith(('.parquet', '.parquet.loading')):
+                        self.adopt(os.path.join(owner_dir, name))
+                    else:
+                        os.remove(os.path.join(owner_dir, name))
+                os.rmdir(owner_dir)
+            os.remove(lock_path)
+
+    def adopt(self, path):
+        '''
+        Move a spool file of a writer that is gone into this one's spool
+        '''
+        name = os.path.basename(path)
+        if name.endswith('.loading'):
+            # the previous process died while loading it
+            self.recovered = True
+        written_at = os.path.getmtime(path)
+        df = pd.read_parquet(path)
+        moved = os.path.join(self.spool_dir, name)
+        os.replace(path, moved)
+        self.add(df, moved, written_at)
+
+    def add(self, df, path, written_at):
+        self.frames.append(df)
+        self.rows += len(df)
+        if path is not None:
+            self.files.append(path)
+        if self.oldest is None:
+            self.oldest = written_at
+
+    def spool(self, df):
+        name = f'{time.time_ns():020d}.parquet'
+        path = os.path.join(self.spool_dir, name)
+        df.to_parquet(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+        return path
+
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        return self.rows >= self.max_rows or (
+            self.oldest is not None and now - self.oldest >= self.max_age)
+
+    def write(self, df):
+        '''
+        Add one snapshot, and flush if the buffer is due. Returns the number
+        of rows written to the storage by this call
+        '''
+        if self.mode == 'stream':
+            return self.storage.stream(self.table, self.dedup(df), self.keys)
+        with self.lock:
+            path = self.spool(df) if self.spool_dir else None
+            self.add(df, path, time.time())
+            if self.due():
+                return self.flush_locked()
+        return 0
+
+    def dedup(self, df):
+        if self.keys:
+            df = df.drop_duplicates(subset=self.keys, keep='last')
+        return df.reset_index(drop=True)
+
+    def flush(self):
+        '''
+        Write everything buffered now, whether it is due or not
+        '''
+        with self.lock:
+            return self.flush_locked()
+
+    def flush_locked(self):
+        if not self.frames:
+            return 0
+        df = self.dedup(pd.concat(self.frames, ignore_index=True))
+        for i, path in enumerate(self.files):
+            if not path.endswith('.loading'):
+                os.replace(path, path + '.loading')
+                self.files[i] = path + '.loading'
+        if self.recovered and self.keys:
+            self.storage.upsert(self.table, df, self.keys)
+        else:
+            self.storage.append(self.table, df)
+        for path in self.files:
+            os.remove(path)
+        self.frames, self.files = [], []
+        self.rows, self.oldest = 0, None
+        self.recovered = False
+        return len(df)
+
+
+writers = {}
+
+
+def get_writer(table, **kwargs):
+    '''
+    Process wide BufferedWriter of a table, so the buffer is shared by all
+    the invocations that land on the same instance
+    '''
+    if not writers:
+        atexit.register(flush_writers)
+    if table not in writers:
+        writers[table] = BufferedWriter(table, DEDUP_KEYS.get(table),
+                                        **kwargs)
+    return writers[table]
+
+
+def flush_writers():
+    '''
+    Flush every process wide writer, registered to run when the process
+    exits so the one-shot collector scripts do not leave their snapshot in
+    the spool
+    '''
+    for writer in writers.values():
+        try:
+            writer.flush()
+        except Exception as e:
+            print(f'could not flush {writer.table}, it stays spooled: {e!r}')
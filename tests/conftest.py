@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def predictions():
+    '''
+    Factory of r_taxi_stand_pred rows: every taxi stand of stands predicted
+    for minutes minutes from start
+    '''
+    def make(start, minutes=15, stands=('kml_1', 'kml_2'), count=1.0):
+        timestamps = pd.date_range(start, periods=minutes,
+                                   freq='min').astype(str)
+        return pd.DataFrame({
+            'taxi_st_id': [s for s in stands for _ in timestamps],
+            'timestamp_pred': [t for _ in stands for t in timestamps],
+            'taxi_count_pred': count
+        })
+
+    return make
+
+
+@pytest.fixture
+def model_inputs():
+    '''
+    Factory of n rows of model inputs in FEATURE_COLUMNS order. taxi_st_num
+    is the row number, so the order of the predictions can be checked
+    '''
+    def make(n, seed=0):
+        rng = np.random.default_rng(seed)
+        return np.column_stack(
+            (np.arange(n), rng.poisson(1.5, n), rng.choice([0.0, 0.2, 1.4],
+                                                           n),
+             rng.integers(0, 2, n), rng.integers(0, 2, n),
+             rng.uniform(-1, 1, (n, 4)))).astype(np.float32)
+
+    return make
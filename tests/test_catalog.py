@@ -0,0 +1,71 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.replay import load_stands
+from taxi_compass.catalog import (StandCatalog, compile_catalog, geojson_md5,
+                                  stand_types)
+from taxi_compass.planning_area import PlanningAreaResolver
+from taxi_compass.stands import LOCAL_TAXI_STAND_GEOJSON_PATH
+
+REPO = os.path.dirname(os.path.dirname(__file__))
+
+
+def test_stand_types_match_the_regex_loop():
+    with open(LOCAL_TAXI_STAND_GEOJSON_PATH) as f:
+        descriptions = [feature['properties']['Description']
+                        for feature in json.load(f)['features']]
+    expected = [
+        str(re.findall(r'TAXI STAND|TAXI STOP|TAXI PICK UP',
+                       row)).strip("['']") for row in descriptions
+    ]
+    assert stand_types(descriptions).tolist() == expected
+
+
+def test_bundled_catalog_is_current(tmp_path):
+    '''
+    The committed catalog is what the compiler makes of the raw data now
+    '''
+    with open(LOCAL_TAXI_STAND_GEOJSON_PATH, 'rb') as f:
+        geojson_bytes = f.read()
+    mrt_links = pd.read_csv(os.path.join(REPO, 'raw_data',
+                                         'mrt_stn_taxi_st_id.csv'),
+                            encoding='utf-8-sig')
+    resolver = PlanningAreaResolver(str(tmp_path / 'missing.geojson'), None)
+    meta = compile_catalog(geojson_bytes, mrt_links, resolver,
+                           str(tmp_path / 'catalog'))
+    compiled, bundled = StandCatalog(str(tmp_path / 'catalog')), StandCatalog()
+    assert meta == bundled.meta
+    assert bundled.meta['geojson_md5'] == geojson_md5(geojson_bytes)
+    for name in ('ts_ids', 'lat', 'lon', 'lat_rad', 'type_code',
+                 'pln_area_code', 'mrt_offsets', 'mrt_codes'):
+        np.testing.assert_array_equal(getattr(compiled, name),
+                                      getattr(bundled, name))
+
+
+def test_catalog_gives_what_the_geojson_gives():
+    catalog = StandCatalog()
+    assert isinstance(catalog.lat, np.memmap)
+    pd.testing.assert_frame_equal(catalog.ts_df(), load_stands())
+    # the index works on the stored radians, not a conversion of its own
+    index = catalog.index()
+    assert np.shares_memory(index.lat_rad, catalog.lat_rad)
+    assert np.shares_memory(index.lon_rad, catalog.lon_rad)
+    np.testing.assert_array_equal(index.lat_rad, np.deg2rad(catalog.lat))
+
+    expected = pd.read_csv(os.path.join(REPO, 'raw_data',
+                                        'taxi_stand_df.csv'))
+    stand_stop_df = catalog.stand_stop_df()
+    assert stand_stop_df['taxi_pln_area'].tolist() == \
+        expected['pln_area'].tolist()
+    assert stand_stop_df['taxi_st_type'].tolist() == \
+        expected['taxi_st_type'].fillna('').tolist()
+
+    mrt_links = pd.read_csv(os.path.join(REPO, 'raw_data',
+                                         'mrt_stn_taxi_st_id.csv'),
+                            encoding='utf-8-sig').dropna()
+    assert set(map(tuple, catalog.mrt_links().to_numpy())) == \
+        set(map(tuple, mrt_links.to_numpy()))
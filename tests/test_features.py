@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks import reference
+from benchmarks.synthetic import get_data_frame
+from taxi_compass.features import array_creation, preprocessing
+
+
+def test_preprocessing_matches_original():
+    # crosses midnight into a Saturday so weekend_bool changes
+    taxi_df_pred = get_data_frame(n_stands=25, minutes=90, missing=0.2)
+    pd.testing.assert_frame_equal(preprocessing(taxi_df_pred),
+                                  reference.preprocessing(taxi_df_pred))
+
+
+def test_preprocessing_without_gaps_matches_original():
+    taxi_df_pred = get_data_frame(n_stands=5, minutes=10, missing=0)
+    pd.testing.assert_frame_equal(preprocessing(taxi_df_pred),
+                                  reference.preprocessing(taxi_df_pred))
+
+
+def test_preprocessing_fills_every_minute():
+    taxi_df_pred = get_data_frame(n_stands=3, minutes=45, missing=0.4, seed=3)
+    df = preprocessing(taxi_df_pred)
+    for _, stand in df.groupby('taxi_st_num'):
+        steps = stand['taxi_update_time'].diff().dropna().unique()
+        assert list(steps) == [pd.Timedelta(minutes=1)]
+    assert set(df['weekend_bool']) == {0, 1}
+
+
+def test_array_creation_matches_original():
+    df = preprocessing(get_data_frame(n_stands=12, minutes=20, missing=0))
+    X_ref, X_pred_ref = reference.array_creation(df, n_stands=12)
+    X_mas, X_mas_pred, mask = array_creation(df)
+    assert X_mas.dtype == np.float32
+    assert mask.all()
+    np.testing.assert_allclose(X_mas, X_ref, rtol=1e-6)
+    pd.testing.assert_frame_equal(X_mas_pred, X_pred_ref)
+
+
+def test_array_creation_pads_ragged_stands():
+    df = preprocessing(get_data_frame(n_stands=4, minutes=20, missing=0))
+    # stand 2 loses its last 5 minutes, stand 5 is asked for but has no rows
+    df = df[~((df["taxi_st_num"] == 2) &
+              (df["taxi_update_time"] >= df["taxi_update_time"].max() -
+               pd.Timedelta(minutes=4)))]
+    X_mas, X_mas_pred, mask = array_creation(df, stands=[1, 2, 3, 4, 5])
+    assert X_mas.shape == (5, 20, 9)
+    assert mask.sum(axis=1).tolist() == [20, 15, 20, 20, 0]
+    assert not X_mas[~mask].any()
+    assert len(X_mas[mask]) == len(X_mas_pred) == 75
+    np.testing.assert_array_equal(X_mas[mask][:, 0],
+                                  X_mas_pred["taxi_st_num"])
@@ -0,0 +1,199 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from taxi_compass.geo import StandIndex, count_taxis_per_stand, haversine_km
+
+GEOJSON_PATH = os.path.join(os.path.dirname(__file__), '..', 'raw_data',
+                            'lta-taxi-stop-geojson.geojson')
+
+
+def load_ts_df():
+    with open(GEOJSON_PATH) as geofile:
+        taxi_stands_json = json.load(geofile)
+    return pd.DataFrame([{
+        'ts_id': ts['properties']['Name'],
+        'lat': ts['geometry']['coordinates'][1],
+        'lon': ts['geometry']['coordinates'][0]
+    } for ts in taxi_stands_json['features']])
+
+
+def per_taxi_counts(ts_df, coordinates, cutoff_distance):
+    '''
+    The original per taxi implementation (find_nearest_taxi_stand called for
+    every taxi, then ts_counter[ts] += 1), kept as the reference
+    '''
+    def find_nearest_taxi_stand(taxi_lat, taxi_lon):
+        taxi_lat_rad = np.deg2rad(np.float64(taxi_lat))
+        taxi_lon_rad = np.deg2rad(np.float64(taxi_lon))
+        ts_lat_rad = np.deg2rad(np.array(ts_df['lat'].tolist()))
+        ts_lon_rad = np.deg2rad(np.array(ts_df['lon'].tolist()))
+        dlat = ts_lat_rad - taxi_lat_rad
+        dlon = ts_lon_rad - taxi_lon_rad
+        d = np.sin(dlat / 2)**2 + np.cos(ts_lat_rad) * np.cos(
+            taxi_lat_rad) * np.sin(dlon / 2)**2
+        df = ts_df.copy()
+        df['distance'] = 2 * 6371 * np.arcsin(np.sqrt(d))
+        df.sort_values(by='distance', inplace=True)
+        return df.iloc[:10]
+
+    ts_counter = dict(zip(ts_df['ts_id'].tolist(), [0] * len(ts_df)))
+    for lat, lon in coordinates:
+        d_df = find_nearest_taxi_stand(lat, lon)
+        d_df = d_df[d_df['distance'] < cutoff_distance]
+        for ts in d_df['ts_id'].tolist():
+            ts_counter[ts] += 1
+    return np.array([ts_counter[ts] for ts in ts_df['ts_id']])
+
+
+def synthetic_fleet(ts_df, n_random=1000, seed=42):
+    '''
+    Taxis spread over Singapore plus a few taxis parked around every stand
+    '''
+    rng = np.random.default_rng(seed)
+    spread = np.column_stack((1.24 + rng.random(n_random) * 0.22,
+                              103.62 + rng.random(n_random) * 0.40))
+    stands = ts_df[['lat', 'lon']].to_numpy()
+    parked = np.repeat(stands, 3, axis=0) + rng.normal(
+        0, 0.0012, (len(stands) * 3, 2))
+    return np.vstack((spread, parked))
+
+
+def test_numpy_engine_matches_per_taxi_loop():
+    ts_df = load_ts_df()
+    coordinates = synthetic_fleet(ts_df)
+    for cutoff_distance in (0.1, 0.2):
+        expected = per_taxi_counts(ts_df, coordinates, cutoff_distance)
+        counts = count_taxis_per_stand(coordinates,
+                                       ts_df[['lat', 'lon']].to_numpy(),
+                                       cutoff_distance,
+                                       max_stands=10,
+                                       chunk_size=512)
+        assert expected.sum() > 0
+        np.testing.assert_array_equal(counts, expected)
+
+
+def test_stand_index_matches_per_taxi_loop():
+    ts_df = load_ts_df()
+    coordinates = synthetic_fleet(ts_df, seed=7)
+    index = StandIndex.from_dataframe(ts_df)
+    for cutoff_distance in (0.1, 0.2):
+        expected = per_taxi_counts(ts_df, coordinates, cutoff_distance)
+        counts = index.count_within(coordinates[:, 0], coordinates[:, 1],
+                                    cutoff_distance, max_stands=10)
+        np.testing.assert_array_equal(counts, expected)
+
+
+def test_max_stands_keeps_nearest():
+    # one taxi next to 3 stands only counts for the nearest 2
+    stands = np.array([[1.3, 103.8], [1.3001, 103.8], [1.3003, 103.8]])
+    taxi = np.array([[1.3, 103.8]])
+    counts = count_taxis_per_stand(taxi, stands, 0.2, max_stands=2)
+    np.testing.assert_array_equal(counts, [1, 1, 0])
+    index = StandIndex(['a', 'b', 'c'], stands[:, 0], stands[:, 1])
+    np.testing.assert_array_equal(
+        index.count_within(taxi[:, 0], taxi[:, 1], 0.2, max_stands=2),
+        [1, 1, 0])
+
+
+def test_empty_snapshot():
+    stands = np.array([[1.3, 103.8]])
+    assert count_taxis_per_stand(np.empty((0, 2)), stands, 0.2).tolist() == [0]
+    index = StandIndex(['a'], stands[:, 0], stands[:, 1])
+    assert index.count_within([], [], 0.2).tolist() == [0]
+
+
+def test_nearest_and_within_match_full_sort():
+    ts_df = load_ts_df()
+    index = StandIndex.from_dataframe(ts_df)
+    lat, lon = 1.3005, 103.8552
+    distance = haversine_km(np.deg2rad(lat), np.deg2rad(lon),
+                            index.lat_rad, index.lon_rad)
+    order = np.argsort(distance)
+
+    ts_ids, nearest_distance = index.nearest(lat, lon, 7)
+    assert ts_ids.tolist() == ts_df['ts_id'].to_numpy()[order[:7]].tolist()
+    np.testing.assert_allclose(nearest_distance, distance[order[:7]])
+
+    ts_ids, within_distance = index.within(lat, lon, 1.0)
+    inside = order[distance[order] < 1.0]
+    assert ts_ids.tolist() == ts_df['ts_id'].to_numpy()[inside].tolist()
+    np.testing.assert_allclose(within_distance, distance[inside])
+
+
+def test_query_radius_per_origin_cutoff_and_max_stands():
+    stands = np.array([[1.3, 103.8], [1.3001, 103.8], [1.3003, 103.8]])
+    index = StandIndex(['a', 'b', 'c'], stands[:, 0], stands[:, 1])
+    taxi_idx, stand_idx, _ = index.query_radius([1.3, 1.3], [103.8, 103.8],
+                                                [0.005, 0.2], [5, 2])
+    assert taxi_idx.tolist() == [0, 1, 1]
+    assert stand_idx.tolist() == [0, 0, 1]
+
+
+def test_nearest_zero_stands_is_empty():
+    index = StandIndex.from_dataframe(load_ts_df())
+    stand_idx, distance = index.query_knn([1.3, 1.31], [103.85, 103.86], 0)
+    assert stand_idx.shape == distance.shape == (2, 0)
+    ts_ids, distance = index.nearest(1.3005, 103.8552, 0)
+    assert ts_ids.tolist() == [] and distance.tolist() == []
+
+
+def test_nearest_weather_station_matches_cross_join():
+    from math import asin, cos, radians, sin, sqrt
+
+    from benchmarks.replay import fixture
+    from googlebigquery.insert_taxi_stn_weather_stn import \
+        nearest_weather_stations
+    from taxi_compass.feeds import rainfall_frame
+
+    def haversine_distance(lon1, lat1, lon2, lat2):
+        lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
+        a = sin((lat2 - lat1) / 2)**2 + \
+            cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2)**2
+        return 2 * 6371 * asin(sqrt(a))
+
+    taxi_st_df = load_ts_df().rename(columns={
+        'ts_id': 'taxi_st_id', 'lat': 'taxi_st_lat', 'lon': 'taxi_st_lon'})
+    weather_df = rainfall_frame(fixture('rainfall.json'))[[
+        'station_id', 'station_lat', 'station_lon']]
+
+    # the original: cross join, row-wise haversine, sort, drop_duplicates
+    combined_df = pd.merge(taxi_st_df, weather_df, how="cross")
+    combined_df["distance"] = combined_df.apply(
+        lambda x: haversine_distance(x["station_lon"], x["station_lat"],
+                                     x["taxi_st_lon"], x["taxi_st_lat"]),
+        axis=1)
+    expected = combined_df.sort_values('distance').drop_duplicates(
+        ["taxi_st_id"]).set_index('taxi_st_id')['station_id']
+
+    nearest = nearest_weather_stations(taxi_st_df, weather_df)
+    assert list(nearest.columns) == ['taxi_st_id', 'weather_stn_id']
+    assert len(nearest) == len(taxi_st_df)
+    assert (nearest.set_index('taxi_st_id')['weather_stn_id'] ==
+            expected.loc[nearest['taxi_st_id']].to_numpy()).all()
+
+
+def test_nearest_facilities_k_weights_and_max_distance():
+    from taxi_compass.geo import nearest_facilities
+    facilities = (['s1', 's2', 's3'], [1.30, 1.31, 1.40],
+                  [103.80, 103.85, 103.90])
+    nearest = nearest_facilities(['a', 'b'], [1.30, 1.35], [103.81, 103.90],
+                                 *facilities, k=2)
+    assert nearest['ts_id'].tolist() == ['a', 'a', 'b', 'b']
+    assert nearest['facility_id'].tolist() == ['s1', 's2', 's3', 's2']
+    assert nearest['rank'].tolist() == [0, 1, 0, 1]
+    np.testing.assert_allclose(
+        nearest.groupby('ts_id')['weight'].sum().to_numpy(), 1)
+    d = nearest['distance'].to_numpy()[:2]
+    np.testing.assert_allclose(nearest['weight'][:2], d[::-1]**2 /
+                               (d**2).sum())
+
+    exact = nearest_facilities(['a'], [1.30], [103.80], *facilities, k=2)
+    assert exact['weight'].tolist() == [1.0, 0.0]
+
+    near = nearest_facilities(['a', 'b'], [1.30, 1.35], [103.81, 103.90],
+                              *facilities, k=2, max_distance=2)
+    assert near['ts_id'].tolist() == ['a']
+    assert near['weight'].tolist() == [1.0]
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from taxi_compass.history import CountHistory
+
+
+def counts_frame(start, minutes, n_stands=5, seed=0):
+    '''
+    Rows like h_taxi_stand_taxi_count, one per taxi stand per minute
+    '''
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range(start, periods=minutes, freq='min') + \
+        pd.Timedelta(seconds=12)
+    return pd.DataFrame({
+        'ts_id': np.tile([f'kml_{i}' for i in range(n_stands)], minutes),
+        'lat': np.tile(1.3 + np.arange(n_stands) / 100, minutes),
+        'lon': np.tile(103.8 + np.arange(n_stands) / 100, minutes),
+        'taxi_count': rng.poisson(2, n_stands * minutes),
+        'timestamp': np.repeat(timestamps, n_stands)
+    })
+
+
+def test_import_export_round_trip_across_midnight(tmp_path):
+    history = CountHistory(str(tmp_path))
+    df = counts_frame('2022-01-20 23:50', 20)
+    history.import_frame(df)
+    assert sorted(p.name for p in tmp_path.glob('*.npy')) == [
+        '2022-01-20.npy', '2022-01-21.npy'
+    ]
+
+    exported = history.export_frame('2022-01-20 23:50', 20)
+    expected = df.assign(timestamp=df['timestamp'].dt.floor('min'))
+    pd.testing.assert_frame_equal(exported, expected, check_dtype=False)
+    assert exported['taxi_count'].dtype == np.int64
+
+    # reopened from disk, the matrix and the stand dictionary are the same
+    reopened = CountHistory(str(tmp_path))
+    np.testing.assert_array_equal(reopened.window('2022-01-20 23:50', 20),
+                                  history.window('2022-01-20 23:50', 20))
+
+
+def test_window_of_one_day_is_a_view(tmp_path):
+    history = CountHistory(str(tmp_path))
+    history.import_frame(counts_frame('2022-01-20 10:00', 30))
+    window = history.window('2022-01-20 10:14', 16)
+    assert window.shape == (5, 16)
+    assert np.shares_memory(window, history.day('2022-01-20'))
+    assert not window.flags.writeable
+    # minutes without a snapshot are MISSING
+    before = history.window('2022-01-20 09:58', 4)
+    assert (before[:, :2] == history.MISSING).all()
+    assert (before[:, 2:] != history.MISSING).all()
+
+
+def test_new_stands_and_large_counts(tmp_path):
+    history = CountHistory(str(tmp_path))
+    history.import_frame(counts_frame('2022-01-20 10:00', 2, n_stands=3))
+    df = counts_frame('2022-01-20 10:02', 1, n_stands=4)
+    df.loc[3, 'taxi_count'] = 1000
+    history.import_frame(df)
+
+    window = history.window('2022-01-20 10:00', 3)
+    assert window.shape == (4, 3)
+    assert (window[3, :2] == history.MISSING).all()
+    assert window[3, 2] == history.MISSING - 1
+
+    wide = CountHistory(str(tmp_path / 'wide'), dtype='uint16')
+    wide.import_frame(df)
+    assert wide.window('2022-01-20 10:02', 1)[3, 0] == 1000
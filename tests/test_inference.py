@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from taxi_compass.inference import LocalPredictor
+
+xgb = pytest.importorskip('xgboost')
+
+
+def test_local_predictor_gives_count_bins(model_inputs):
+    pred = LocalPredictor().predict(model_inputs(500))
+    assert pred.shape == (500, )
+    assert pred.dtype == np.float64
+    assert set(np.unique(pred)) <= {0.0, 1.0, 2.0, 3.0, 4.0}
+
+
+def test_batches_match_a_single_dmatrix_predict(model_inputs):
+    X = model_inputs(1000, seed=1)
+    predictor = LocalPredictor(batch_size=128, n_threads=2)
+    expected = predictor.booster.predict(xgb.DMatrix(X.astype(np.float32)))
+    np.testing.assert_array_equal(predictor.predict(X), expected)
+    assert len(predictor.predict(X[:0])) == 0
@@ -0,0 +1,76 @@
+import asyncio
+
+from benchmarks.replay import (MRT_LIST_PATH, OfflineStandCache,
+                               replay_routes, replay_urls)
+from benchmarks.stub_server import StubServer
+from taxi_compass.ingest import IngestService, default_feeds
+from taxi_compass.storage import SQLiteStorage
+
+
+def replay_service(stub, storage, **kwargs):
+    intervals = {
+        'taxi_stand_count': 0.2,
+        'mrt_status': 0.2,
+        'weather_rainfall': 0.5,
+        'taxi_availability': 0.5
+    }
+    return IngestService(default_feeds(intervals),
+                         storage,
+                         stand_cache=OfflineStandCache(),
+                         mrt_list_path=MRT_LIST_PATH,
+                         urls=replay_urls(stub),
+                         writer_kwargs={'spool_dir': None},
+                         **kwargs)
+
+
+def count(storage, table):
+    return storage.read(f'select count(*) as n from {table}')['n'][0]
+
+
+def test_all_feeds_run_on_their_intervals():
+    storage = SQLiteStorage()
+    with StubServer(replay_routes()) as stub:
+        service = replay_service(stub, storage)
+        stats = asyncio.run(service.run(duration=1.1))
+
+    feeds = stats['feeds']
+    assert all(feed['errors'] == 0 for feed in feeds.values()), feeds
+    assert feeds['taxi_stand_count']['runs'] >= 4
+    assert feeds['weather_rainfall']['runs'] in (2, 3)
+    n_stands = len(service.stand_cache.ts_df)
+    assert count(storage, 'h_taxi_stand_taxi_count') == \
+        n_stands * feeds['taxi_stand_count']['runs']
+    assert count(storage, 'h_taxi_availability') == \
+        300 * feeds['taxi_availability']['runs']
+    assert feeds['taxi_stand_count']['rows_per_s'] > 0
+    assert 0 < feeds['taxi_stand_count']['max_lag_s'] < 1
+
+    # the counts carry the rainfall once the rainfall feed has run
+    counts = storage.read('select rainfall from h_taxi_stand_taxi_count')
+    assert counts['rainfall'].notna().sum() >= n_stands
+
+    mrt = storage.read('select stn_id, non_disruption_bool '
+                       'from h_mrt_status_availability')
+    disrupted = set(mrt.loc[mrt['non_disruption_bool'] == 0, 'stn_id'])
+    assert disrupted == {'NS1', 'NS2', 'NS3'}
+    # the mrt station list is read once and kept in memory
+    assert service.mrt_list_loaded_at is not None
+    # one call per run
+    assert stub.requests.count(('/rainfall', {})) == \
+        feeds['weather_rainfall']['runs']
+
+
+def test_a_failing_feed_does_not_stop_the_others():
+    storage = SQLiteStorage()
+    routes = replay_routes()
+    del routes['/rainfall']
+    with StubServer(routes) as stub:
+        stats = asyncio.run(replay_service(stub, storage).run(duration=0.7))
+
+    feeds = stats['feeds']
+    assert feeds['weather_rainfall']['errors'] == \
+        feeds['weather_rainfall']['runs'] >= 1
+    assert '404' in feeds['weather_rainfall']['last_error']
+    assert feeds['taxi_stand_count']['errors'] == 0
+    assert count(storage, 'h_taxi_stand_taxi_count') > 0
+    assert min(feed['runs'] for feed in feeds.values()) >= 1
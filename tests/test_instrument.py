@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import get_data_frame
+from taxi_compass import instrument
+from taxi_compass.features import array_creation, preprocessing
+
+
+def log_lines(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()
+            if line.startswith('{')]
+
+
+def pipeline(mode):
+    with instrument.run('test', mode):
+        df = preprocessing(get_data_frame(20, 60))
+        array_creation(df)
+        with instrument.stage('write') as s:
+            s.record(pd.DataFrame({'a': range(7)}))
+
+
+def test_summary_logs_one_line_per_run(capsys):
+    pipeline('summary')
+    lines = log_lines(capsys)
+    assert len(lines) == 1
+    record = lines[0]
+    assert record == instrument.last_runs['test']
+    assert record['severity'] == 'INFO'
+    assert set(record['stages']) == {'preprocessing', 'array_creation',
+                                     'write'}
+    assert record['stages']['write']['rows'] == 7
+    assert record['stages']['write']['calls'] == 1
+    for metrics in record['stages'].values():
+        assert metrics['wall_s'] >= 0 and metrics['bytes'] > 0
+
+
+def test_stages_report_their_own_memory_growth(capsys):
+    with instrument.run('memory', 'summary'):
+        with instrument.stage('heavy'):
+            np.ones(64 * 1024**2 // 8).sum()
+        with instrument.stage('light'):
+            np.ones(1024).sum()
+    record = log_lines(capsys)[0]
+    heavy, light = record['stages']['heavy'], record['stages']['light']
+    assert heavy['peak_rss_growth_mb'] >= 0
+    # the process peak of the heavy stage is not the light stage's
+    assert light['peak_rss_growth_mb'] == 0
+    assert record['process_peak_rss_mb'] >= heavy['peak_rss_growth_mb']
+
+
+def test_detailed_logs_stages_and_profile(capsys, monkeypatch, tmp_path):
+    monkeypatch.setattr(instrument, 'PROFILE_DIR', str(tmp_path))
+    pipeline('detailed')
+    lines = log_lines(capsys)
+    assert [line.get('stage') for line in lines[:-1]] == [
+        'preprocessing', 'array_creation', 'write'
+    ]
+    assert lines[-1]['profile'].startswith(str(tmp_path))
+    assert len(list(tmp_path.glob('test-*.prof'))) == 1
+
+
+def test_off_logs_nothing(capsys):
+    instrument.last_runs.clear()
+    pipeline('off')
+    assert log_lines(capsys) == []
+    assert instrument.last_runs == {}
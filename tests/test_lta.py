@@ -0,0 +1,86 @@
+import json
+import os
+
+import numpy as np
+
+from benchmarks.stub_server import StubServer
+from taxi_compass.lta import get_taxi_coordinates, make_session
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'fixtures',
+                            'lta_taxi_availability.json')
+
+
+def load_recorded_pages():
+    with open(FIXTURE_PATH) as f:
+        recorded = json.load(f)
+    return recorded['page_size'], recorded['pages']
+
+
+def taxi_availability_route(pages, page_size, failures=None):
+    '''
+    Replay the recorded pages by $skip, failing the first call of the skips
+    listed in failures with a 503
+    '''
+    failures = dict(failures or {})
+
+    def route(query, body):
+        skip = int(query.get('$skip', 0))
+        if failures.get(skip):
+            failures[skip] -= 1
+            return 503, {'error': 'try again'}
+        index = skip // page_size
+        if index < len(pages):
+            return 200, pages[index]
+        return 200, {'value': []}
+
+    return route
+
+
+def expected_coordinates(pages):
+    return np.array([[row['Latitude'], row['Longitude']] for page in pages
+                     for row in page['value']])
+
+
+def test_fetches_all_pages_in_order():
+    page_size, pages = load_recorded_pages()
+    routes = {'/Taxi-Availability': taxi_availability_route(pages, page_size)}
+    with StubServer(routes) as stub:
+        coordinates = get_taxi_coordinates(url=stub.url +
+                                           '/Taxi-Availability',
+                                           concurrency=2,
+                                           page_size=page_size)
+    assert coordinates.dtype == np.float64
+    np.testing.assert_array_equal(coordinates, expected_coordinates(pages))
+
+
+def test_stops_at_first_empty_page():
+    page_size = 2
+    pages = [{'value': [{'Latitude': 1.3, 'Longitude': 103.8}] * 2}] * 5
+    routes = {'/Taxi-Availability': taxi_availability_route(pages, page_size)}
+    with StubServer(routes) as stub:
+        coordinates = get_taxi_coordinates(url=stub.url +
+                                           '/Taxi-Availability',
+                                           concurrency=4,
+                                           page_size=page_size)
+    assert coordinates.shape == (10, 2)
+    # pages 0-3, then 4-7 where page 5 is empty, nothing after that window
+    skips = sorted(int(query['$skip']) for _, query in stub.requests)
+    assert skips == [0, 2, 4, 6, 8, 10, 12, 14]
+
+
+def test_retries_failed_pages_with_backoff():
+    page_size, pages = load_recorded_pages()
+    routes = {
+        '/Taxi-Availability':
+        taxi_availability_route(pages, page_size, failures={500: 2})
+    }
+    with StubServer(routes) as stub:
+        session = make_session(pool_size=2, retries=3, backoff_factor=0.01)
+        coordinates = get_taxi_coordinates(session,
+                                           url=stub.url +
+                                           '/Taxi-Availability',
+                                           concurrency=2,
+                                           page_size=page_size)
+    np.testing.assert_array_equal(coordinates, expected_coordinates(pages))
+    skips = [int(query['$skip']) for _, query in stub.requests]
+    assert skips.count(500) == 3
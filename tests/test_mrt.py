@@ -0,0 +1,95 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import reference
+from benchmarks.replay import MRT_LIST_PATH, fixture
+from taxi_compass import feeds
+from taxi_compass.feeds import MrtSchedule, load_mrt_list, mrt_status_frame
+from taxi_compass.storage import SQLiteStorage
+
+NORMAL_SERVICE = {'value': {'Status': 1, 'AffectedSegments': []}}
+
+
+def test_status_frame_matches_reference():
+    mrt_list = load_mrt_list(MRT_LIST_PATH)
+    alerts = fixture('train_service_alerts.json')
+    schedule = MrtSchedule(mrt_list)
+    for hour in (3, 5, 12, 23):
+        update_time = datetime.datetime(2022, 1, 20, hour, 50)
+        pd.testing.assert_frame_equal(
+            schedule.status_frame(alerts, update_time),
+            reference.mrt_status_frame(mrt_list, alerts, update_time))
+    assert set(schedule.status_frame(alerts, update_time).query(
+        'non_disruption_bool == 0')['stn_id']) == {'NS1', 'NS2', 'NS3'}
+
+
+def test_in_operation_every_minute_of_the_day():
+    mrt_list = load_mrt_list(MRT_LIST_PATH)
+    schedule = MrtSchedule(mrt_list)
+    update_times = pd.date_range('2022-01-20', periods=24 * 60, freq='min')
+    in_operation = schedule.in_operation(update_times)
+    for i, update_time in enumerate(update_times.to_pydatetime()):
+        for s, row in mrt_list.iterrows():
+            expected = reference.check_operation_bool(
+                update_time,
+                reference.get_first_time(update_time, row['stn_first_train']),
+                reference.get_last_time(update_time, row['stn_last_train']))
+            if row['stn_last_train'].startswith('0:') and \
+                    update_time.time() <= datetime.datetime.strptime(
+                        row['stn_last_train'], '%H:%M:%S').time():
+                # the previous day's last trains, the original saw none
+                expected = 1.0
+            assert in_operation[i, s] == expected, (update_time,
+                                                    row['stn_id'])
+
+
+def test_unreadable_schedule_is_not_in_operation():
+    mrt_list = load_mrt_list(MRT_LIST_PATH)
+    mrt_list.loc[0, 'stn_first_train'] = 'n/a'
+    status = mrt_status_frame(mrt_list, NORMAL_SERVICE,
+                              datetime.datetime(2022, 1, 20, 12, 0))
+    assert status['in_operation_bool'].tolist() == [0.0] + [1.0] * 7
+
+
+def test_history_frame_backfills_minutes():
+    schedule = MrtSchedule(load_mrt_list(MRT_LIST_PATH))
+    start = datetime.datetime(2022, 1, 20, 23, 58)
+    history = schedule.history_frame(start, 5,
+                                     fixture('train_service_alerts.json'))
+    assert len(history) == 5 * len(schedule)
+    for update_time, rows in history.groupby('update_time', sort=False):
+        expected = schedule.status_frame(
+            fixture('train_service_alerts.json'),
+            datetime.datetime.strptime(update_time, '%Y-%m-%d %H:%M:%S'))
+        pd.testing.assert_frame_equal(rows.reset_index(drop=True), expected)
+    # TE8 stops at 23:59, CC3 runs past midnight
+    te8 = history.query('stn_id == "TE8"')['in_operation_bool'].tolist()
+    cc3 = history.query('stn_id == "CC3"')['in_operation_bool'].tolist()
+    assert te8 == [1.0, 1.0, 0.0, 0.0, 0.0]
+    assert cc3 == [1.0] * 5
+
+    storage = SQLiteStorage(':memory:')
+    storage.append('h_mrt_status_availability', history)
+    assert storage.read('select count(*) as n from h_mrt_status_availability'
+                        )['n'][0] == len(history)
+
+
+def test_schedule_is_cached(monkeypatch):
+    loads = []
+
+    def load(path):
+        loads.append(path)
+        return load_mrt_list(MRT_LIST_PATH)
+
+    monkeypatch.setattr(feeds, 'load_mrt_list', load)
+    monkeypatch.setattr(feeds, 'mrt_schedule', None)
+    clock = iter([0, 10, feeds.MRT_LIST_REFRESH_SECONDS + 1])
+    first = feeds.get_mrt_schedule(MRT_LIST_PATH, lambda: next(clock))
+    assert feeds.get_mrt_schedule(MRT_LIST_PATH, lambda: next(clock)) is first
+    assert feeds.get_mrt_schedule(MRT_LIST_PATH,
+                                  lambda: next(clock)) is not first
+    assert len(loads) == 2
+    np.testing.assert_array_equal(first.first[:2],
+                                  [5 * 3600 + 13 * 60, 5 * 3600 + 4 * 60])
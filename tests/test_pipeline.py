@@ -0,0 +1,21 @@
+import pytest
+
+from benchmarks.bench_pipeline import run
+
+pytest.importorskip('xgboost')
+
+
+def test_replayed_pipeline_reports_every_stage():
+    result = run(n_taxis=2000, n_stands=400, minutes=3)
+    assert result['taxis'] == 2000
+    assert set(result['ingest_seconds_per_minute']) == {
+        'fetch', 'assign', 'write'
+    }
+    assert set(result['predict_seconds']) == {
+        'read', 'preprocessing', 'array_creation', 'inference', 'write_back'
+    }
+    assert result['rows'] == {
+        'snapshot': 400,
+        'model_input': 1200,
+        'predictions': 1200
+    }
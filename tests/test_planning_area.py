@@ -0,0 +1,119 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from taxi_compass.planning_area import (DERIVED_STAND_AREAS_PATH,
+                                        PlanningAreaResolver, PlanningAreas,
+                                        derive_stand_areas)
+
+REPO = os.path.dirname(os.path.dirname(__file__))
+
+
+def square(x0, y0, size):
+    return [[x0, y0], [x0 + size, y0], [x0 + size, y0 + size],
+            [x0, y0 + size], [x0, y0]]
+
+
+def boundaries():
+    '''
+    A square with a hole, the hole as a second area, and a two part area
+    described the way the data.gov.sg kml export does
+    '''
+    return [{
+        'properties': {'PLN_AREA_N': 'RING'},
+        'geometry': {'type': 'Polygon',
+                     'coordinates': [square(0, 0, 4), square(1, 1, 2)]}
+    }, {
+        'properties': {'PLN_AREA_N': 'HOLE'},
+        'geometry': {'type': 'Polygon', 'coordinates': [square(1, 1, 2)]}
+    }, {
+        'properties': {'Name': 'kml_3',
+                       'Description': '<table><tr><th>PLN_AREA_N</th> '
+                                      '<td>ISLANDS</td></tr></table>'},
+        'geometry': {'type': 'MultiPolygon',
+                     'coordinates': [[square(10, 0, 1)], [square(20, 0, 1)]]}
+    }]
+
+
+def test_locate_points():
+    areas = PlanningAreas(boundaries())
+    lon = [0.5, 2.0, 3.5, 10.5, 20.5, 15.0, -1.0]
+    lat = [0.5, 2.0, 3.9, 0.5, 0.2, 0.5, 2.0]
+    assert areas.locate(lat, lon).tolist() == [
+        'RING', 'HOLE', 'RING', 'ISLANDS', 'ISLANDS', None, None]
+
+
+def test_resolver_caches_results(tmp_path, monkeypatch):
+    boundary_path = tmp_path / 'boundaries.geojson'
+    boundary_path.write_text(json.dumps({'features': boundaries()}))
+    cache_path = tmp_path / 'cache.csv'
+    resolver = PlanningAreaResolver(str(boundary_path), str(cache_path),
+                                    seed_path=None)
+    assert resolver.resolve([0.5, 0.5], [10.5, 15.0]).tolist() == [
+        'ISLANDS', None]
+    assert pd.read_csv(cache_path)['pln_area'].tolist() == ['ISLANDS']
+
+    # later builds with the same polygons read the cache instead of them
+    resolver = PlanningAreaResolver(str(boundary_path), str(cache_path),
+                                    seed_path=None)
+    monkeypatch.setattr(PlanningAreas, 'from_geojson', None)
+    assert resolver.resolve([0.5000001], [10.5]).tolist() == ['ISLANDS']
+
+
+def test_resolver_ignores_the_cache_of_other_polygons(tmp_path):
+    boundary_path = tmp_path / 'boundaries.geojson'
+    boundary_path.write_text(json.dumps({'features': boundaries()}))
+    cache_path = tmp_path / 'cache.csv'
+    PlanningAreaResolver(str(boundary_path), str(cache_path),
+                         seed_path=None).resolve([0.5], [10.5])
+
+    features = boundaries()
+    features[2]['properties'] = {'PLN_AREA_N': 'OUTER ISLANDS'}
+    boundary_path.write_text(json.dumps({'features': features}))
+    resolver = PlanningAreaResolver(str(boundary_path), str(cache_path),
+                                    seed_path=None)
+    assert resolver.cache == {}
+    assert resolver.resolve([0.5], [10.5]).tolist() == ['OUTER ISLANDS']
+
+
+def taxi_stand_coordinates():
+    with open(os.path.join(REPO, 'raw_data',
+                           'lta-taxi-stop-geojson.geojson')) as f:
+        features = json.load(f)['features']
+    lon, lat = np.array([f['geometry']['coordinates'][:2]
+                         for f in features]).T
+    return lat, lon
+
+
+def test_taxi_stands_resolve_offline_from_seed(tmp_path):
+    lat, lon = taxi_stand_coordinates()
+    resolver = PlanningAreaResolver(str(tmp_path / 'missing.geojson'),
+                                    str(tmp_path / 'cache.csv'))
+    expected = pd.read_csv(os.path.join(REPO, 'raw_data',
+                                        'taxi_stand_df.csv'))['pln_area']
+    assert resolver.resolve(lat, lon).tolist() == expected.tolist()
+
+
+def test_derived_stand_areas_give_the_onemap_answers():
+    '''
+    The bundled stand areas are built around these taxi stands, so they
+    give them back the OneMap answers; other points get the nearest one's
+    '''
+    lat, lon = taxi_stand_coordinates()
+    expected = pd.read_csv(os.path.join(REPO, 'raw_data',
+                                        'taxi_stand_df.csv'))['pln_area']
+    areas = PlanningAreas.from_geojson(DERIVED_STAND_AREAS_PATH)
+    assert areas.locate(lat, lon).tolist() == expected.tolist()
+    # a point away from every taxi stand still gets an area
+    assert areas.locate([1.3521], [103.8198])[0] is not None
+
+
+def test_derived_stand_areas_give_the_nearest_area():
+    features = derive_stand_areas([1.2, 1.2, 1.4], [103.7, 104.0, 103.85],
+                                  ['WEST', 'EAST', 'NORTH'])
+    areas = PlanningAreas(features)
+    assert areas.locate([1.21, 1.19, 1.45, 1.5],
+                        [103.75, 103.95, 103.85, 103.85]).tolist() == \
+        ['WEST', 'EAST', 'NORTH', None]
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+from taxi_compass.predictions import (PredictionCache, PredictionSnapshot,
+                                      write_version)
+from taxi_compass.storage import SQLiteStorage
+
+STANDS = pd.DataFrame({
+    'taxi_st_id': ['kml_1', 'kml_2', 'kml_3'],
+    'taxi_st_lat': [1.30, 1.31, 1.32],
+    'taxi_st_lon': [103.80, 103.81, 103.82]
+})
+
+
+def publish(storage, y_res):
+    storage.upsert('r_taxi_stand_pred',
+                   y_res,
+                   keys=['taxi_st_id', 'timestamp_pred'],
+                   expire_column='timestamp_pred',
+                   expire_before=y_res['timestamp_pred'].min())
+    write_version(storage, y_res)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lookup_matches_the_join(predictions):
+    storage = SQLiteStorage()
+    storage.append('c_taxi_stand', STANDS)
+    y_res = predictions('2022-01-20 10:15')
+    y_res.loc[y_res['taxi_st_id'] == 'kml_2', 'taxi_count_pred'] = 3.0
+    publish(storage, y_res)
+    snapshot = PredictionCache(storage).get()
+
+    looked_up = snapshot.lookup(['kml_2', 'kml_3', 'kml_9', 'kml_1'],
+                                '2022-01-20 10:20:00')
+    assert looked_up['ts_id'].tolist() == ['kml_2', 'kml_1']
+    assert looked_up['prediction'].tolist() == [3.0, 1.0]
+    assert looked_up['latitude'].tolist() == [1.31, 1.30]
+    assert looked_up['longitude'].tolist() == [103.81, 103.80]
+    assert snapshot.lookup(['kml_1'], '2022-01-20 12:00').empty
+
+    dates = snapshot.prediction_dates(pd.Timestamp('2022-01-20 10:24'))
+    assert len(dates) == 5
+    assert dates['timestamp_pred'].iloc[0] == '2022-01-20 10:25:00'
+
+
+def test_reloads_on_new_version_or_ttl(predictions):
+    storage = SQLiteStorage()
+    storage.append('c_taxi_stand', STANDS)
+    publish(storage, predictions('2022-01-20 10:15'))
+    clock = Clock()
+    cache = PredictionCache(storage, ttl=600, check_interval=30, clock=clock)
+
+    first = cache.get()
+    clock.now = 29
+    assert cache.get() is first
+    clock.now = 31
+    assert cache.get() is first
+    assert cache.loads == 1
+
+    publish(storage, predictions('2022-01-20 10:16', count=2.0))
+    clock.now = 45
+    assert cache.get() is first
+    clock.now = 62
+    second = cache.get()
+    assert cache.loads == 2
+    assert second.lookup(['kml_1'], '2022-01-20 10:30')['prediction'][0] == 2.0
+    assert second.horizons[0] == np.datetime64('2022-01-20 10:16')
+
+    clock.now = 62 + 600
+    cache.get()
+    assert cache.loads == 3
+
+
+def test_without_version_marker_reloads_on_ttl(predictions):
+    storage = SQLiteStorage()
+    storage.append('c_taxi_stand', STANDS)
+    storage.append('r_taxi_stand_pred', predictions('2022-01-20 10:15'))
+    clock = Clock()
+    cache = PredictionCache(storage, ttl=600, check_interval=30, clock=clock)
+    cache.get()
+    clock.now = 300
+    cache.get()
+    assert cache.loads == 1
+    clock.now = 601
+    cache.get()
+    assert cache.loads == 2
+
+
+def test_empty_table():
+    snapshot = PredictionSnapshot(
+        pd.DataFrame(columns=['ts_id', 'prediction', 'timestamp_pred',
+                              'latitude', 'longitude']))
+    assert snapshot.prediction_dates().empty
+    assert snapshot.lookup(['kml_1'], '2022-01-20 10:20').empty
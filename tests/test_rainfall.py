@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.replay import fixture, load_stands
+from benchmarks.stub_server import StubServer
+from taxi_compass import rainfall as rainfall_module
+from taxi_compass.feeds import rainfall_frame
+from taxi_compass.geo import haversine_km
+from taxi_compass.rainfall import (RainfallWeights, fetch_stand_rainfall,
+                                   stand_rainfall)
+from taxi_compass.storage import SQLiteStorage
+
+
+def dense_idw(ts_df, stations, k=3, power=2):
+    '''
+    Every taxi stand against every station, the k nearest weighted by
+    1 / distance**power
+    '''
+    d = haversine_km(np.deg2rad(ts_df['lat'].to_numpy())[:, None],
+                     np.deg2rad(ts_df['lon'].to_numpy())[:, None],
+                     np.deg2rad(stations['station_lat'].to_numpy()),
+                     np.deg2rad(stations['station_lon'].to_numpy()))
+    nearest = np.argsort(d, axis=1)[:, :k]
+    w = np.take_along_axis(d, nearest, axis=1)**-power
+    r = stations['rainfall'].to_numpy()[nearest]
+    return (w * r).sum(axis=1) / w.sum(axis=1)
+
+
+def snapshot():
+    stations = rainfall_frame(fixture('rainfall.json'))
+    stations['rainfall'] = np.linspace(0, 5, len(stations))
+    return stations
+
+
+def test_interpolation_matches_dense_idw():
+    ts_df, stations = load_stands(), snapshot()
+    weights = RainfallWeights.from_frames(ts_df, stations, k=3, power=2)
+    assert weights.weights.shape == (len(ts_df), len(stations))
+    assert weights.weights.nnz == 3 * len(ts_df)
+    np.testing.assert_allclose(weights.interpolate(stations),
+                               dense_idw(ts_df, stations))
+
+
+def test_missing_readings_are_left_out():
+    ts_df = pd.DataFrame({'ts_id': ['kml_1', 'kml_2'], 'lat': [1.30, 1.50],
+                          'lon': [103.80, 103.80]})
+    stations = pd.DataFrame({'station_id': ['S1', 'S2', 'S3'],
+                             'station_lat': [1.30, 1.31, 1.50],
+                             'station_lon': [103.81, 103.80, 103.80],
+                             'rainfall': [1.0, 2.0, 3.0]})
+    weights = RainfallWeights.from_frames(ts_df, stations, k=2)
+    # kml_2 sits on S3, kml_1 gets S1 and S2
+    assert weights.interpolate(stations)[1] == 3.0
+    # S2 without a reading: kml_1 only has S1 left
+    readings = stations[stations['station_id'] != 'S2']
+    np.testing.assert_allclose(weights.interpolate(readings), [1.0, 3.0])
+    readings = stations[stations['station_id'] == 'S2']
+    result = weights.interpolate(readings)
+    assert result[0] == 2.0 and np.isnan(result[1])
+
+
+def test_weights_rebuilt_only_when_stations_change(monkeypatch):
+    monkeypatch.setattr(rainfall_module, 'rainfall_weights', None)
+    ts_df, stations = load_stands(), snapshot()
+    stand_rainfall(ts_df, stations)
+    weights = rainfall_module.rainfall_weights
+    stand_rainfall(ts_df, stations.assign(rainfall=1.0))
+    assert rainfall_module.rainfall_weights is weights
+    fewer = stations.iloc[1:]
+    np.testing.assert_allclose(stand_rainfall(ts_df, fewer),
+                               dense_idw(ts_df, fewer))
+    assert rainfall_module.rainfall_weights is not weights
+
+
+def test_failing_feed_is_tried_once(monkeypatch):
+    monkeypatch.setattr(rainfall_module, 'rainfall_session', None)
+    routes = {'/rainfall': lambda query, body: (503, {'error': 'down'})}
+    with StubServer(routes) as stub:
+        assert fetch_stand_rainfall(load_stands(),
+                                    url=stub.url + '/rainfall') is None
+    # no retries: the counts of the snapshot are not held up
+    assert len(stub.requests) == 1
+
+
+def test_rainfall_column_added_to_existing_table():
+    storage = SQLiteStorage()
+    old = pd.DataFrame({'ts_id': ['kml_1'], 'taxi_count': [2],
+                        'timestamp': ['2022-01-20 10:00:00']})
+    storage.append('h_taxi_stand_taxi_count', old)
+    storage.append('h_taxi_stand_taxi_count',
+                   old.assign(timestamp='2022-01-20 10:01:00', rainfall=0.4))
+    storage.upsert('h_taxi_stand_taxi_count',
+                   old.assign(timestamp='2022-01-20 10:02:00', rainfall=0.6,
+                              lat=1.3),
+                   keys=['ts_id', 'timestamp'])
+    stored = storage.read('select * from h_taxi_stand_taxi_count')
+    assert stored['rainfall'].tolist()[1:] == [0.4, 0.6]
+    assert np.isnan(stored['rainfall'][0])
+    assert stored['lat'].tolist()[2] == 1.3
@@ -0,0 +1,102 @@
+import json
+
+import numpy as np
+import pytest
+
+from benchmarks.fake_ml_engine import FakeMLService, fake_service_factory
+from benchmarks.stub_server import StubServer
+from taxi_compass.inference import RemotePredictor, compact_instances
+
+MODEL_PATH = '/v1/projects/taxi-compass-lewagon/models/xgb:predict'
+
+
+def echo_route(failures=0, sizes=None, body_bytes=None):
+    '''
+    Fake model predicting the first value of each row (taxi_st_num), so the
+    order of the predictions can be checked. Fails the first calls with a
+    503 and records the rows and bytes of each request in sizes and
+    body_bytes.
+    '''
+    state = {'failures': failures}
+
+    def route(query, body):
+        if state['failures']:
+            state['failures'] -= 1
+            return 503, {'error': 'unavailable'}
+        instances = json.loads(body)['instances']
+        if sizes is not None:
+            sizes.append(len(instances))
+        if body_bytes is not None:
+            body_bytes.append(len(body))
+        return 200, {'predictions': [row[0] for row in instances]}
+
+    return route
+
+
+def test_compact_instances():
+    X = np.array([[12.0, 0.86602540378, 1.0], [3.0, -0.5, 0.0]],
+                 dtype=np.float32)
+    instances = compact_instances(X, decimals=3)
+    assert json.dumps(instances) == '[[12, 0.866, 1], [3, -0.5, 0]]'
+    # values under the rounding step do not collapse to 0
+    assert compact_instances([[6.1e-17, 0.12345]],
+                             decimals=3) == [[6.1e-17, 0.123]]
+    assert compact_instances(X[:0]) == []
+
+
+def test_chunks_are_sent_concurrently_and_reassembled_in_order(model_inputs):
+    sizes = []
+    X = model_inputs(1050)
+    with StubServer({MODEL_PATH: echo_route(sizes=sizes)}) as stub:
+        predictor = RemotePredictor('taxi-compass-lewagon',
+                                    None,
+                                    'xgb',
+                                    max_rows=100,
+                                    max_workers=4,
+                                    service_factory=fake_service_factory(
+                                        stub.url))
+        FakeMLService.builds = 0
+        np.testing.assert_array_equal(predictor.predict(X), np.arange(1050))
+        np.testing.assert_array_equal(predictor.predict(X), np.arange(1050))
+    assert sorted(sizes) == [50, 50] + [100] * 20
+    # one service per worker thread, reused by the second call
+    assert FakeMLService.builds <= 4
+
+
+def test_chunks_respect_max_bytes(model_inputs):
+    body_bytes = []
+    with StubServer({MODEL_PATH: echo_route(body_bytes=body_bytes)}) as stub:
+        predictor = RemotePredictor('taxi-compass-lewagon',
+                                    None,
+                                    'xgb',
+                                    max_bytes=2000,
+                                    service_factory=fake_service_factory(
+                                        stub.url))
+        predictor.predict(model_inputs(300))
+    assert len(body_bytes) > 1
+    # 17 bytes of {"instances": ...} around the rows
+    assert max(body_bytes) <= 2000 + 17
+
+
+def test_failed_chunks_are_retried(model_inputs):
+    with StubServer({MODEL_PATH: echo_route(failures=2)}) as stub:
+        predictor = RemotePredictor('taxi-compass-lewagon',
+                                    None,
+                                    'xgb',
+                                    max_workers=1,
+                                    backoff=0.01,
+                                    service_factory=fake_service_factory(
+                                        stub.url))
+        np.testing.assert_array_equal(predictor.predict(model_inputs(10)),
+                                      np.arange(10))
+
+    with StubServer({MODEL_PATH: echo_route(failures=10)}) as stub:
+        predictor = RemotePredictor('taxi-compass-lewagon',
+                                    None,
+                                    'xgb',
+                                    retries=1,
+                                    backoff=0.01,
+                                    service_factory=fake_service_factory(
+                                        stub.url))
+        with pytest.raises(Exception):
+            predictor.predict(model_inputs(10))
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from benchmarks import reference
+from benchmarks.bench_map import USER, results
+from taxi_compass.stand_map import prediction_colors, stand_features
+
+
+def test_colors_match_color_guide():
+    counts = np.arange(9)
+    assert prediction_colors(counts).tolist() == [
+        reference.color_guide(count) for count in counts
+    ]
+
+
+def test_features_carry_prediction_and_color():
+    results_df = results(50)
+    features = stand_features(results_df)['features']
+    assert len(features) == 50
+    assert [f['properties']['ts_id'] for f in features] == \
+        results_df['ts_id'].tolist()
+    assert [f['properties']['color'] for f in features] == [
+        reference.color_guide(count) for count in results_df['prediction']
+    ]
+    assert features[0]['geometry']['coordinates'] == [
+        results_df['longitude'][0], results_df['latitude'][0]
+    ]
+
+
+def test_color_follows_the_rounded_count():
+    results_df = results(3)
+    results_df['prediction'] = [0.4, 0.6, 4.4]
+    properties = [f['properties']
+                  for f in stand_features(results_df)['features']]
+    assert [p['prediction'] for p in properties] == [0, 1, 4]
+    assert [p['color'] for p in properties] == [
+        reference.color_guide(count) for count in (0, 1, 4)
+    ]
+
+
+def test_map_has_one_layer_for_all_stands():
+    pytest.importorskip('folium')
+    from taxi_compass.stand_map import stand_map
+    html = stand_map(USER, results(300)).get_root().render()
+    assert html.count('L.geoJson(') == 1
+    assert html.count('L.marker(') == 1
+    assert 'maplegend' in html
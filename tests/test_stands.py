@@ -0,0 +1,103 @@
+import json
+
+import numpy as np
+
+from benchmarks.replay import load_stands
+from taxi_compass import stands
+from taxi_compass.catalog import StandCatalog
+from taxi_compass.stands import LOCAL_TAXI_STAND_GEOJSON_PATH, StandCache
+
+
+class FakeBlob:
+    def __init__(self, payload, generation):
+        self.payload = payload
+        self.generation = generation
+        self.etag = f'etag-{generation}'
+        self.downloads = 0
+
+    def download_as_bytes(self):
+        self.downloads += 1
+        return json.dumps(self.payload).encode()
+
+
+class FakeStandCache(StandCache):
+    def __init__(self, blob, **kwargs):
+        super().__init__(**kwargs)
+        self.blob = blob
+        self.metadata_calls = 0
+
+    def get_blob(self):
+        self.metadata_calls += 1
+        if self.blob is None:
+            raise ConnectionError('no bucket')
+        return self.blob
+
+
+def geojson(*stands):
+    return {
+        'features': [{
+            'properties': {
+                'Name': name
+            },
+            'geometry': {
+                'coordinates': [lon, lat, 0.0]
+            }
+        } for name, lat, lon in stands]
+    }
+
+
+def test_warm_calls_skip_the_bucket():
+    blob = FakeBlob(geojson(('kml_1', 1.30, 103.80)), generation=1)
+    cache = FakeStandCache(blob, check_interval=3600)
+    ts_df, index = cache.get()
+    assert ts_df['ts_id'].tolist() == ['kml_1']
+    for _ in range(5):
+        assert cache.get()[1] is index
+    assert blob.downloads == 1
+    assert cache.metadata_calls == 1
+
+
+def test_reloads_only_when_generation_changes():
+    blob = FakeBlob(geojson(('kml_1', 1.30, 103.80)), generation=1)
+    cache = FakeStandCache(blob, check_interval=0)
+    _, index = cache.get()
+    assert cache.get()[1] is index
+    assert blob.downloads == 1
+
+    blob.payload = geojson(('kml_1', 1.30, 103.80), ('kml_2', 1.31, 103.81))
+    blob.generation = 2
+    blob.etag = 'etag-2'
+    ts_df, index = cache.get()
+    assert len(ts_df) == 2
+    np.testing.assert_allclose(index.lat_rad, np.deg2rad([1.30, 1.31]))
+    assert blob.downloads == 2
+
+
+def test_falls_back_to_bundled_copy():
+    cache = FakeStandCache(None, catalog_path=None)
+    ts_df, index = cache.get()
+    assert cache.version == ('local', LOCAL_TAXI_STAND_GEOJSON_PATH)
+    assert len(ts_df) == len(index) == 350
+
+
+def test_falls_back_to_bundled_catalog():
+    cache = FakeStandCache(None)
+    ts_df, index = cache.get()
+    assert cache.version[0] == 'catalog'
+    assert len(ts_df) == len(index) == 350
+
+
+def test_unchanged_bucket_json_loads_the_catalog():
+    with open(LOCAL_TAXI_STAND_GEOJSON_PATH) as f:
+        blob = FakeBlob(json.load(f), generation=1)
+    blob.md5_hash = StandCatalog().meta['geojson_md5']
+    cache = FakeStandCache(blob)
+    ts_df, _ = cache.get()
+    assert blob.downloads == 0
+    assert ts_df.equals(load_stands())
+
+
+def test_get_stand_cache_is_process_wide(monkeypatch):
+    monkeypatch.setattr(stands, 'default_stand_cache', None)
+    cache = stands.get_stand_cache()
+    assert stands.get_stand_cache() is cache
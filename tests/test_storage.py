@@ -0,0 +1,163 @@
+import datetime
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from taxi_compass.storage import SQLiteStorage
+
+KEYS = ['taxi_st_id', 'timestamp_pred']
+
+
+def upsert(storage, y_res):
+    storage.upsert('r_taxi_stand_pred',
+                   y_res,
+                   keys=KEYS,
+                   expire_column='timestamp_pred',
+                   expire_before=y_res['timestamp_pred'].min())
+
+
+def read_all(storage):
+    return storage.read('select * from r_taxi_stand_pred '
+                        'order by taxi_st_id, timestamp_pred')
+
+
+def test_upsert_updates_inserts_and_expires_past_horizons(predictions):
+    storage = SQLiteStorage()
+    upsert(storage, predictions('2022-01-20 10:00', 16))
+    assert len(read_all(storage)) == 32
+
+    # next run one minute later: 10:00 is in the past, 10:01-10:15 are
+    # predicted again (kml_1 changed), 10:16 is new
+    new = predictions('2022-01-20 10:01', 16)
+    new.loc[new['taxi_st_id'] == 'kml_1', 'taxi_count_pred'] = 3.0
+    upsert(storage, new)
+
+    result = read_all(storage)
+    assert result['timestamp_pred'].min() == '2022-01-20 10:01:00'
+    assert result['timestamp_pred'].max() == '2022-01-20 10:16:00'
+    assert len(result) == 32
+    pd.testing.assert_frame_equal(
+        result.reset_index(drop=True),
+        new.sort_values(KEYS).reset_index(drop=True))
+
+
+def test_unchanged_rows_are_not_rewritten(predictions):
+    storage = SQLiteStorage()
+    upsert(storage, predictions('2022-01-20 10:00', 16))
+    before = storage.conn.total_changes
+    upsert(storage, predictions('2022-01-20 10:00', 16))
+    staging_rows = 32
+    assert storage.conn.total_changes - before == staging_rows
+
+
+def test_shifted_rerun_writes_only_new_and_expired_rows(predictions):
+    from googlebigquery.insert_predicted_count import merge_rows
+
+    storage = SQLiteStorage()
+    merge_rows(predictions('2022-01-20 10:00', 16), storage)
+    before = storage.conn.total_changes
+    # one minute later with the same predictions: 10:16 is new for both
+    # taxi stands and 10:00 expired, 10:01-10:15 stay as they are
+    merge_rows(predictions('2022-01-20 10:01', 16), storage)
+    staging_rows, version_rows = 32, 1
+    assert storage.conn.total_changes - before == \
+        staging_rows + version_rows + 2 + 2
+    assert len(read_all(storage)) == 32
+
+
+def test_readers_never_see_an_empty_table(tmp_path, predictions):
+    path = str(tmp_path / 'warehouse.db')
+    storage = SQLiteStorage(path)
+    upsert(storage, predictions('2022-01-20 10:00', 16))
+
+    counts = []
+    done = threading.Event()
+
+    def reader():
+        reader_storage = SQLiteStorage(path)
+        while not done.is_set():
+            counts.append(
+                reader_storage.conn.execute(
+                    'select count(*) from r_taxi_stand_pred').fetchone()[0])
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    for minute in range(1, 30):
+        upsert(storage,
+               predictions(f'2022-01-20 10:{minute:02d}', 16,
+                           stands=[f'kml_{i}' for i in range(50)]))
+    done.set()
+    thread.join()
+    assert counts and min(counts) > 0
+
+
+def test_append_in_batches_keeps_columns_and_types():
+    storage = SQLiteStorage(batch_size=3)
+    df = pd.DataFrame({
+        'ts_id': [f'kml_{i}' for i in range(10)],
+        'lat': np.linspace(1.3, 1.4, 10),
+        'taxi_count': np.arange(10),
+        'timestamp': pd.date_range('2022-01-20 10:00:05', periods=10,
+                                   freq='min')
+    })
+    df.loc[3, 'lat'] = np.nan
+    assert storage.append('h_taxi_stand_taxi_count', df) == 10
+    storage.append('h_taxi_stand_taxi_count', df.head(2))
+
+    result = storage.read('select * from h_taxi_stand_taxi_count')
+    assert len(result) == 12
+    expected = df.astype({'timestamp': str})
+    expected.loc[3, 'lat'] = np.nan
+    pd.testing.assert_frame_equal(result.head(10), expected)
+    # same rows as pandas to_sql writes
+    df.to_sql('to_sql', storage.conn, index=False)
+    pd.testing.assert_frame_equal(result.head(10),
+                                  storage.read('select * from to_sql'))
+
+
+def ingest(storage, now_sg, minutes=15):
+    '''
+    What the collectors append in the last minutes, for two taxi stands
+    '''
+    times = [now_sg - datetime.timedelta(minutes=m, seconds=-20)
+             for m in range(minutes, 0, -1)]
+    storage.append('c_mrt_stn_taxi_stand',
+                   pd.DataFrame({'taxi_st_id': ['kml_1', 'kml_2'],
+                                 'mrt_stn': ['NS1', None]}))
+    for t in times:
+        storage.append('h_taxi_stand_taxi_count',
+                       pd.DataFrame({'ts_id': ['kml_1', 'kml_2'],
+                                     'lat': [1.30, 1.31],
+                                     'lon': [103.8, 103.81],
+                                     'taxi_count': [1, 3],
+                                     'timestamp': [t, t],
+                                     'rainfall': [0.2, 0.2]}))
+        storage.append('h_mrt_status_availability',
+                       pd.DataFrame({'stn_id': ['NS1'],
+                                     'final_status': [1.0],
+                                     'update_time': [str(t)]}))
+
+
+def test_ingest_predict_merge_on_sqlite(monkeypatch):
+    pytest.importorskip('xgboost')
+    from googlebigquery import insert_predicted_count
+
+    monkeypatch.setattr(insert_predicted_count, 'PREDICT_BACKEND', 'local')
+    storage = SQLiteStorage()
+    now = datetime.datetime(2022, 1, 20, 2, 0)
+    ingest(storage, now + datetime.timedelta(hours=8))
+
+    taxi_df_pred = insert_predicted_count.get_data(storage, now)
+    assert len(taxi_df_pred) == 30
+    assert taxi_df_pred['taxi_update_time'].dt.second.eq(0).all()
+    assert taxi_df_pred['rainfall'].eq(0.2).all()
+    assert taxi_df_pred.groupby('taxi_st_id')['mrt_final_status'].count(
+    ).to_dict() == {'kml_1': 15, 'kml_2': 0}
+
+    insert_predicted_count.predicted_count(storage=storage, now=now)
+    pred = read_all(storage)
+    assert len(pred) == 30
+    assert pred['timestamp_pred'].min() == '2022-01-20 10:00:00'
+    assert pred['timestamp_pred'].max() == '2022-01-20 10:14:00'
@@ -0,0 +1,99 @@
+import io
+import json
+
+import numpy as np
+
+from googlebigquery.functions.tsfinder import main as tsfinder
+
+
+class Request:
+    def __init__(self, request_json):
+        self.request_json = request_json
+
+    def get_json(self):
+        return self.request_json
+
+
+def call(request_json):
+    return tsfinder.taxi_stop_finder(Request(request_json))
+
+
+def test_single_origin_is_backward_compatible():
+    body, status = call({
+        'latitude': 1.281260,
+        'longitude': 103.8443,
+        'length': 3
+    })
+    assert status == 200
+    assert body == 'kml_1-kml_4-kml_6'
+
+
+def test_batch_matches_single_origin_calls():
+    origins = [{
+        'latitude': 1.281260,
+        'longitude': 103.8443,
+        'length': 4
+    }, {
+        'latitude': 1.3521,
+        'longitude': 103.8198,
+        'length': 2
+    }]
+    body, status, headers = call({'origins': origins})
+    assert status == 200
+    result = json.loads(body)
+    for origin, ts_ids, distances in zip(origins, result['ts_ids'],
+                                         result['distances_km']):
+        single, _ = call(origin)
+        assert ts_ids == single.split('-')
+        assert distances == sorted(distances)
+
+
+def test_batch_without_origins_has_no_results():
+    body, status, headers = call({'origins': []})
+    assert status == 200
+    assert json.loads(body) == {'ts_ids': [], 'distances_km': []}
+
+
+def test_batch_radius_only_returns_all_stands_within():
+    _, index = tsfinder.stand_cache.get()
+    body, _, _ = call({
+        'origins': [{
+            'latitude': 1.281260,
+            'longitude': 103.8443,
+            'radius_km': 0.5
+        }, {
+            'latitude': 1.281260,
+            'longitude': 103.8443,
+            'radius_km': 0.5,
+            'length': 2
+        }]
+    })
+    result = json.loads(body)
+    stand_idx, distance = index.query_knn(1.281260, 103.8443, len(index))
+    expected = index.ts_ids[stand_idx[0][distance[0] <= 0.5]].tolist()
+    assert result['ts_ids'][0] == expected
+    assert result['ts_ids'][1] == expected[:2]
+    assert np.all(np.array(result['distances_km'][0]) <= 0.5)
+
+
+def test_batch_arrow_body():
+    import pyarrow as pa
+    body, _, headers = call({
+        'format': 'arrow',
+        'origins': [{
+            'latitude': 1.281260,
+            'longitude': 103.8443,
+            'length': 3
+        }, {
+            'latitude': 1.3521,
+            'longitude': 103.8198,
+            'length': 2
+        }]
+    })
+    assert headers['Content-Type'] == 'application/vnd.apache.arrow.stream'
+    table = pa.ipc.open_stream(io.BytesIO(body)).read_all()
+    assert table.column('origin').to_pylist() == [0, 0, 0, 1, 1]
+    assert table.column('rank').to_pylist() == [0, 1, 2, 0, 1]
+    assert table.column('ts_id').to_pylist()[:3] == [
+        'kml_1', 'kml_4', 'kml_6'
+    ]
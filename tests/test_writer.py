@@ -0,0 +1,168 @@
+import os
+
+import pandas as pd
+import pytest
+
+from taxi_compass import writer as writer_module
+from taxi_compass.storage import SQLiteStorage
+from taxi_compass.writer import BufferedWriter
+
+TABLE = 'h_taxi_stand_taxi_count'
+KEYS = ['ts_id', 'timestamp']
+
+
+class CountingStorage(SQLiteStorage):
+    def __init__(self):
+        super().__init__()
+        self.loads = []
+
+    def append(self, table, df):
+        self.loads.append(('append', len(df)))
+        return super().append(table, df)
+
+    def upsert(self, table, df, keys, **kwargs):
+        self.loads.append(('upsert', len(df)))
+        return super().upsert(table, df, keys, **kwargs)
+
+
+def snapshot(minute, n_stands=350):
+    return pd.DataFrame({
+        'ts_id': [f'kml_{i}' for i in range(n_stands)],
+        'taxi_count': minute % 5,
+        'timestamp': pd.Timestamp('2022-01-20 10:00') +
+        pd.Timedelta(minutes=minute)
+    })
+
+
+def stored(storage):
+    return storage.read(f'select * from {TABLE}')
+
+
+def spooled(tmp_path):
+    return list((tmp_path / TABLE).rglob('*.parquet*'))
+
+
+def test_coalesces_snapshots_into_one_load(tmp_path):
+    storage = CountingStorage()
+    writer = BufferedWriter(TABLE, KEYS, storage, max_age=3600,
+                            max_rows=1750, spool_dir=str(tmp_path))
+    written = [writer.write(snapshot(m)) for m in range(5)]
+    assert written == [0, 0, 0, 0, 1750]
+    assert storage.loads == [('append', 1750)]
+    assert len(stored(storage)) == 1750
+    assert spooled(tmp_path) == []
+
+
+def test_flushes_when_the_oldest_snapshot_is_due(tmp_path):
+    storage = CountingStorage()
+    writer = BufferedWriter(TABLE, KEYS, storage, max_age=60,
+                            spool_dir=str(tmp_path))
+    writer.write(snapshot(0))
+    assert storage.loads == []
+    writer.oldest -= 61
+    writer.write(snapshot(1))
+    assert storage.loads == [('append', 700)]
+
+
+class CrashingStorage(CountingStorage):
+    '''
+    Loads the rows, then dies before the writer removes its spool files
+    '''
+    def append(self, table, df):
+        super().append(table, df)
+        raise SystemExit('killed')
+
+
+def test_spooled_snapshots_survive_a_crash(tmp_path):
+    storage = CrashingStorage()
+    writer = BufferedWriter(TABLE, KEYS, storage, max_age=3600,
+                            spool_dir=str(tmp_path))
+    writer.write(snapshot(0))
+    with pytest.raises(SystemExit):
+        writer.flush()
+    writer.close()
+    storage.loads.clear()
+
+    restarted = BufferedWriter(TABLE, KEYS, storage, max_age=3600,
+                               spool_dir=str(tmp_path))
+    assert restarted.rows == 350 and restarted.recovered
+    restarted.write(snapshot(1))
+    assert restarted.flush() == 700
+    assert storage.loads == [('upsert', 700)]
+    result = stored(storage)
+    assert len(result) == 700
+    assert not result.duplicated(KEYS).any()
+
+
+def test_unflushed_snapshots_of_a_clean_exit_are_appended(tmp_path):
+    storage = CountingStorage()
+    writer = BufferedWriter(TABLE, KEYS, storage, max_age=3600,
+                            spool_dir=str(tmp_path))
+    writer.write(snapshot(0))
+    writer.close()
+
+    restarted = BufferedWriter(TABLE, KEYS, storage, max_age=3600,
+                               spool_dir=str(tmp_path))
+    assert restarted.rows == 350 and not restarted.recovered
+    assert restarted.flush() == 350
+    assert storage.loads == [('append', 350)]
+    # the spool of the writer that is gone is removed with it
+    assert sorted(p.name for p in (tmp_path / TABLE).iterdir()) == sorted(
+        [os.path.basename(restarted.spool_dir),
+         os.path.basename(restarted.owner_lock.name)])
+
+
+def test_running_writers_keep_their_own_spool(tmp_path):
+    storage = CountingStorage()
+    first = BufferedWriter(TABLE, KEYS, storage, max_age=3600,
+                           spool_dir=str(tmp_path))
+    first.write(snapshot(0))
+
+    # another run of the collector while the first one still buffers
+    second = BufferedWriter(TABLE, KEYS, storage, max_age=3600,
+                            spool_dir=str(tmp_path))
+    assert second.rows == 0
+    second.write(snapshot(1))
+    assert first.flush() == 350
+    assert second.flush() == 350
+    assert storage.loads == [('append', 350), ('append', 350)]
+    assert not stored(storage).duplicated(KEYS).any()
+    assert spooled(tmp_path) == []
+
+    # once the first one is gone, what it left is picked up once
+    first.write(snapshot(2))
+    first.close()
+    third = BufferedWriter(TABLE, KEYS, storage, max_age=3600,
+                           spool_dir=str(tmp_path))
+    fourth = BufferedWriter(TABLE, KEYS, storage, max_age=3600,
+                            spool_dir=str(tmp_path))
+    assert (third.rows, fourth.rows) == (350, 0)
+    assert third.flush() == 350
+    assert len(stored(storage)) == 1050
+
+
+def test_process_wide_writers_flush_at_exit(tmp_path, monkeypatch):
+    storage = CountingStorage()
+    monkeypatch.setattr(writer_module, 'writers', {})
+    registered = []
+    monkeypatch.setattr(writer_module.atexit, 'register', registered.append)
+    writer = writer_module.get_writer(TABLE, storage=storage, max_age=3600,
+                                      spool_dir=str(tmp_path))
+    writer.write(snapshot(0))
+    assert registered == [writer_module.flush_writers]
+    writer_module.flush_writers()
+    assert storage.loads == [('append', 350)]
+    assert spooled(tmp_path) == []
+
+
+def test_memory_buffer_and_stream_mode():
+    storage = CountingStorage()
+    writer = BufferedWriter(TABLE, KEYS, storage, max_age=3600,
+                            spool_dir=None)
+    writer.write(snapshot(0))
+    assert writer.flush() == 350
+
+    streaming = BufferedWriter(TABLE, KEYS, storage, mode='stream')
+    streaming.write(snapshot(1))
+    streaming.write(snapshot(1))
+    assert len(stored(storage)) == 700